@@ -0,0 +1,65 @@
+"""
+Compare importing many small textfiles one at a time and in bulk
+
+Writes a directory of small product-description-like files, then imports
+them into a fresh database file with import_files and with
+bulk_import_files, then bulk imports them again, which skips every file
+as unchanged. Run from the repository root:
+
+    python -m benchmarks.bench_bulk_import --files 20000
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from corpusmaker.database import Database
+from corpusmaker.loader import Loader
+from loguru import logger
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch_size", type=int, default=1000)
+    args = parser.parse_args()
+
+    logger.remove()
+    rng = random.Random(0)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    with tempfile.TemporaryDirectory() as directory:
+        filenames = []
+        for index in range(args.files):
+            filename = os.path.join(directory, f"description_{index}.txt")
+            with open(filename, "w") as f:
+                f.write(" ".join(rng.choices(vocabulary, k=60)) + "\n")
+            filenames.append(filename)
+
+        bulk_loader = Loader(
+            Database(f"sqlite:///{os.path.join(directory, 'bulk.sqlite3')}")
+        )
+        serial_loader = Loader(
+            Database(f"sqlite:///{os.path.join(directory, 'serial.sqlite3')}")
+        )
+        # A rerun only stats the files, as they are unchanged since the bulk import
+        for name, loader in [
+            ("serial", serial_loader),
+            ("bulk", bulk_loader),
+            ("rerun", bulk_loader),
+        ]:
+            started_at = time.perf_counter()
+            if name == "serial":
+                loader.import_files(filenames)
+            else:
+                loader.bulk_import_files(
+                    filenames, workers=args.workers, batch_size=args.batch_size
+                )
+            seconds = time.perf_counter() - started_at
+            print(f"{name:>8} {seconds:8.2f}s {args.files / seconds:10.0f} files/s")
+
+
+if __name__ == "__main__":
+    main()
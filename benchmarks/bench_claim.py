@@ -0,0 +1,60 @@
+"""
+Benchmark claiming scenes for a worker as more of the corpus is summarized
+
+Builds a database file of scenes, marks a growing fraction of them as
+summarized, and times claim_scenes at each stage. A claim holds the write
+lock, so its time bounds how many workers can share one database. Run from
+the repository root:
+
+    python -m benchmarks.bench_claim --scenes 300000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from corpusmaker.database import Database
+from corpusmaker.model import RawText, Scene, SceneStatus
+from loguru import logger
+from sqlalchemy import insert, update
+from sqlmodel import Session, col
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scenes", type=int, default=300000)
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--claims", type=int, default=20)
+    args = parser.parse_args()
+
+    logger.remove()
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(f"sqlite:///{os.path.join(directory, 'claim.sqlite3')}")
+        with Session(db.engine) as session:
+            session.add(RawText(content="", checksum="raw text"))
+            session.commit()
+            session.execute(
+                insert(Scene),
+                [
+                    {"content": f"Scene {index}", "checksum": str(index), "text_id": 1}
+                    for index in range(args.scenes)
+                ],
+            )
+            session.commit()
+            for fraction in [0.0, 0.5, 0.9, 0.99]:
+                session.execute(
+                    update(Scene)
+                    .where(col(Scene.id) <= int(args.scenes * fraction))
+                    .values(summary="Summary", status=SceneStatus.DONE)
+                )
+                session.commit()
+                started_at = time.perf_counter()
+                for index in range(args.claims):
+                    db.claim_scenes(session, f"worker {index}", args.count, 600)
+                seconds = (time.perf_counter() - started_at) / args.claims
+                print(f"{fraction:6.0%} summarized {seconds * 1000:8.2f}ms per claim")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark scene creation with different numbers of worker processes
+
+Builds a synthetic corpus of many texts, then times `create_scenes` on a fresh
+in-memory database for each worker count and reports the speedup over one
+worker. Run from the repository root:
+
+    python -m benchmarks.bench_create_scenes --texts 200 --words 100000
+"""
+
+import argparse
+import os
+import random
+import time
+
+from corpusmaker.database import Database
+from corpusmaker.model import RawText
+from loguru import logger
+from sqlmodel import Session
+
+WORDS = ["the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog", "again"]
+
+
+def make_text(rng: random.Random, words: int) -> str:
+    lines = []
+    while words > 0:
+        length = min(words, rng.randint(5, 40))
+        lines.append(" ".join(rng.choices(WORDS, k=length)))
+        words -= length
+    return "\n".join(lines)
+
+
+def make_corpus(texts: int, words: int) -> list[str]:
+    rng = random.Random(0)
+    return [make_text(rng, words) for _ in range(texts)]
+
+
+def time_create_scenes(corpus: list[str], word_limit: int, workers: int) -> float:
+    db = Database("sqlite://")
+    with Session(db.engine) as session:
+        for content in corpus:
+            db.create_raw_text(session, RawText(content=content))
+        text_ids = list(range(1, len(corpus) + 1))
+        started_at = time.perf_counter()
+        if workers > 1:
+            db.create_scenes_in_parallel(session, text_ids, word_limit, workers)
+        else:
+            for text_id in text_ids:
+                db.create_scenes(session, text_id, word_limit)
+        return time.perf_counter() - started_at
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--texts", type=int, default=64)
+    parser.add_argument("--words", type=int, default=100000)
+    parser.add_argument("--word-limit", type=int, default=8000)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1]
+    )
+    args = parser.parse_args()
+
+    logger.remove()
+    corpus = make_corpus(args.texts, args.words)
+    print(f"{args.texts} texts of {args.words} words on {os.cpu_count()} cores")
+    baseline = None
+    for workers in sorted(set(args.workers)):
+        seconds = time_create_scenes(corpus, args.word_limit, workers)
+        baseline = baseline or seconds
+        print(
+            f"workers={workers:<3} {seconds:8.2f}s  speedup {baseline / seconds:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compare database profiles on the ingest and export paths
+
+For each profile, imports a directory of small files one at a time into a
+fresh database file, chunks them into scenes, stores a summary for every
+scene, and exports them to JSONL. Statements logged by the debug profile
+are written to /dev/null, so only the cost of formatting them is counted.
+Run from the repository root:
+
+    python -m benchmarks.bench_db_profile --files 2000
+"""
+
+import argparse
+import contextlib
+import os
+import random
+import tempfile
+import time
+
+from corpusmaker.cli import Cli
+from loguru import logger
+from sqlmodel import Session, select
+from corpusmaker.model import Scene
+
+
+def time_profile(directory: str, profile: str, pattern: str) -> list[float]:
+    cli = Cli(f"sqlite:///{os.path.join(directory, profile)}.sqlite3", profile)
+    timings = []
+    started_at = time.perf_counter()
+    cli.import_files([pattern])
+    timings.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    cli.create_scenes(word_limit=20)
+    with Session(cli.db.engine) as session:
+        scene_ids = list(session.exec(select(Scene.id)))
+        cli.db.update_summaries(
+            session,
+            {scene_id: f"Summary {scene_id}" for scene_id in scene_ids if scene_id},
+        )
+    timings.append(time.perf_counter() - started_at)
+
+    system_prompt_file = os.path.join(directory, "system_prompt.txt")
+    with open(system_prompt_file, "w") as f:
+        f.write("You write product descriptions.")
+    started_at = time.perf_counter()
+    cli.export_summaries(
+        system_prompt_file, os.path.join(directory, f"{profile}.jsonl")
+    )
+    timings.append(time.perf_counter() - started_at)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=1000)
+    args = parser.parse_args()
+
+    logger.remove()
+    rng = random.Random(0)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for index in range(args.files):
+            filename = os.path.join(directory, f"description_{index}.txt")
+            with open(filename, "w") as f:
+                for _ in range(5):
+                    f.write(" ".join(rng.choices(vocabulary, k=15)) + "\n")
+        pattern = os.path.join(directory, "description_*.txt")
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for profile in ["debug", "safe", "bulk"]:
+                results[profile] = time_profile(directory, profile, pattern)
+
+    print(f"{'profile':>8} {'import':>9} {'scenes':>9} {'export':>9}")
+    for profile, (imported, scenes, exported) in results.items():
+        print(f"{profile:>8} {imported:8.2f}s {scenes:8.2f}s {exported:8.2f}s")
+
+
+if __name__ == "__main__":
+    main()
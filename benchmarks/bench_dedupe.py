@@ -0,0 +1,80 @@
+"""
+Benchmark near-duplicate detection as the number of scenes grows
+
+Builds corpora of random scenes in which a fraction are lightly edited
+copies of earlier ones, dedupes each on a fresh in-memory database, and
+reports throughput, how close the work is to linear, and how many of the
+copies were found. Run from the repository root:
+
+    python -m benchmarks.bench_dedupe --scenes 2000 4000 8000
+"""
+
+import argparse
+import random
+import time
+
+from corpusmaker.database import Database
+from corpusmaker.deduper import Deduper
+from corpusmaker.model import RawText, Scene
+from loguru import logger
+from sqlmodel import Session, col, select
+
+
+def make_corpus(
+    scenes: int, words: int, copies: float, rng: random.Random
+) -> tuple[list[str], set[int]]:
+    """
+    Random scenes, and the positions of those that are edited copies
+    """
+    vocabulary = [f"word{i}" for i in range(20000)]
+    corpus: list[str] = []
+    copied = set()
+    for index in range(scenes):
+        if corpus and rng.random() < copies:
+            scene = corpus[rng.randrange(len(corpus))].split(" ")
+            for _ in range(len(scene) // 100):
+                scene[rng.randrange(len(scene))] = "edited"
+            corpus.append(" ".join(scene))
+            copied.add(index)
+        else:
+            corpus.append(" ".join(rng.choices(vocabulary, k=words)))
+    return corpus, copied
+
+
+def time_dedupe(corpus: list[str], copied: set[int], workers: int) -> None:
+    db = Database("sqlite://")
+    with Session(db.engine) as session:
+        raw_text = RawText(content="\n***\n".join(corpus), separator="***")
+        db.create_raw_text(session, raw_text)
+        assert raw_text.id
+        db.create_scenes(session, raw_text.id, 100000)
+        started_at = time.perf_counter()
+        checked, found = Deduper(db, workers=workers).run(session)
+        seconds = time.perf_counter() - started_at
+        statement = select(Scene.id).where(col(Scene.duplicate_of).is_not(None))
+        marked = {scene_id - 1 for scene_id in session.exec(statement) if scene_id}
+    recall = len(marked & copied) / len(copied) if copied else 1.0
+    print(
+        f"{checked:>8} scenes {seconds:8.2f}s {checked / seconds:10.0f} scenes/s"
+        f"  {seconds / checked * 1e6:8.0f}us/scene"
+        f"  copies found {recall:6.1%}  false matches {len(marked - copied)}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scenes", type=int, nargs="+", default=[1000, 2000, 4000])
+    parser.add_argument("--words", type=int, default=500)
+    parser.add_argument("--copies", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    logger.remove()
+    rng = random.Random(0)
+    for scenes in args.scenes:
+        corpus, copied = make_corpus(scenes, args.words, args.copies, rng)
+        time_dedupe(corpus, copied, args.workers)
+
+
+if __name__ == "__main__":
+    main()
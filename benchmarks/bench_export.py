@@ -0,0 +1,87 @@
+"""
+Benchmark JSONL export throughput in records per second
+
+Exports synthetic prompt-completion pairs with json.dump, as export used to,
+and with the Exporter's fast path, and checks that both files are identical.
+Run from the repository root:
+
+    python -m benchmarks.bench_export --records 200000
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from corpusmaker.exporter import Exporter, encode_string_ascii
+from loguru import logger
+
+WORDS = ["the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog", "café"]
+
+
+def make_pcps(records: int, words: int) -> list[dict[str, str]]:
+    rng = random.Random(0)
+    return [
+        {
+            "prompt": "SUMMARY: " + " ".join(rng.choices(WORDS, k=words // 10)),
+            "completion": "\n".join(
+                " ".join(rng.choices(WORDS, k=10)) for _ in range(words // 10)
+            ),
+        }
+        for _ in range(records)
+    ]
+
+
+def export_with_json_dump(
+    exporter: Exporter, pcps: list[dict[str, str]], filename: Path
+) -> None:
+    with open(filename, "w", encoding="utf-8-sig") as f:
+        for pcp in pcps:
+            json.dump(exporter.convert_pcp_to_chat_completion_jsonline(pcp), f)
+            f.write("\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--words", type=int, default=300)
+    args = parser.parse_args()
+
+    logger.remove()
+    pcps = make_pcps(args.records, args.words)
+    system_prompt = "You write short summaries of scenes.\nBe concise."
+    with tempfile.TemporaryDirectory() as directory:
+        files: dict[str, bytes] = {}
+        runs = [
+            ("json.dump", None),
+            (
+                "fast, json module",
+                Exporter(system_prompt, "", encode_string=encode_string_ascii),
+            ),
+            ("fast, default encoder", Exporter(system_prompt, "")),
+        ]
+        for name, exporter in runs:
+            filename = Path(directory) / f"{len(files)}.jsonl"
+            started_at = time.perf_counter()
+            if exporter:
+                exporter.filename = str(filename)
+                exporter.export_pcps_to_jsonl(pcps)
+            else:
+                export_with_json_dump(Exporter(system_prompt, ""), pcps, filename)
+            seconds = time.perf_counter() - started_at
+            files[name] = filename.read_bytes()
+            size = os.path.getsize(filename) / 1e6
+            print(
+                f"{name:<22} {args.records / seconds:12,.0f} records/s"
+                f"  {size / seconds:8.1f} MB/s"
+            )
+        baseline = files["json.dump"]
+        assert all(output == baseline for output in files.values())
+        print("Outputs are byte-identical")
+
+
+if __name__ == "__main__":
+    main()
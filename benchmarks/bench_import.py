@@ -0,0 +1,88 @@
+"""
+Compare peak memory and time of importing a large textfile whole and in blocks
+
+Writes a textfile of the given size, then imports it into a fresh database
+file by reading it whole and by streaming it a block at a time, under each
+database profile. Each import runs in its own process, and peak memory is
+the growth of its peak resident set size (RSS) during the import, which
+includes SQLite's own allocations. Run from the repository root:
+
+    python -m benchmarks.bench_import --megabytes 300
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from corpusmaker.database import Database
+from corpusmaker.loader import Loader
+from loguru import logger
+from sqlmodel import Session
+
+
+def peak_rss() -> int:
+    """
+    The peak resident set size of this process in bytes
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_import(method: str, profile: str, filename: str, db_file: str) -> None:
+    logger.remove()
+    db = Database(f"sqlite:///{db_file}", profile)
+    loader = Loader(db)
+    before = peak_rss()
+    started_at = time.perf_counter()
+    if method == "whole":
+        raw_text = loader.read_file(filename)
+        assert raw_text
+        with Session(db.engine) as session:
+            db.create_raw_text(session, raw_text)
+    else:
+        loader.import_file(filename)
+    seconds = time.perf_counter() - started_at
+    growth = (peak_rss() - before) / (1 << 20)
+    print(
+        f"{method:>8} {profile:>6} {seconds:8.2f}s  peak RSS growth {growth:8.1f} MiB"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--megabytes", type=int, default=100)
+    parser.add_argument("--child", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_import(*args.child)
+        return
+
+    line = "Some words of a scene, and some more words. " * 20 + "\n"
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "large.txt")
+        with open(filename, "w") as f:
+            for _ in range(args.megabytes * (1 << 20) // len(line)):
+                f.write(line)
+        for method in ["whole", "blocks"]:
+            for profile in ["safe", "bulk"]:
+                db_file = os.path.join(directory, f"{method}-{profile}.sqlite3")
+                subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "benchmarks.bench_import",
+                        "--child",
+                        method,
+                        profile,
+                        filename,
+                        db_file,
+                    ],
+                    check=True,
+                )
+
+
+if __name__ == "__main__":
+    main()
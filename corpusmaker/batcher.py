@@ -0,0 +1,117 @@
+"""
+Batch API operations for Corpusmaker
+"""
+
+from typing import Iterable, Iterator
+
+from dataclasses import dataclass
+from pathlib import Path
+import json
+from sqlmodel import Session
+from corpusmaker.database import Database
+from corpusmaker.model import Scene
+from loguru import logger
+
+
+@dataclass
+class Batcher:
+    system_prompt: str = ""
+    model: str = ""
+    shard_size: int = 50000
+    shard_bytes: int = 100_000_000
+
+    def make_request(self, scene: Scene) -> dict[str, object]:
+        return {
+            "custom_id": str(scene.id),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model,
+                "messages": [
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": scene.content},
+                ],
+            },
+        }
+
+    def write_requests(self, scenes: Iterable[Scene], directory: str) -> list[str]:
+        """
+        Write scenes as batch requests, starting a new shard whenever the
+        current one reaches `shard_size` requests or `shard_bytes` bytes
+        """
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        filenames: list[str] = []
+        count = size = 0
+        f = None
+        try:
+            for scene in scenes:
+                line = (json.dumps(self.make_request(scene)) + "\n").encode("utf-8")
+                if f is None or count >= self.shard_size or size >= self.shard_bytes:
+                    if f:
+                        f.close()
+                    filenames.append(
+                        str(Path(directory) / f"batch_{len(filenames):05d}.jsonl")
+                    )
+                    f = open(filenames[-1], "wb")
+                    count = size = 0
+                f.write(line)
+                count += 1
+                size += len(line)
+        finally:
+            if f:
+                f.close()
+        logger.info(f"Wrote {len(filenames)} batch request files to {directory}")
+        return filenames
+
+    def read_results(self, filename: str) -> Iterator[tuple[int, str]]:
+        """
+        Stream (scene ID, summary) pairs from a batch results file,
+        skipping requests that failed
+        """
+        with open(filename, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code") != 200:
+                    logger.error(
+                        f"Request {result.get('custom_id')} failed: {result.get('error')}"
+                    )
+                    continue
+                try:
+                    scene_id = int(result.get("custom_id"))
+                except (TypeError, ValueError):
+                    logger.error(
+                        f"Skipping result with invalid custom_id: {result.get('custom_id')!r}"
+                    )
+                    continue
+                summary = response["body"]["choices"][0]["message"]["content"]
+                yield scene_id, str(summary)
+
+    def ingest_results(
+        self, db: Database, session: Session, filename: str, batch_size: int = 5000
+    ) -> int:
+        """
+        Store the summaries from a batch results file, committing every
+        `batch_size` results, and return the number stored. Results for
+        scenes that no longer exist, e.g. because they were deleted after
+        the requests were written, are logged and skipped.
+        """
+        logger.info(f"Ingesting batch results from {filename}")
+        summaries: dict[int, str] = {}
+        total = skipped = 0
+        for scene_id, summary in self.read_results(filename):
+            summaries[scene_id] = summary
+            if len(summaries) >= batch_size:
+                stored = db.update_summaries(session, summaries)
+                total += stored
+                skipped += len(summaries) - stored
+                summaries = {}
+        stored = db.update_summaries(session, summaries)
+        total += stored
+        skipped += len(summaries) - stored
+        if skipped:
+            logger.error(f"Skipped {skipped} results for scenes that do not exist")
+        logger.info(f"Ingested {total} summaries from {filename}")
+        return total
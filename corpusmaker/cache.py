@@ -0,0 +1,114 @@
+"""
+Summary cache operations for Corpusmaker
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from hashlib import sha256
+from sqlalchemy import and_, delete, func, tuple_, update
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, col, create_engine, select
+from corpusmaker.model import CacheModel, CachedSummary
+from loguru import logger
+
+BATCH_SIZE = 500
+
+
+@dataclass
+class SummaryCache:
+    """
+    Summaries keyed by (model, system prompt digest, scene checksum), kept
+    in their own SQLite file so they survive rebuilding the corpus database
+    """
+
+    pathname: str = "sqlite:///data/summary_cache.sqlite3"
+    max_entries: int = 100000
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+    writes: int = field(default=0, init=False)
+
+    def __post_init__(self) -> None:
+        self.engine: Engine = create_engine(self.pathname)
+        CacheModel.metadata.create_all(self.engine)
+
+    @staticmethod
+    def digest(system_prompt: str) -> str:
+        return sha256(system_prompt.encode("utf-8")).hexdigest()
+
+    def get_many(
+        self, model: str, prompt_digest: str, checksums: list[str]
+    ) -> dict[str, str]:
+        """
+        Look up cached summaries for many scenes, returning them by checksum
+        """
+        found: dict[str, str] = {}
+        with Session(self.engine) as session:
+            for i in range(0, len(checksums), BATCH_SIZE):
+                batch = checksums[i : i + BATCH_SIZE]
+                condition = and_(
+                    col(CachedSummary.model) == model,
+                    col(CachedSummary.prompt_digest) == prompt_digest,
+                    col(CachedSummary.checksum).in_(batch),
+                )
+                for entry in session.exec(select(CachedSummary).where(condition)):
+                    found[entry.checksum] = entry.summary
+                session.execute(
+                    update(CachedSummary)
+                    .where(condition)
+                    .values(used_at=datetime.now(timezone.utc))
+                )
+            session.commit()
+        self.hits += len(found)
+        self.misses += len(set(checksums)) - len(found)
+        return found
+
+    def put_many(
+        self, model: str, prompt_digest: str, summaries: dict[str, str]
+    ) -> None:
+        """
+        Store summaries by checksum, replacing any older ones under the same key
+        """
+        with Session(self.engine) as session:
+            for checksum, summary in summaries.items():
+                session.merge(
+                    CachedSummary(
+                        model=model,
+                        prompt_digest=prompt_digest,
+                        checksum=checksum,
+                        summary=summary,
+                    )
+                )
+            session.commit()
+        before = self.writes
+        self.writes += len(summaries)
+        if before // 1000 != self.writes // 1000:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Drop the least recently used summaries beyond `max_entries`
+        """
+        with Session(self.engine) as session:
+            count = session.exec(select(func.count()).select_from(CachedSummary)).one()
+            excess = count - self.max_entries
+            if excess > 0:
+                key = tuple_(
+                    col(CachedSummary.model),
+                    col(CachedSummary.prompt_digest),
+                    col(CachedSummary.checksum),
+                )
+                oldest = (
+                    select(
+                        CachedSummary.model,
+                        CachedSummary.prompt_digest,
+                        CachedSummary.checksum,
+                    )
+                    .order_by(col(CachedSummary.used_at))
+                    .limit(excess)
+                )
+                session.execute(delete(CachedSummary).where(key.in_(oldest)))
+                session.commit()
+                logger.info(f"Evicted {excess} summaries from cache")
+
+    def report(self) -> None:
+        logger.info(f"Summary cache: {self.hits} hits, {self.misses} misses")
@@ -0,0 +1,206 @@
+"""
+Chunking operations for Corpusmaker
+"""
+
+from typing import Iterator, Optional
+
+from dataclasses import dataclass
+from hashlib import md5
+import re
+
+SceneRecord = tuple[int, int, int, int, bool, str, str]
+
+
+@dataclass
+class Chunker:
+    """
+    Split text into scenes in a single pass, as (start, end) spans of the content
+
+    Algorithm:
+    - Split content by separator (newline by default)
+    - For each section of content:
+      - If it is under the word limit and there is no separator:
+        - Add as many next sections as we can
+        - Stop before it's over the limit
+      - If it is over the word limit:
+        - Split the section in half by word
+        - Keep doing that until the subsections are under the limit
+
+    Words are counted as the spaces in a section plus one, so no word lists
+    are built. Sections are stripped of surrounding whitespace and empty ones
+    are skipped. A scene made of several sections is their text joined by
+    single spaces; every other scene is exactly its span of the content.
+    """
+
+    content: str
+    separator: str = ""
+    use_regex: bool = False
+    word_limit: int = 8000
+
+    def __post_init__(self) -> None:
+        self.merge = not self.separator
+        self.pattern = re.compile(self.separator) if self.use_regex else None
+
+    def strip(self, start: int, end: int) -> Optional[tuple[int, int]]:
+        """
+        Narrow a span to exclude surrounding whitespace, or None if nothing is left
+        """
+        section = self.content[start:end]
+        stripped = section.lstrip()
+        if not stripped:
+            return None
+        start += len(section) - len(stripped)
+        return start, start + len(stripped.rstrip())
+
+    def raw_sections(self, start: int, end: int) -> Iterator[tuple[int, int]]:
+        """
+        The spans that splitting content[start:end] by the separator would produce
+        """
+        if self.pattern:
+            position = start
+            for match in self.pattern.finditer(self.content, start, end):
+                yield position, match.start()
+                # Like re.split, include the text of any groups in the pattern
+                for group in range(1, self.pattern.groups + 1):
+                    group_start, group_end = match.span(group)
+                    if group_start != -1:
+                        yield group_start, group_end
+                position = match.end()
+            yield position, end
+        else:
+            separator = self.separator or "\n"
+            position = start
+            while (found := self.content.find(separator, position, end)) != -1:
+                yield position, found
+                position = found + len(separator)
+            yield position, end
+
+    def sections(
+        self, start: int = 0, end: Optional[int] = None
+    ) -> Iterator[tuple[int, int, int]]:
+        """
+        The stripped, non-empty sections of the content as (start, end, words)
+        """
+        end = len(self.content) if end is None else end
+        for raw_start, raw_end in self.raw_sections(start, end):
+            span = self.strip(raw_start, raw_end)
+            if span:
+                yield span[0], span[1], self.content.count(" ", *span) + 1
+
+    def split(self, start: int, end: int, words: int) -> Iterator[tuple[int, int]]:
+        """
+        Split a section into equal runs of words, halving the run length until
+        it is within the word limit
+        """
+        chunk_length = words
+        while chunk_length > self.word_limit:
+            chunk_length = -(-chunk_length // 2)
+        if chunk_length == words:
+            yield start, end
+            return
+        chunk_start = position = start
+        count = 0
+        while (found := self.content.find(" ", position, end)) != -1:
+            count += 1
+            position = found + 1
+            if count == chunk_length:
+                yield chunk_start, found
+                chunk_start = position
+                count = 0
+        yield chunk_start, end
+
+    def spans(self) -> Iterator[tuple[int, int]]:
+        """
+        The (start, end) span of each scene, in order
+        """
+        sections = self.sections()
+        current = next(sections, None)
+        merged_start: Optional[int] = None
+        merged_words = 0
+        while current:
+            upcoming = next(sections, None)
+            start, end, words = current
+            if merged_start is not None:
+                start = merged_start
+                words += merged_words
+                merged_start = None
+            if (
+                self.merge
+                and words < self.word_limit
+                and upcoming
+                and words + upcoming[2] < self.word_limit
+            ):
+                merged_start, merged_words = start, words
+            else:
+                yield from self.split(start, end, words)
+            current = upcoming
+
+    def text(self, start: int, end: int) -> str:
+        """
+        The text of the scene with the given span
+        """
+        if self.merge:
+            pieces = [
+                self.content[section_start:section_end]
+                for section_start, section_end, _ in self.sections(start, end)
+            ]
+            if len(pieces) > 1:
+                return " ".join(pieces)
+        return self.content[start:end]
+
+    def scenes(self) -> Iterator[tuple[int, int, str]]:
+        """
+        The span and text of each scene, in order
+        """
+        for start, end in self.spans():
+            yield start, end, self.text(start, end)
+
+    def records(self) -> Iterator[SceneRecord]:
+        """
+        Each scene as (start, end, start_byte, end_byte, joined, content,
+        checksum), for storing
+
+        The byte offsets are those of the span in the UTF-8 content, so the
+        span can be read without the rest of the raw text. A scene merged
+        from several lines is marked as joined, since span_text can rebuild
+        it from its span. Content is only kept for scenes that cannot be
+        rebuilt from their span, which are those merged from the sections of
+        a regex separator that matches the empty string.
+        """
+        position = byte_position = 0
+        for start, end, text in self.scenes():
+            span = self.content[start:end]
+            start_byte = byte_position + utf8_length(self.content[position:start])
+            end_byte = start_byte + utf8_length(span)
+            position, byte_position = end, end_byte
+            joined = text != span
+            content = text if joined and self.pattern else ""
+            checksum = md5(text.encode("utf-8")).hexdigest()
+            yield start, end, start_byte, end_byte, joined, content, checksum
+
+
+def utf8_length(text: str) -> int:
+    """
+    The number of bytes in the UTF-8 encoding of a text
+    """
+    return len(text.encode("utf-8"))
+
+
+def span_text(content: str, start: int, end: int, joined: bool = False) -> str:
+    """
+    The text of a scene stored as a span of its raw text, which only
+    depends on the content within the span
+    """
+    if joined:
+        return Chunker(content[start:end]).text(0, end - start)
+    return content[start:end]
+
+
+def chunk_text(
+    content: str, separator: str, use_regex: bool, word_limit: int
+) -> list[SceneRecord]:
+    """
+    The records of each scene of a text, compact enough to send back from a
+    worker process
+    """
+    return list(Chunker(content, separator, use_regex, word_limit).records())
@@ -3,65 +3,233 @@ CLI operations for Corpusmaker
 """
 
 from dataclasses import dataclass, field
+from corpusmaker.batcher import Batcher
+from corpusmaker.cache import SummaryCache
 from corpusmaker.database import Database
+from corpusmaker.deduper import Deduper
 from corpusmaker.exporter import Exporter
 from corpusmaker.loader import Loader
+from corpusmaker.planner import Planner
 from corpusmaker.model import RawText, Scene
+from corpusmaker.ratelimiter import RateLimiter
 from corpusmaker.requester import Requester
+from corpusmaker.summarizer import Summarizer
+from corpusmaker.telemetry import Telemetry
 from loguru import logger
 from sqlmodel import Session, select, not_, col
-from datetime import datetime
-from pathlib import Path
+from datetime import datetime, timezone
+from itertools import chain
+from glob import glob
 
 
 @dataclass
 class Cli:
     db_file: str = "sqlite:///data/corpus.sqlite3"
+    db_profile: str = "safe"
+    base_url: str = ""
+    timeout: float = 600.0
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
     db: Database = field(init=False)
 
     def __post_init__(self) -> None:
-        self.db = Database(self.db_file)
+        self.db = Database(self.db_file, self.db_profile)
         logger.info(f"Initialized database at {self.db_file}")
 
     def import_files(
-        self, filenames: list[str], separator: str = "", use_regex: bool = False
+        self,
+        filenames: list[str],
+        separator: str = "",
+        use_regex: bool = False,
+        bulk: bool = False,
+        workers: int = 8,
+        batch_size: int = 1000,
     ) -> None:
         loader = Loader(self.db)
-        filename_list = []
-        for filename in filenames:
-            filename_list.extend([str(f) for f in Path(".").glob(filename)])
-        loader.import_files(filename_list, separator, use_regex)
+        # Expand every pattern once, keeping the first match of each file
+        filename_list = list(
+            dict.fromkeys(
+                filename
+                for pattern in filenames
+                for filename in sorted(glob(pattern, recursive=True))
+            )
+        )
+        if bulk:
+            loader.bulk_import_files(
+                filename_list, separator, use_regex, workers, batch_size
+            )
+        else:
+            loader.import_files(filename_list, separator, use_regex)
 
-    def create_scenes(self, word_limit: int = 8000) -> None:
+    def create_scenes(self, word_limit: int = 8000, workers: int = 1) -> None:
         with Session(self.db.engine) as session:
-            statement = select(RawText).where(
+            statement = select(RawText.id).where(
                 not_(col(RawText.id).in_(select(Scene.text_id)))
             )
-            results = session.execute(statement).all()
+            text_ids = list(session.execute(statement).scalars())
+
+            if workers > 1:
+                added, skipped = self.db.create_scenes_in_parallel(
+                    session, text_ids, word_limit, workers
+                )
+            else:
+                added = skipped = 0
+                for text_id in text_ids:
+                    text_added, text_skipped = self.db.create_scenes(
+                        session=session, text_id=text_id, word_limit=word_limit
+                    )
+                    added += text_added
+                    skipped += text_skipped
+            logger.info(f"Created {added} scenes, skipped {skipped} duplicates")
+
+    def dedupe_scenes(
+        self,
+        threshold: float = 0.8,
+        num_perm: int = 128,
+        bands: int = 16,
+        shingle_size: int = 5,
+        batch_size: int = 1000,
+        workers: int = 1,
+    ) -> None:
+        deduper = Deduper(
+            self.db, threshold, num_perm, bands, shingle_size, batch_size, workers
+        )
+        with Session(self.db.engine) as session:
+            checked, found = deduper.run(session)
+        logger.info(f"Checked {checked} scenes, marked {found} as near-duplicates")
 
-            for result in results:
-                self.db.create_scenes(
-                    session=session, text_id=result.RawText.id, word_limit=word_limit
+    def plan(
+        self,
+        system_prompt_file: str = "data/summarizing_system_prompt.txt",
+        model: str = "gpt-3.5-turbo",
+        input_price: float = 0.5,
+        output_price: float = 1.5,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        concurrency: int = 1,
+        latency: float = 10.0,
+        completion_tokens: int = 256,
+    ) -> None:
+        with open(system_prompt_file) as f:
+            system_prompt = f.read()
+        planner = Planner(system_prompt, model, completion_tokens=completion_tokens)
+        with Session(self.db.engine) as session:
+            planner.report(
+                planner.plan(
+                    self.db.iter_unsummarized_contents(session),
+                    input_price,
+                    output_price,
+                    requests_per_minute,
+                    tokens_per_minute,
+                    concurrency,
+                    latency,
                 )
+            )
+
+    def _make_requester(
+        self,
+        system_prompt_file: str,
+        model: str,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+    ) -> Requester:
+        with open(system_prompt_file) as f:
+            system_prompt = f.read()
+        limiter = None
+        if requests_per_minute or tokens_per_minute:
+            limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        return Requester(
+            system_prompt,
+            model,
+            limiter,
+            Telemetry(self.db),
+            base_url=self.base_url,
+            timeout=self.timeout,
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+        )
 
     def summarize_scenes(
         self,
         system_prompt_file: str = "data/summarizing_system_prompt.txt",
         model: str = "gpt-3.5-turbo",
+        concurrency: int = 1,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        cache_file: str = "",
+        cache_size: int = 100000,
+        mode: str = "online",
+        batch_dir: str = "data/batches",
+        shard_size: int = 50000,
+        lease_seconds: float = 0,
+        claim_size: int = 100,
+        write_batch_size: int = 100,
+        flush_interval: float = 1.0,
     ) -> None:
+        if mode not in ("online", "batch"):
+            raise Exception(f"Unknown summarization mode: {mode}")
+        leased = bool(lease_seconds) and mode == "online"
         with Session(self.db.engine) as session:
-            scenes = self.db.find_scenes_without_summaries(session)
+            scenes = []
+            if not leased:
+                scenes = self.db.find_scenes_without_summaries(session)
+                if not scenes:
+                    logger.info("No scenes need summarizing")
+                    return
+            requester = self._make_requester(
+                system_prompt_file, model, requests_per_minute, tokens_per_minute
+            )
+            if mode == "batch":
+                batcher = Batcher(requester.system_prompt, model, shard_size)
+                batcher.write_requests(scenes, batch_dir)
+                return
+            cache = None
+            if cache_file:
+                cache = SummaryCache(cache_file, cache_size)
+            summarizer = Summarizer(
+                self.db,
+                requester,
+                concurrency,
+                cache,
+                write_batch_size=write_batch_size,
+                flush_interval=flush_interval,
+            )
+            if leased:
+                summarizer.run_leased(session, claim_size, lease_seconds)
+            else:
+                summarizer.run(session, scenes)
+
+    def retry_failed(
+        self,
+        system_prompt_file: str = "data/summarizing_system_prompt.txt",
+        model: str = "gpt-3.5-turbo",
+        concurrency: int = 1,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+    ) -> None:
+        with Session(self.db.engine) as session:
+            scenes = self.db.find_failed_scenes(session)
             if scenes:
-                with open(system_prompt_file) as f:
-                    system_prompt = f.read()
-                requester = Requester(system_prompt, model)
-                for scene in scenes:
-                    if scene.id:
-                        self.db.update_summary(
-                            session, scene.id, requester.generate_summary(scene.content)
-                        )
+                requester = self._make_requester(
+                    system_prompt_file, model, requests_per_minute, tokens_per_minute
+                )
+                summarizer = Summarizer(self.db, requester, concurrency)
+                summarizer.run(session, scenes)
             else:
-                logger.info("No scenes need summarizing")
+                logger.info("No failed scenes to retry")
+
+    def ingest_batch_results(self, results_files: list[str]) -> None:
+        with Session(self.db.engine) as session:
+            batcher = Batcher()
+            for results_file in results_files:
+                batcher.ingest_results(self.db, session, results_file)
+
+    def stats(
+        self, input_price: float = 0.5, output_price: float = 1.5, model: str = ""
+    ) -> None:
+        with Session(self.db.engine) as session:
+            telemetry = Telemetry(self.db)
+            telemetry.report(telemetry.stats(session, input_price, output_price, model))
 
     def export_summaries(
         self,
@@ -69,10 +237,55 @@ class Cli:
         export_file: str = f"data/scenes_{datetime.today().strftime('%Y-%m-%dT%H:%M:%S%z')}.jsonl",
         filter_for: str = "",
         chat: bool = True,
+        shard_size: int = 0,
+        shard_bytes: int = 0,
+        compression: str = "",
+        validation_fraction: float = 0.0,
+        workers: int = 1,
+        incremental: bool = False,
+        format: str = "jsonl",
+        row_group_size: int = 10000,
     ) -> None:
+        if format not in ("jsonl", "parquet"):
+            raise Exception(f"Unknown export format: {format}")
+        sharded = bool(shard_size or shard_bytes or validation_fraction)
+        if format == "parquet" and sharded:
+            raise Exception("Sharding and splitting are only supported for JSONL")
+        base_file = export_file.removesuffix(".jsonl").removesuffix(".parquet")
         with Session(self.db.engine) as session:
             with open(system_prompt_file) as f:
                 system_prompt = f.read()
-            exporter = Exporter(system_prompt, export_file)
-            pcps = self.db.get_pcps(session, filter_for)
-            exporter.export_pcps_to_jsonl(pcps, chat)
+            exporter = Exporter(
+                system_prompt,
+                export_file if format == "jsonl" else f"{base_file}.{format}",
+                shard_size=shard_size,
+                shard_bytes=shard_bytes,
+                compression=compression,
+                validation_fraction=validation_fraction,
+                workers=workers,
+                row_group_size=row_group_size,
+            )
+            watermark = None
+            if incremental:
+                watermark = self.db.read_export_watermark(session, export_file)
+                exporter.filename = f"{base_file}.part-{watermark.parts:05d}.{format}"
+            pcps = self.db.iter_pcps(session, filter_for, watermark=watermark)
+            if incremental:
+                first = next(pcps, None)
+                if first is None:
+                    logger.info(f"No new summaries to export to {export_file}")
+                    return
+                pcps = chain([first], pcps)
+            if format == "parquet":
+                exporter.export_pcps_to_parquet(pcps, chat)
+            elif sharded or compression:
+                filenames = exporter.export_pcps_to_shards(pcps, chat)
+                logger.info(f"Exported {len(filenames)} files")
+            else:
+                exporter.export_pcps_to_jsonl(pcps, chat)
+            if watermark:
+                watermark.parts += 1
+                watermark.exported_at = datetime.now(timezone.utc)
+                session.add(watermark)
+                session.commit()
+                logger.info(f"Exported part {watermark.parts} of {export_file}")
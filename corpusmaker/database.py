@@ -2,23 +2,194 @@
 Database operations for Corpusmaker
 """
 
-from typing import Optional
-from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, Optional
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
 from hashlib import md5
-import re
-from sqlmodel import SQLModel, create_engine, Session, select
-from sqlalchemy.engine import Engine
-from corpusmaker.model import RawText, Scene
+from itertools import islice
+from sqlmodel import SQLModel, create_engine, Session, col, select
+import sqlite3
+import sqlalchemy
+from sqlalchemy import (
+    Integer,
+    ScalarSelect,
+    bindparam,
+    event,
+    func,
+    inspect,
+    literal,
+    or_,
+    text,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection, Engine
+from corpusmaker.chunker import Chunker, SceneRecord, chunk_text
+from corpusmaker.model import (
+    ExportWatermark,
+    ImportedFile,
+    RawText,
+    Scene,
+    SceneStatus,
+    decode_raw_text_content,
+    read_scene_content,
+)
 from loguru import logger
 
 
+@dataclass
+class DatabaseProfile:
+    """
+    Whether the engine logs every statement, and the SQLite pragmas set on
+    every connection it opens
+    """
+
+    echo: bool = False
+    pragmas: dict[str, str | int] = field(default_factory=dict)
+
+
+DATABASE_PROFILES = {
+    # Log every statement and leave SQLite at its defaults
+    "debug": DatabaseProfile(echo=True),
+    # Durable: every commit is synced, in WAL mode so readers do not block writers
+    "safe": DatabaseProfile(
+        pragmas={
+            "journal_mode": "WAL",
+            "synchronous": "FULL",
+            "cache_size": -64 * 1024,
+            "mmap_size": 0,
+            "temp_store": "DEFAULT",
+        }
+    ),
+    # Fast: commits are not synced, so an OS crash or power loss can lose or
+    # corrupt recent writes, though an application crash cannot
+    "bulk": DatabaseProfile(
+        pragmas={
+            "journal_mode": "WAL",
+            "synchronous": "OFF",
+            "cache_size": -256 * 1024,
+            "mmap_size": 1 << 30,
+            "temp_store": "MEMORY",
+        }
+    ),
+}
+
+
+# The page cache size used while raw text is written a block at a time, 8 MiB
+WRITE_CACHE_SIZE = -8 * 1024
+
+
+def checksum_blocks(blocks: Iterable[str]) -> tuple[str, int]:
+    """
+    The md5 checksum of a text read in blocks, and its size in bytes
+    """
+    digest = md5()
+    size = 0
+    for block in blocks:
+        data = block.encode("utf-8")
+        digest.update(data)
+        size += len(data)
+    return digest.hexdigest(), size
+
+
+def next_summary_seq() -> ScalarSelect[int]:
+    """
+    The sequence number of the next summary to be written, for use in the
+    statement that writes it. It is read under the write lock, so summaries
+    are numbered in the order they are committed, whatever the writers'
+    clocks say.
+    """
+    return (
+        sqlalchemy.select(func.coalesce(func.max(Scene.summary_seq), 0) + 1)
+        .correlate(None)
+        .scalar_subquery()
+    )
+
+
 @dataclass
 class Database:
     pathname: str = "sqlite:///data/database.sqlite3"
+    profile: str = "safe"
 
     def __post_init__(self) -> None:
-        self.engine: Engine = create_engine(self.pathname, echo=True)
+        if self.profile not in DATABASE_PROFILES:
+            raise Exception(f"Unknown database profile: {self.profile}")
+        profile = DATABASE_PROFILES[self.profile]
+        self.engine: Engine = create_engine(self.pathname, echo=profile.echo)
+        if self.engine.dialect.name == "sqlite" and profile.pragmas:
+
+            @event.listens_for(self.engine, "connect")
+            def set_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+                cursor = dbapi_connection.cursor()
+                for name, value in profile.pragmas.items():
+                    cursor.execute(f"PRAGMA {name} = {value}")
+                cursor.close()
+
         SQLModel.metadata.create_all(self.engine)
+        self.migrate()
+
+    def migrate(self) -> None:
+        """
+        Add columns and indexes introduced since an existing database was created
+        """
+        inspector = inspect(self.engine)
+        added = set()
+        with self.engine.begin() as connection:
+            for table in SQLModel.metadata.sorted_tables:
+                existing = {
+                    column["name"] for column in inspector.get_columns(table.name)
+                }
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    logger.info(f"Adding column {table.name}.{column.name}")
+                    added.add(f"{table.name}.{column.name}")
+                    quote = self.engine.dialect.identifier_preparer.quote
+                    ddl = f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} "
+                    ddl += column.type.compile(self.engine.dialect)
+                    default = getattr(column.default, "arg", None)
+                    if default is not None and not callable(default):
+                        value = literal(default, column.type).compile(
+                            self.engine, compile_kwargs={"literal_binds": True}
+                        )
+                        ddl += f" NOT NULL DEFAULT {value}"
+                    connection.execute(text(ddl))
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+            if "scene.summary_seq" in added:
+                self.number_summaries(connection)
+
+    def number_summaries(self, connection: Connection) -> None:
+        """
+        Number the summaries of a database made before summaries were
+        numbered in the order they were committed, in the order of their
+        timestamps, and move export watermarks to the same positions
+        """
+        logger.info("Numbering existing summaries")
+        connection.execute(
+            text(
+                "UPDATE scene SET summary_seq = ordered.seq FROM ("
+                " SELECT id, row_number() OVER (ORDER BY summarized_at, id) AS seq"
+                " FROM scene WHERE summary != ''"
+                ") AS ordered WHERE scene.id = ordered.id"
+            )
+        )
+        # Scenes summarized before summary timestamps were recorded sort first
+        connection.execute(
+            text(
+                "UPDATE exportwatermark SET summary_seq = coalesce(("
+                " SELECT max(scene.summary_seq) FROM scene WHERE"
+                " (scene.summarized_at IS NULL AND"
+                "  (exportwatermark.summarized_at IS NOT NULL"
+                "   OR scene.id <= exportwatermark.scene_id))"
+                " OR scene.summarized_at < exportwatermark.summarized_at"
+                " OR (scene.summarized_at = exportwatermark.summarized_at"
+                "  AND scene.id <= exportwatermark.scene_id)"
+                "), 0)"
+            )
+        )
 
     def create_raw_text(self, session: Session, raw_text: RawText) -> None:
         """
@@ -37,6 +208,135 @@ class Database:
         else:
             logger.error("Duplicate found, not adding")
 
+    def create_raw_text_from_blocks(
+        self,
+        session: Session,
+        raw_text: RawText,
+        read_blocks: Callable[[], Iterable[str]],
+    ) -> tuple[str, bool]:
+        """
+        Enter raw text in the database a block at a time, so the whole text
+        is never held in memory, and return its checksum and whether it was
+        added
+
+        `read_blocks` is read twice: first to find the checksum and size, so
+        duplicates are found before anything is written, then to write the
+        UTF-8 content into space reserved for it with SQLite incremental blob
+        I/O. The content is kept as bytes, which are decoded when the raw text
+        is read, as converting it to text in SQLite would hold all of it in
+        memory.
+        """
+        if self.engine.dialect.name != "sqlite":
+            raw_text.content = "".join(read_blocks())
+            checksum = md5(raw_text.content.encode("utf-8")).hexdigest()
+            raw_text.checksum = checksum
+            return checksum, self.create_raw_texts(session, [raw_text]) == 1
+        logger.info("Entering raw text in database")
+        checksum, size = checksum_blocks(read_blocks())
+        statement = select(RawText.id).where(RawText.checksum == checksum)
+        if session.exec(statement).first() is not None:
+            logger.error("Duplicate found, not adding")
+            return checksum, False
+
+        connection = session.connection().connection.driver_connection
+        assert isinstance(connection, sqlite3.Connection)
+        limit = connection.getlimit(sqlite3.SQLITE_LIMIT_LENGTH)
+        if size > limit:
+            raise Exception(f"Raw text is {size} bytes, SQLite stores at most {limit}")
+        raw_text.content = ""
+        raw_text.checksum = checksum
+        try:
+            session.add(raw_text)
+            session.flush()
+            assert raw_text.id
+            where = col(RawText.id) == raw_text.id
+            digest = md5()
+            # Written pages are spilled through a small page cache, so the
+            # cache size of the profile does not decide how much is held
+            cache_size = connection.execute("PRAGMA cache_size").fetchone()[0]
+            connection.execute(f"PRAGMA cache_size = {WRITE_CACHE_SIZE}")
+            try:
+                session.execute(
+                    update(RawText)
+                    .where(where)
+                    .values(encoded_content=func.zeroblob(size))
+                )
+                if size:
+                    with connection.blobopen(
+                        "rawtext", "encoded_content", raw_text.id
+                    ) as blob:
+                        for block in read_blocks():
+                            data = block.encode("utf-8")
+                            digest.update(data)
+                            blob.write(data)
+            finally:
+                connection.execute(f"PRAGMA cache_size = {cache_size}")
+            if digest.hexdigest() != checksum:
+                raise Exception("Raw text changed while it was being entered")
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        logger.info("Raw text added to database")
+        return checksum, True
+
+    def create_raw_texts(self, session: Session, raw_texts: list[RawText]) -> int:
+        """
+        Enter raw texts whose checksums are already set in one transaction,
+        skipping duplicates of stored texts and of each other, and return the
+        number added
+        """
+        checksums = [raw_text.checksum for raw_text in raw_texts]
+        existing: set[str] = set()
+        for i in range(0, len(checksums), 500):
+            statement = select(RawText.checksum).where(
+                col(RawText.checksum).in_(checksums[i : i + 500])
+            )
+            existing.update(session.exec(statement))
+        added = []
+        for raw_text in raw_texts:
+            if raw_text.checksum not in existing:
+                existing.add(raw_text.checksum)
+                added.append(raw_text)
+        session.add_all(added)
+        session.commit()
+        return len(added)
+
+    def read_imported_files(
+        self, session: Session, paths: list[str]
+    ) -> dict[str, ImportedFile]:
+        """
+        The manifest entries of the given files whose raw text is still stored
+        """
+        imported = {}
+        for i in range(0, len(paths), 500):
+            statement = (
+                select(ImportedFile)
+                .join(RawText, col(RawText.checksum) == col(ImportedFile.checksum))
+                .where(col(ImportedFile.path).in_(paths[i : i + 500]))
+            )
+            for imported_file in session.exec(statement):
+                imported[imported_file.path] = imported_file
+        return imported
+
+    def record_imported_files(
+        self, session: Session, imported_files: list[dict[str, Any]]
+    ) -> None:
+        """
+        Add or replace manifest entries in the current transaction
+        """
+        if not imported_files:
+            return
+        statement = insert(ImportedFile)
+        statement = statement.on_conflict_do_update(
+            index_elements=["path"],
+            set_={
+                name: statement.excluded[name]
+                for name in ["size", "mtime_ns", "checksum", "imported_at"]
+            },
+        )
+        session.execute(statement, imported_files)
+
     def read_raw_text(self, session: Session, text_id: int) -> RawText:
         logger.info(f"Reading Text {text_id} from database")
         statement = select(RawText).where(RawText.id == text_id)
@@ -72,6 +372,7 @@ class Database:
         raw_text = results.first()
 
         if raw_text:
+            self.store_scene_contents(session, text_id)
             session.delete(raw_text)
             session.commit()
 
@@ -94,7 +395,9 @@ class Database:
         statement = select(RawText)
         results = session.exec(statement)
 
-        for raw_text in results:
+        for raw_text in results.all():
+            if raw_text.id:
+                self.store_scene_contents(session, raw_text.id)
             session.delete(raw_text)
             session.commit()
 
@@ -107,109 +410,187 @@ class Database:
             logger.error("Deletion of all raw text failed")
             raise Exception("Deletion of all raw text failed")
 
-    def convert_raw_text_to_scenes(
+    def store_scene_contents(self, session: Session, text_id: int) -> None:
+        """
+        Store the content of the scenes of a raw text that are kept as offsets
+        into it, so they can still be read once it is deleted
+        """
+        scenes = session.exec(
+            select(Scene).where(Scene.text_id == text_id, col(Scene.start).is_not(None))
+        ).all()
+        if scenes:
+            session.execute(
+                update(Scene),
+                [
+                    {
+                        "id": scene.id,
+                        "content": scene.content,
+                        "start": None,
+                        "end": None,
+                        "start_byte": None,
+                        "end_byte": None,
+                    }
+                    for scene in scenes
+                ],
+            )
+        session.info.pop("raw_text_content", None)
+
+    def iter_scenes(
         self, session: Session, text_id: int, word_limit: int
-    ) -> list[Scene]:
+    ) -> Iterator[Scene]:
         """
-        Split content of raw text into scenes
+        Split content of raw text into scenes, yielding them one at a time
 
-        Algorithm:
-        - Split content by separator (newline by default)
-        - For each section of content:
-          - If it is under the word limit:
-            - Add as many next sections as we can
-            - Stop before it's over the limit
-          - If it is over the word limit:
-            - Split the section in half by word
-            - Keep doing that until the subsections are under the limit
-        - Convert each resulting section to a Scene
+        See Chunker for the algorithm.
 
         Drawback:
         - Sections longer than the word limit will be split by word, not sentence or line.
 
         """
         raw_text = self.read_raw_text(session, text_id)
-        raw_text_words_by_section = []
-        if raw_text.use_regex:
-            raw_text_words_by_section.extend(
-                [
-                    section.strip().split(" ")
-                    for section in re.split(
-                        re.compile(raw_text.separator), raw_text.content
-                    )
-                    if section.strip()
-                ]
-            )
-        else:
-            raw_text_words_by_section.extend(
-                [
-                    section.strip().split(" ")
-                    for section in raw_text.content.split(raw_text.separator or "\n")
-                    if section.strip()
-                ]
-            )
-
-        sections = []
-        previous_words: list[str] = []
-        for index, current_words in enumerate(raw_text_words_by_section):
-            # If there was a previous line to add to this one, add it
-            words = list(previous_words)
-            words.extend(current_words)
-            # Reset the previous line now that it's been added
-            previous_words = []
-
-            chunk_length = len(words)
-            next_index = index + 1
-
-            # If current line is below word limit, check if we can add
-            # the next line to it without going over the limit. If we can,
-            # skip this iteration and do that at the beginning of the next one
-            if (not raw_text.separator) and chunk_length < word_limit:
-                if next_index < len(raw_text_words_by_section):
-                    if (
-                        chunk_length + len(raw_text_words_by_section[next_index])
-                        < word_limit
-                    ):
-                        previous_words.extend(words)
-                        continue
-
-            # If current line is above word limit, define how we're going to
-            # split it down to fit: halve the target length until it's below the limit.
-            while chunk_length > word_limit:
-                chunk_length = -(-chunk_length // 2)
-
-            # Split our current line down into sublists (chunks) as necessary
-            chunks = [
-                words[i : i + chunk_length] for i in range(0, len(words), chunk_length)
-            ]
-            sections.extend([" ".join(chunk) for chunk in chunks])
-
-        return [
-            Scene(
+        chunker = Chunker(
+            raw_text.content, raw_text.separator, raw_text.use_regex, word_limit
+        )
+        for start, end, section in chunker.scenes():
+            yield Scene(
                 content=section,
                 text_id=text_id,
                 checksum=md5(section.encode("utf-8")).hexdigest(),
+                start=start,
+                end=end,
+            )
+
+    def convert_raw_text_to_scenes(
+        self, session: Session, text_id: int, word_limit: int
+    ) -> list[Scene]:
+        """
+        Split content of raw text into a list of scenes
+        """
+        return list(self.iter_scenes(session, text_id, word_limit))
+
+    def insert_scenes(
+        self,
+        session: Session,
+        text_id: int,
+        records: Iterable[SceneRecord],
+        batch_size: int = 1000,
+    ) -> tuple[int, int]:
+        """
+        Insert the scene records of a Raw Text in batches, skipping any scene
+        whose checksum is already in the database.
+        Scenes are stored as offsets into the Raw Text, so their content is
+        only stored when it cannot be read back from those offsets.
+        Returns the number of scenes added and the number skipped.
+        """
+        statement = insert(SQLModel.metadata.tables["scene"]).on_conflict_do_nothing(
+            index_elements=["checksum"]
+        )
+        added = total = 0
+        iterator = iter(records)
+        while batch := list(islice(iterator, batch_size)):
+            added += (
+                session.connection()
+                .execute(
+                    statement,
+                    [
+                        {
+                            "content": content,
+                            "checksum": checksum,
+                            "text_id": text_id,
+                            "start": start,
+                            "end": end,
+                            "start_byte": start_byte,
+                            "end_byte": end_byte,
+                            "joined": joined,
+                        }
+                        for (
+                            start,
+                            end,
+                            start_byte,
+                            end_byte,
+                            joined,
+                            content,
+                            checksum,
+                        ) in batch
+                    ],
+                )
+                .rowcount
             )
-            for section in sections
-        ]
+            total += len(batch)
+        session.commit()
+        skipped = total - added
+        logger.info(f"Added {added} scenes to database, skipped {skipped} duplicates")
+        return added, skipped
 
-    def create_scenes(self, session: Session, text_id: int, word_limit: int) -> None:
+    def create_scenes(
+        self, session: Session, text_id: int, word_limit: int, batch_size: int = 1000
+    ) -> tuple[int, int]:
         """
-        Split up a stored Raw Text into scenes
+        Split up a stored Raw Text into scenes, skipping any scene whose
+        checksum is already in the database.
+        Scenes are inserted in batches, so the whole text is never held as scenes.
+        Returns the number of scenes added and the number skipped.
         """
         logger.info(f"Converting Text {text_id} into scenes")
-        scenes = self.convert_raw_text_to_scenes(session, text_id, word_limit)
-        for scene in scenes:
-            statement = select(Scene).where(Scene.checksum == scene.checksum)
-            results = session.exec(statement)
-            duplicate = results.first()
-
-            if not duplicate:
-                session.add(scene)
-                session.commit()
-                logger.info("Scene added to database")
-            else:
-                logger.error("Duplicate found, not adding")
+        raw_text = self.read_raw_text(session, text_id)
+        chunker = Chunker(
+            raw_text.content, raw_text.separator, raw_text.use_regex, word_limit
+        )
+        return self.insert_scenes(session, text_id, chunker.records(), batch_size)
+
+    def create_scenes_in_parallel(
+        self,
+        session: Session,
+        text_ids: Iterable[int],
+        word_limit: int,
+        workers: int,
+        batch_size: int = 1000,
+    ) -> tuple[int, int]:
+        """
+        Split up stored Raw Texts into scenes with a pool of worker processes.
+        This process reads each text, hands it to a worker for chunking and
+        hashing, and inserts the results in the order of `text_ids`, so scene
+        ids are the same as when the texts are converted one at a time.
+        Only a few texts per worker are in flight at once.
+        Returns the number of scenes added and the number skipped.
+        """
+        added = skipped = 0
+        pending: deque[tuple[int, Future[list[SceneRecord]]]] = deque()
+
+        def insert_next() -> None:
+            nonlocal added, skipped
+            text_id, future = pending.popleft()
+            logger.info(f"Converting Text {text_id} into scenes")
+            text_added, text_skipped = self.insert_scenes(
+                session, text_id, future.result(), batch_size
+            )
+            added += text_added
+            skipped += text_skipped
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for text_id in text_ids:
+                content, encoded_content, separator, use_regex = session.execute(
+                    select(
+                        RawText.content,
+                        RawText.encoded_content,
+                        RawText.separator,
+                        RawText.use_regex,
+                    ).where(RawText.id == text_id)
+                ).one()
+                content = decode_raw_text_content(content, encoded_content)
+                pending.append(
+                    (
+                        text_id,
+                        pool.submit(
+                            chunk_text, content, separator, use_regex, word_limit
+                        ),
+                    )
+                )
+                if len(pending) >= workers * 2:
+                    insert_next()
+            while pending:
+                insert_next()
+        return added, skipped
 
     def read_scene(self, session: Session, scene_id: int) -> Scene:
         """
@@ -226,12 +607,127 @@ class Database:
 
     def find_scenes_without_summaries(self, session: Session) -> list[Scene]:
         """
-        Find all stored Scenes that do not yet have a summary
+        Find all stored Scenes that do not yet have a summary, except those
+        whose summarization has failed and near-duplicates of other scenes
         """
         logger.info("Grabbing unsummarized scenes from database")
-        statement = select(Scene).where(Scene.summary == "")
+        statement = select(Scene).where(
+            Scene.summary == "",
+            Scene.status != SceneStatus.FAILED,
+            col(Scene.duplicate_of).is_(None),
+        )
+        return list(session.exec(statement).all())
+
+    def iter_unsummarized_contents(
+        self, session: Session, batch_size: int = 1000
+    ) -> Iterator[str]:
+        """
+        Stream the content of every Scene that find_scenes_without_summaries
+        would return, without loading them all at once
+        """
+        statement = (
+            select(Scene)
+            .where(
+                Scene.summary == "",
+                Scene.status != SceneStatus.FAILED,
+                col(Scene.duplicate_of).is_(None),
+            )
+            .execution_options(yield_per=batch_size)
+        )
+        for scene in session.exec(statement):
+            yield scene.content
+
+    def find_failed_scenes(self, session: Session) -> list[Scene]:
+        """
+        Find all stored Scenes whose summarization has failed
+        """
+        logger.info("Grabbing failed scenes from database")
+        statement = select(Scene).where(Scene.status == SceneStatus.FAILED)
         return list(session.exec(statement).all())
 
+    def claim_scenes(
+        self, session: Session, owner: str, count: int, lease_seconds: float
+    ) -> list[Scene]:
+        """
+        Claim up to `count` unsummarized Scenes for one worker until its lease
+        expires. Scenes leased to another worker are skipped unless their
+        lease has expired.
+        """
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=lease_seconds)
+        # End any open read transaction so the claim starts from fresh data
+        session.commit()
+        # Find claimable scenes through the status index: comparing
+        # duplicate_of through coalesce keeps SQLite from walking its index
+        # instead, which would pass every summarized scene under the write lock
+        claimable = (
+            select(Scene.id)
+            .where(
+                col(Scene.status).in_([SceneStatus.PENDING, SceneStatus.IN_FLIGHT]),
+                Scene.summary == "",
+                func.coalesce(Scene.duplicate_of, 0) == 0,
+                or_(
+                    col(Scene.lease_expires_at).is_(None),
+                    col(Scene.lease_expires_at) < now,
+                ),
+            )
+            .order_by(col(Scene.id))
+            .limit(count)
+        )
+        session.execute(
+            update(Scene)
+            .where(col(Scene.id).in_(claimable.scalar_subquery()))
+            .values(
+                status=SceneStatus.IN_FLIGHT,
+                lease_owner=owner,
+                lease_expires_at=expires_at,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        statement = select(Scene).where(
+            Scene.lease_owner == owner,
+            Scene.lease_expires_at == expires_at,
+            Scene.summary == "",
+        )
+        scenes = list(session.exec(statement).all())
+        logger.info(f"Claimed {len(scenes)} scenes for {owner}")
+        return scenes
+
+    def mark_in_flight(self, session: Session, scene_ids: list[int]) -> None:
+        """
+        Mark many Scenes as having summarization requests in flight
+        """
+        for i in range(0, len(scene_ids), 500):
+            session.execute(
+                update(Scene)
+                .where(col(Scene.id).in_(scene_ids[i : i + 500]))
+                .values(status=SceneStatus.IN_FLIGHT)
+                .execution_options(synchronize_session=False)
+            )
+        session.commit()
+
+    def update_scene_status(
+        self,
+        session: Session,
+        scene_id: int,
+        status: str,
+        error: str = "",
+        attempts: Optional[int] = None,
+    ) -> None:
+        """
+        Set the summarization status of a Scene, recording the error and
+        number of attempts if there are any
+        """
+        logger.info(f"Marking Scene {scene_id} as {status}")
+        values: dict[str, str | int] = {"status": status}
+        if error:
+            values["last_error"] = error
+        if attempts is not None:
+            values["attempts"] = attempts
+        session.execute(update(Scene).where(col(Scene.id) == scene_id).values(**values))
+        session.commit()
+
     def update_summary(
         self, session: Session, scene_id: int, summary: str = ""
     ) -> None:
@@ -241,9 +737,64 @@ class Database:
         logger.info(f"Summarizing Scene {scene_id}")
         scene = self.read_scene(session, scene_id)
         scene.summary = summary
+        scene.status = SceneStatus.DONE if summary else SceneStatus.PENDING
+        scene.summarized_at = datetime.now(timezone.utc) if summary else None
+        scene.summary_seq = next_summary_seq() if summary else None  # type: ignore[assignment]
         session.add(scene)
         session.commit()
 
+    def update_summaries(
+        self,
+        session: Session,
+        summaries: dict[int, str],
+        attempts: Optional[dict[int, int]] = None,
+    ) -> int:
+        """
+        Add summaries to many Scenes in one transaction, keyed by scene ID,
+        along with the number of attempts each one took. IDs of scenes that
+        do not exist are logged and skipped. Returns the number of summaries
+        stored.
+        """
+        logger.info(f"Summarizing {len(summaries)} scenes")
+        scene_ids = list(summaries)
+        existing: set[int] = set()
+        for i in range(0, len(scene_ids), 500):
+            statement = select(Scene.id).where(
+                col(Scene.id).in_(scene_ids[i : i + 500])
+            )
+            existing.update(
+                scene_id for scene_id in session.exec(statement) if scene_id
+            )
+        missing = [scene_id for scene_id in scene_ids if scene_id not in existing]
+        if missing:
+            logger.error(f"Skipping summaries for missing scenes: {missing[:10]}")
+        if existing:
+            write = (
+                update(Scene)
+                .where(col(Scene.id) == bindparam("scene_id"))
+                .values(
+                    summary=bindparam("new_summary"),
+                    status=SceneStatus.DONE,
+                    summarized_at=datetime.now(timezone.utc),
+                    summary_seq=next_summary_seq(),
+                    attempts=func.coalesce(
+                        bindparam("new_attempts", type_=Integer), Scene.attempts
+                    ),
+                )
+            )
+            rows = [
+                {
+                    "scene_id": scene_id,
+                    "new_summary": summary,
+                    "new_attempts": (attempts or {}).get(scene_id),
+                }
+                for scene_id, summary in summaries.items()
+                if scene_id in existing
+            ]
+            session.connection().execute(write, rows)
+            session.commit()
+        return len(existing)
+
     def find_scenes_with_summaries(self, session: Session) -> list[Scene]:
         """
         Find all stored Scenes that have a summary
@@ -252,20 +803,75 @@ class Database:
         statement = select(Scene).where(Scene.summary != "")
         return list(session.exec(statement).all())
 
+    def iter_pcps(
+        self,
+        session: Session,
+        filter_for: str = "",
+        batch_size: int = 1000,
+        watermark: Optional[ExportWatermark] = None,
+    ) -> Iterator[dict[str, str]]:
+        """
+        Stream prompt-completion pairs for summarized scenes that are not
+        near-duplicates, in scene order, along with the checksum of each scene.
+        Only the columns needed are fetched, `filter_for` is applied in SQL,
+        and rows are read `batch_size` at a time, so memory use does not
+        grow with the corpus.
+
+        With a watermark, only scenes summarized after it are streamed, in the
+        order their summaries were committed, and the watermark is moved past
+        each pair as it is yielded. It is up to the caller to commit it.
+        """
+        logger.info("Streaming PCPs")
+        # sqlmodel's select takes at most four columns
+        statement = sqlalchemy.select(
+            col(Scene.summary),
+            col(Scene.content),
+            col(Scene.checksum),
+            col(Scene.text_id),
+            col(Scene.start),
+            col(Scene.end),
+            col(Scene.start_byte),
+            col(Scene.end_byte),
+            col(Scene.joined),
+            col(Scene.id),
+            col(Scene.summarized_at),
+            col(Scene.summary_seq),
+        ).where(col(Scene.summary) != "", col(Scene.duplicate_of).is_(None))
+        if filter_for:
+            statement = statement.where(func.instr(Scene.summary, filter_for) > 0)
+        if watermark:
+            statement = statement.where(
+                col(Scene.summary_seq) > watermark.summary_seq
+            ).order_by(col(Scene.summary_seq))
+        else:
+            statement = statement.order_by(col(Scene.id))
+        rows = session.execute(statement.execution_options(yield_per=batch_size))
+        for row in rows:
+            summary, content, checksum, text_id, start, end = row[:6]
+            if not content and start is not None and end is not None:
+                start_byte, end_byte, joined = row[6:9]
+                content = read_scene_content(
+                    session, text_id, start, end, start_byte, end_byte, joined
+                )
+            yield {
+                "prompt": summary,  # .encode("unicode_escape").decode("utf-8-sig"),
+                "completion": content,  # .encode("unicode_escape").decode("utf-8-sig"),
+                "checksum": checksum,
+            }
+            if watermark:
+                watermark.scene_id, watermark.summarized_at, watermark.summary_seq = (
+                    row[9:]
+                )
+
+    def read_export_watermark(self, session: Session, target: str) -> ExportWatermark:
+        """
+        Get the watermark of an export target, or a new one if it was never exported
+        """
+        return session.get(ExportWatermark, target) or ExportWatermark(target=target)
+
     def get_pcps(self, session: Session, filter_for: str = "") -> list[dict[str, str]]:
         """
         Get a list of prompt-completion pairs for all summarized scenes
         """
         logger.info("Grabbing PCPs")
-        scenes = self.find_scenes_with_summaries(session)
-        pcps = [
-            {
-                "prompt": scene.summary,  # .encode("unicode_escape").decode("utf-8-sig"),
-                "completion": scene.content,  # .encode("unicode_escape").decode("utf-8-sig"),
-            }
-            for scene in scenes
-        ]
-        if filter_for:
-            return [pcp for pcp in pcps if filter_for in pcp["prompt"]]
-        else:
-            return pcps
+        return list(self.iter_pcps(session, filter_for))
@@ -0,0 +1,294 @@
+"""
+Near-duplicate detection operations for Corpusmaker
+"""
+
+from typing import Iterable, Optional
+
+import random
+import struct
+import zlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from hashlib import blake2b
+from sqlalchemy import insert, tuple_, update
+from sqlmodel import Session, col, not_, select
+from corpusmaker.database import Database
+from corpusmaker.model import LshBucket, Scene, SceneSignature
+from loguru import logger
+
+MAX_HASH = (1 << 32) - 1
+# The smallest prime above 2**32, so (a * x + b) stays within 64 bits
+PRIME = 4294967311
+BATCH_SIZE = 500
+
+BucketKey = tuple[int, int]
+
+
+def shingle_hashes(content: str, shingle_size: int) -> list[int]:
+    """
+    The distinct crc32 hashes of the word shingles of a text, ignoring case
+    and how it is spaced, so reformatted copies share their shingles
+    """
+    words = content.lower().split()
+    count = max(len(words) - shingle_size + 1, 1)
+    return list(
+        {
+            zlib.crc32(" ".join(words[i : i + shingle_size]).encode("utf-8"))
+            for i in range(count)
+        }
+    )
+
+
+def jaccard(signature: list[int], other: list[int]) -> float:
+    """
+    Estimate the Jaccard similarity of two texts from their signatures
+    """
+    return sum(a == b for a, b in zip(signature, other)) / len(signature)
+
+
+@dataclass
+class MinHasher:
+    """
+    MinHash signatures from `num_perm` universal hash functions.
+    numpy is used if it is installed, with the same results as without it.
+    """
+
+    num_perm: int = 128
+    shingle_size: int = 5
+    seed: int = 1
+    a: list[int] = field(init=False)
+    b: list[int] = field(init=False)
+
+    def __post_init__(self) -> None:
+        rng = random.Random(self.seed)
+        self.a = [rng.randrange(1, MAX_HASH) for _ in range(self.num_perm)]
+        self.b = [rng.randrange(0, MAX_HASH) for _ in range(self.num_perm)]
+
+    def signature(self, content: str) -> list[int]:
+        hashes = shingle_hashes(content, self.shingle_size)
+        try:
+            import numpy
+        except ImportError:
+            return [
+                min([((a * x + b) % PRIME) & MAX_HASH for x in hashes])
+                for a, b in zip(self.a, self.b)
+            ]
+        a = numpy.array(self.a, dtype=numpy.uint64)[:, None]
+        b = numpy.array(self.b, dtype=numpy.uint64)[:, None]
+        signature = numpy.full(self.num_perm, MAX_HASH, dtype=numpy.uint64)
+        # Hash a slice of shingles at a time to bound memory on long scenes
+        for i in range(0, len(hashes), 8192):
+            x = numpy.array(hashes[i : i + 8192], dtype=numpy.uint64)[None, :]
+            values = ((a * x + b) % numpy.uint64(PRIME)) & numpy.uint64(MAX_HASH)
+            signature = numpy.minimum(signature, values.min(axis=1))
+        return [int(value) for value in signature]
+
+    def signatures(self, contents: list[str]) -> list[list[int]]:
+        return [self.signature(content) for content in contents]
+
+
+def pack(signature: list[int]) -> bytes:
+    return struct.pack(f"<{len(signature)}I", *signature)
+
+
+def unpack(data: bytes) -> list[int]:
+    return list(struct.unpack(f"<{len(data) // 4}I", data))
+
+
+@dataclass
+class Deduper:
+    """
+    Mark scenes that are near-duplicates of an earlier scene
+
+    Each scene gets a MinHash signature, split into `bands` bands that are
+    hashed into buckets of a locality-sensitive hashing (LSH) index kept in
+    the database. Scenes that share a bucket with an earlier one are compared
+    by their signatures, and marked as duplicates of the first one whose
+    estimated Jaccard similarity is at least `threshold`. Only scenes that
+    are not duplicates are added to the index, and scenes that already have
+    a signature are skipped, so the index can be updated as scenes are added.
+
+    The signature settings and number of bands must stay the same for a
+    database. More bands find pairs with a lower similarity, at the cost of
+    more comparisons: the index finds most pairs above about
+    (1 / bands) ** (bands / num_perm).
+    """
+
+    db: Database
+    threshold: float = 0.8
+    num_perm: int = 128
+    bands: int = 16
+    shingle_size: int = 5
+    batch_size: int = 1000
+    workers: int = 1
+    hasher: MinHasher = field(init=False)
+
+    def __post_init__(self) -> None:
+        if self.num_perm % self.bands:
+            raise Exception(
+                f"The number of bands ({self.bands}) must divide num_perm ({self.num_perm})"
+            )
+        self.hasher = MinHasher(self.num_perm, self.shingle_size)
+
+    def bucket_keys(self, signature: list[int]) -> list[BucketKey]:
+        """
+        The (band, bucket) keys of a signature in the LSH index
+        """
+        rows = self.num_perm // self.bands
+        keys = []
+        for band in range(self.bands):
+            digest = blake2b(
+                pack(signature[band * rows : (band + 1) * rows]), digest_size=8
+            ).digest()
+            keys.append((band, int.from_bytes(digest, "big", signed=True)))
+        return keys
+
+    def find_buckets(
+        self, session: Session, keys: Iterable[BucketKey]
+    ) -> dict[BucketKey, list[int]]:
+        """
+        The IDs of the scenes already indexed in each of the given buckets
+        """
+        keys = list(keys)
+        buckets: dict[BucketKey, list[int]] = defaultdict(list)
+        for i in range(0, len(keys), BATCH_SIZE):
+            statement = select(
+                LshBucket.band, LshBucket.bucket, LshBucket.scene_id
+            ).where(
+                tuple_(col(LshBucket.band), col(LshBucket.bucket)).in_(
+                    keys[i : i + BATCH_SIZE]
+                )
+            )
+            for band, bucket, scene_id in session.exec(statement):
+                buckets[(band, bucket)].append(scene_id)
+        return buckets
+
+    def read_signatures(
+        self, session: Session, scene_ids: Iterable[int]
+    ) -> dict[int, list[int]]:
+        scene_ids = list(scene_ids)
+        signatures = {}
+        for i in range(0, len(scene_ids), BATCH_SIZE):
+            statement = select(SceneSignature).where(
+                col(SceneSignature.scene_id).in_(scene_ids[i : i + BATCH_SIZE])
+            )
+            for row in session.exec(statement):
+                signature = unpack(row.signature)
+                if len(signature) != self.num_perm:
+                    raise Exception(
+                        f"Scene {row.scene_id} has a signature of {len(signature)} "
+                        f"hashes, but num_perm is {self.num_perm}"
+                    )
+                signatures[row.scene_id] = signature
+        return signatures
+
+    def find_duplicate(
+        self,
+        signature: list[int],
+        candidates: Iterable[int],
+        signatures: dict[int, list[int]],
+    ) -> Optional[int]:
+        """
+        The earliest candidate similar enough to be the original of a scene
+        """
+        for candidate in sorted(set(candidates)):
+            if jaccard(signature, signatures[candidate]) >= self.threshold:
+                return candidate
+        return None
+
+    def dedupe_batch(
+        self,
+        session: Session,
+        scenes: list[Scene],
+        pool: Optional[ProcessPoolExecutor] = None,
+    ) -> int:
+        """
+        Sign, index and mark a batch of scenes in one transaction, returning
+        the number of duplicates found
+        """
+        contents = [scene.content for scene in scenes]
+        if pool:
+            chunk = -(-len(contents) // self.workers)
+            signatures_by_chunk = pool.map(
+                self.hasher.signatures,
+                [contents[i : i + chunk] for i in range(0, len(contents), chunk)],
+            )
+            new_signatures = [s for chunk in signatures_by_chunk for s in chunk]
+        else:
+            new_signatures = self.hasher.signatures(contents)
+
+        keys = {
+            scene.id: self.bucket_keys(signature)
+            for scene, signature in zip(scenes, new_signatures)
+            if scene.id
+        }
+        buckets = self.find_buckets(
+            session, {key for scene_keys in keys.values() for key in scene_keys}
+        )
+        signatures = self.read_signatures(
+            session, {scene_id for ids in buckets.values() for scene_id in ids}
+        )
+
+        duplicates: dict[int, int] = {}
+        new_buckets: list[dict[str, int]] = []
+        for scene, signature in zip(scenes, new_signatures):
+            if not scene.id:
+                continue
+            candidates = [i for key in keys[scene.id] for i in buckets.get(key, [])]
+            original = self.find_duplicate(signature, candidates, signatures)
+            if original is not None:
+                duplicates[scene.id] = original
+                continue
+            signatures[scene.id] = signature
+            for band, bucket in keys[scene.id]:
+                buckets.setdefault((band, bucket), []).append(scene.id)
+                new_buckets.append(
+                    {"band": band, "bucket": bucket, "scene_id": scene.id}
+                )
+
+        session.execute(
+            insert(SceneSignature),
+            [
+                {"scene_id": scene.id, "signature": pack(signature)}
+                for scene, signature in zip(scenes, new_signatures)
+            ],
+        )
+        if new_buckets:
+            session.execute(insert(LshBucket), new_buckets)
+        if duplicates:
+            session.execute(
+                update(Scene),
+                [
+                    {"id": scene_id, "duplicate_of": original}
+                    for scene_id, original in duplicates.items()
+                ],
+            )
+        session.commit()
+        return len(duplicates)
+
+    def run(self, session: Session) -> tuple[int, int]:
+        """
+        Dedupe every scene without a signature, in order, returning the number
+        of scenes checked and the number of duplicates found
+        """
+        checked = found = 0
+        pool = ProcessPoolExecutor(self.workers) if self.workers > 1 else None
+        try:
+            while True:
+                statement = (
+                    select(Scene)
+                    .where(not_(col(Scene.id).in_(select(SceneSignature.scene_id))))
+                    .order_by(col(Scene.id))
+                    .limit(self.batch_size)
+                )
+                scenes = list(session.exec(statement).all())
+                if not scenes:
+                    break
+                found += self.dedupe_batch(session, scenes, pool)
+                checked += len(scenes)
+                logger.info(f"Checked {checked} scenes, found {found} duplicates")
+        finally:
+            if pool:
+                pool.shutdown()
+        return checked, found
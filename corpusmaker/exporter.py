@@ -2,14 +2,108 @@
 Export operations for Corpusmaker
 """
 
-from dataclasses import dataclass
-import json
+from typing import IO, Any, Callable, Iterable, Optional, cast
+
+import codecs
+import gzip
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import cached_property
+from hashlib import sha256
+from json.encoder import encode_basestring_ascii
+from loguru import logger
+
+StringEncoder = Callable[[str], bytes]
+
+COMPRESSION_SUFFIXES = {"": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def encode_string_ascii(string: str) -> bytes:
+    """
+    Encode a string as a JSON string exactly as json.dump does by default
+    """
+    return encode_basestring_ascii(string).encode("ascii")
+
+
+def get_string_encoder() -> StringEncoder:
+    """
+    Encode JSON strings with orjson if it is installed, otherwise with the
+    standard library. orjson only escapes what it must, so it is used only
+    for printable ASCII strings, which both encode identically.
+    """
+    try:
+        import orjson
+    except ImportError:
+        logger.debug("orjson is not installed, encoding JSON with the json module")
+        return encode_string_ascii
+
+    def encode_string(string: str) -> bytes:
+        if string.isascii() and "\x7f" not in string:
+            return orjson.dumps(string)
+        return encode_string_ascii(string)
+
+    return encode_string
+
+
+def split_for(checksum: str, validation_fraction: float) -> str:
+    """
+    Assign a record to the train or validation split by a hash of its scene
+    checksum, so reruns always put it in the same split
+    """
+    position = int(sha256(checksum.encode("utf-8")).hexdigest()[:16], 16) / 16**16
+    return "validation" if position < validation_fraction else "train"
+
+
+def open_shard(
+    filename: str, compression: str = "", buffer_size: int = 1 << 20
+) -> IO[bytes]:
+    """
+    Open a shard for writing, compressing what is written to it as a stream
+    if asked to
+    """
+    if compression == "gzip":
+        # A fixed timestamp keeps reruns byte-identical
+        return cast(IO[bytes], gzip.GzipFile(filename, "wb", mtime=0))
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("zstd compression needs zstandard to be installed")
+        writer: IO[bytes] = zstandard.ZstdCompressor().stream_writer(
+            open(filename, "wb", buffering=buffer_size), closefd=True
+        )
+        return writer
+    return open(filename, "wb", buffering=buffer_size)
+
+
+def write_shard(filename: str, data: bytes, compression: str = "") -> str:
+    """
+    Write a whole shard, compressing it if asked to
+    """
+    with open_shard(filename, compression) as f:
+        f.write(data)
+    logger.info(f"Wrote {filename}")
+    return filename
 
 
 @dataclass
 class Exporter:
     system_prompt: str
     filename: str
+    buffer_size: int = 1 << 20
+    encode_string: StringEncoder = field(default_factory=get_string_encoder)
+    shard_size: int = 0
+    shard_bytes: int = 0
+    compression: str = ""
+    validation_fraction: float = 0.0
+    workers: int = 1
+    row_group_size: int = 10000
+
+    def __post_init__(self) -> None:
+        if self.compression not in COMPRESSION_SUFFIXES:
+            raise Exception(f"Unknown compression: {self.compression}")
 
     def make_message(self, role: str, content: str) -> dict[str, str]:
         return {"role": role, "content": content}
@@ -34,13 +128,217 @@ class Exporter:
             "completion": pcp["completion"].encode("unicode_escape").decode("utf-8"),
         }
 
+    @cached_property
+    def chat_prefix(self) -> bytes:
+        """
+        The start of every chat line, up to the user message content, which
+        holds the system message encoded once for the whole export
+        """
+        system_prompt = self.system_prompt.encode("unicode_escape").decode("utf-8")
+        return (
+            b'{"messages": [{"role": "system", "content": '
+            + self.encode_string(system_prompt)
+            + b'}, {"role": "user", "content": '
+        )
+
+    def encode_chat_completion_jsonline(self, pcp: dict[str, str]) -> bytes:
+        """
+        The bytes json.dump would write for convert_pcp_to_chat_completion_jsonline
+        """
+        completion = pcp["completion"].encode("unicode_escape").decode("utf-8")
+        return b"".join(
+            (
+                self.chat_prefix,
+                self.encode_string(pcp["prompt"]),
+                b'}, {"role": "assistant", "content": ',
+                self.encode_string(completion),
+                b"}]}",
+            )
+        )
+
+    def encode_legacy_completion_jsonline(self, pcp: dict[str, str]) -> bytes:
+        """
+        The bytes json.dump would write for convert_pcp_to_legacy_completion_jsonline
+        """
+        completion = pcp["completion"].encode("unicode_escape").decode("utf-8")
+        return b"".join(
+            (
+                b'{"prompt": ',
+                self.encode_string(pcp["prompt"]),
+                b', "completion": ',
+                self.encode_string(completion),
+                b"}",
+            )
+        )
+
     def export_pcps_to_jsonl(
-        self, pcps: list[dict[str, str]], chat: bool = True
+        self, pcps: Iterable[dict[str, str]], chat: bool = True
     ) -> None:
-        with open(self.filename, "w", encoding="utf-8-sig") as f:
+        """
+        Write each pair as it arrives, so pairs can be streamed from the database
+
+        Lines are encoded straight to bytes and written through a large buffer,
+        producing the same UTF-8 file with a byte order mark as json.dump would.
+        """
+        encode = (
+            self.encode_chat_completion_jsonline
+            if chat
+            else self.encode_legacy_completion_jsonline
+        )
+        newline = os.linesep.encode("ascii")
+        with open(self.filename, "wb", buffering=self.buffer_size) as f:
+            f.write(codecs.BOM_UTF8)
+            for pcp in pcps:
+                f.write(encode(pcp) + newline)
+
+    def shard_filename(self, split: str, index: Optional[int]) -> str:
+        """
+        The name of a shard, e.g. `scenes.train-00001.jsonl.gz` for `scenes.jsonl`
+        """
+        filename = self.filename.removesuffix(".jsonl")
+        if split:
+            filename += f".{split}"
+        if index is not None:
+            filename += f"-{index:05d}"
+        return filename + ".jsonl" + COMPRESSION_SUFFIXES[self.compression]
+
+    def export_pcps_to_shards(
+        self, pcps: Iterable[dict[str, str]], chat: bool = True
+    ) -> list[str]:
+        """
+        Write pairs to shards of at most `shard_size` records and `shard_bytes`
+        bytes before compression, split into train and validation sets if
+        `validation_fraction` is set. Each shard is a complete JSONL file.
+
+        Lines are written to each shard, through its compressor, as they
+        arrive. If the export is sharded and `workers` is above 1, each shard
+        is instead encoded here and compressed and written by a process, with
+        a few shards per worker in flight at once, so memory use is bounded
+        by the shard size. Returns the shard filenames in the order they are
+        finished.
+        """
+        encode = (
+            self.encode_chat_completion_jsonline
+            if chat
+            else self.encode_legacy_completion_jsonline
+        )
+        newline = os.linesep.encode("ascii")
+        sharded = bool(self.shard_size or self.shard_bytes)
+        splits = ["train", "validation"] if self.validation_fraction else [""]
+        current: dict[str, str] = {}
+        streams: dict[str, IO[bytes]] = {}
+        lines: dict[str, list[bytes]] = {}
+        sizes = {split: 0 for split in splits}
+        records = {split: 0 for split in splits}
+        indexes = {split: 0 for split in splits}
+        filenames: list[str] = []
+        pending: deque[Future[str]] = deque()
+        pool = (
+            ProcessPoolExecutor(self.workers) if sharded and self.workers > 1 else None
+        )
+
+        def start(split: str) -> None:
+            filename = self.shard_filename(split, indexes[split] if sharded else None)
+            indexes[split] += 1
+            current[split] = filename
+            sizes[split] = records[split] = 0
+            if pool:
+                lines[split] = [codecs.BOM_UTF8]
+            else:
+                streams[split] = open_shard(
+                    filename, self.compression, self.buffer_size
+                )
+                streams[split].write(codecs.BOM_UTF8)
+
+        def finish(split: str) -> None:
+            filename = current.pop(split)
+            filenames.append(filename)
+            if not pool:
+                streams.pop(split).close()
+                logger.info(f"Wrote {filename}")
+                return
+            data = b"".join(lines.pop(split))
+            pending.append(pool.submit(write_shard, filename, data, self.compression))
+            if len(pending) >= self.workers * 2:
+                pending.popleft().result()
+
+        try:
             for pcp in pcps:
-                if chat:
-                    json.dump(self.convert_pcp_to_chat_completion_jsonline(pcp), f)
+                split = splits[0]
+                if self.validation_fraction:
+                    split = split_for(pcp["checksum"], self.validation_fraction)
+                line = encode(pcp) + newline
+                if split not in current:
+                    start(split)
+                elif records[split] and (
+                    (self.shard_size and records[split] >= self.shard_size)
+                    or (
+                        self.shard_bytes and sizes[split] + len(line) > self.shard_bytes
+                    )
+                ):
+                    finish(split)
+                    start(split)
+                if pool:
+                    lines[split].append(line)
                 else:
-                    json.dump(self.convert_pcp_to_legacy_completion_jsonline(pcp), f)
-                f.write("\n")
+                    streams[split].write(line)
+                records[split] += 1
+                sizes[split] += len(line)
+            for split in splits:
+                if split not in current and not indexes[split]:
+                    start(split)
+                if split in current:
+                    finish(split)
+            while pending:
+                pending.popleft().result()
+        finally:
+            for stream in streams.values():
+                stream.close()
+            if pool:
+                pool.shutdown()
+        return filenames
+
+    def export_pcps_to_parquet(
+        self, pcps: Iterable[dict[str, str]], chat: bool = True
+    ) -> None:
+        """
+        Write pairs to a Parquet file with the same values the JSONL export
+        holds, a row group of `row_group_size` rows at a time, so memory use
+        is bounded by the row group size.
+
+        Chat exports have a `messages` column of role and content structs,
+        and legacy exports have `prompt` and `completion` columns. Row groups
+        are compressed with `compression`, or snappy if it is not set.
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("Parquet export needs pyarrow to be installed")
+
+        if chat:
+            message = pyarrow.struct(
+                [("role", pyarrow.string()), ("content", pyarrow.string())]
+            )
+            schema = pyarrow.schema([("messages", pyarrow.list_(message))])
+        else:
+            schema = pyarrow.schema(
+                [("prompt", pyarrow.string()), ("completion", pyarrow.string())]
+            )
+        convert = (
+            self.convert_pcp_to_chat_completion_jsonline
+            if chat
+            else self.convert_pcp_to_legacy_completion_jsonline
+        )
+
+        with pyarrow.parquet.ParquetWriter(
+            self.filename, schema, compression=self.compression or "snappy"
+        ) as writer:
+            rows: list[dict[str, Any]] = []
+            for pcp in pcps:
+                rows.append(convert(pcp))
+                if len(rows) >= self.row_group_size:
+                    writer.write_batch(pyarrow.RecordBatch.from_pylist(rows, schema))
+                    rows = []
+            if rows:
+                writer.write_batch(pyarrow.RecordBatch.from_pylist(rows, schema))
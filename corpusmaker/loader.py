@@ -2,18 +2,211 @@
 Textfile operations for Corpusmaker
 """
 
-from typing import Optional
+from typing import IO, Any, Callable, Iterator, Optional, cast
 
+import bz2
+import gzip
+import io
+import lzma
+import os
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import partial
+from hashlib import md5
+from itertools import repeat
 from sqlmodel import Session
 from corpusmaker.database import Database
-from corpusmaker.model import RawText
+from corpusmaker.model import ImportedFile, RawText
 from loguru import logger
 
+BLOCK_SIZE = 1 << 20
+# Files up to this many characters are held in memory, a batch at a time, in
+# a bulk import; longer ones are streamed
+SMALL_FILE_SIZE = 1 << 16
+
+# The magic bytes each supported compression format starts with
+MAGIC_NUMBERS = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\xfd7zXZ\x00": "xz",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
+ZIP_MAGIC_NUMBERS = (b"PK\x03\x04", b"PK\x05\x06")
+
+
+# A tar header, which is also long enough to hold every magic number
+HEADER_SIZE = 512
+TAR_COMPRESSIONS = ("gzip", "bz2", "xz")
+
+
+def read_header(filename: str) -> bytes:
+    with open(filename, "rb") as f:
+        return f.read(HEADER_SIZE)
+
+
+def compression_of(header: bytes) -> str:
+    return next(
+        (name for number, name in MAGIC_NUMBERS.items() if header.startswith(number)),
+        "",
+    )
+
+
+def open_decompressed(filename: str, header: Optional[bytes] = None) -> IO[bytes]:
+    """
+    Open a file for reading, decompressing it as a stream if it starts with
+    the magic bytes of gzip, bz2, xz or zstd. A header already read from the
+    file saves reading it again to find out.
+    """
+    compression = compression_of(read_header(filename) if header is None else header)
+    if compression == "gzip":
+        return cast(IO[bytes], gzip.open(filename, "rb"))
+    if compression == "bz2":
+        return bz2.open(filename, "rb")
+    if compression == "xz":
+        return lzma.open(filename, "rb")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception("zstd compressed files need zstandard to be installed")
+        reader: IO[bytes] = zstandard.ZstdDecompressor().stream_reader(
+            open(filename, "rb"), closefd=True
+        )
+        return reader
+    return open(filename, "rb")
+
+
+def extract_member(archive: tarfile.TarFile, member: tarfile.TarInfo) -> IO[bytes]:
+    f = archive.extractfile(member)
+    if f is None:
+        raise Exception(f"{member.name} is not a file")
+    return f
+
+
+def is_tar(filename: str, header: bytes) -> bool:
+    """
+    Whether a file is a tar archive, uncompressed or compressed with gzip,
+    bz2 or xz, going by the "ustar" magic of its first member's header.
+    Only compressed files are opened again, to decompress that header.
+    """
+    if compression_of(header) in TAR_COMPRESSIONS:
+        try:
+            with open_decompressed(filename, header) as f:
+                header = f.read(HEADER_SIZE)
+        except Exception:
+            # Reported when the file is read as text instead
+            return False
+    return header[257:262] == b"ustar"
+
+
+def is_archive(filename: str, header: bytes) -> bool:
+    """
+    Whether a file with the given header is a zip or tar archive
+    """
+    return header.startswith(ZIP_MAGIC_NUMBERS) or is_tar(filename, header)
+
+
+@dataclass
+class Document:
+    """
+    A text to import: a file, which may be compressed, or a member of an archive
+    """
+
+    name: str
+    open_binary: Callable[[], IO[bytes]]
+
+    def read_blocks(self, block_size: int = BLOCK_SIZE) -> Iterator[str]:
+        """
+        Read the text `block_size` characters at a time
+        """
+        with io.TextIOWrapper(self.open_binary()) as f:
+            while block := f.read(block_size):
+                yield block
+
+
+def iter_documents(filename: str) -> Iterator[Document]:
+    """
+    The documents in a file: each file in a zip or tar archive, streamed
+    from the archive without extracting it, or else the file itself
+    """
+    header = read_header(filename)
+    if header.startswith(ZIP_MAGIC_NUMBERS):
+        with zipfile.ZipFile(filename) as zip_archive:
+            for info in zip_archive.infolist():
+                if not info.is_dir():
+                    yield Document(
+                        f"{filename}:{info.filename}", partial(zip_archive.open, info)
+                    )
+    elif is_tar(filename, header):
+        with tarfile.open(filename, "r:*") as tar_archive:
+            for member in tar_archive:
+                if member.isfile():
+                    yield Document(
+                        f"{filename}:{member.name}",
+                        partial(extract_member, tar_archive, member),
+                    )
+    else:
+        yield Document(filename, partial(open_decompressed, filename, header))
+
+
+def log_read_error(name: str, e: Exception) -> None:
+    if isinstance(e, FileNotFoundError):
+        logger.error(f"{name} was not found.")
+    elif isinstance(e, UnicodeDecodeError):
+        logger.error(f"{name} is not readable as text.")
+    else:
+        logger.error(f"{name} could not be read: {e}")
+
+
+def stat_file(filename: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(filename)
+    except OSError:
+        return None
+
+
+def is_unchanged(
+    stat: Optional[os.stat_result], imported_file: Optional[ImportedFile]
+) -> bool:
+    """
+    Whether a file has the size and modification time it had when imported
+    """
+    return bool(
+        stat
+        and imported_file
+        and stat.st_size == imported_file.size
+        and stat.st_mtime_ns == imported_file.mtime_ns
+    )
+
+
+def manifest_entry(
+    filename: str, stat: Optional[os.stat_result], checksum: str
+) -> list[dict[str, Any]]:
+    """
+    The manifest entry of a file that was read, if it could be stat'ed first
+    """
+    if not stat:
+        return []
+    return [
+        {
+            "path": os.path.abspath(filename),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "checksum": checksum,
+            "imported_at": datetime.now(timezone.utc),
+        }
+    ]
+
 
 @dataclass
 class Loader:
     db: Database
+    block_size: int = BLOCK_SIZE
+    small_file_size: int = SMALL_FILE_SIZE
 
     def read_file(
         self, filename: str, separator: str = "", use_regex: bool = False
@@ -32,14 +225,130 @@ class Loader:
             logger.error(e)
         return None
 
+    def read_document(
+        self,
+        document: Document,
+        separator: str = "",
+        use_regex: bool = False,
+        limit: Optional[int] = None,
+    ) -> Optional[RawText]:
+        """
+        Read and checksum a document of up to `limit` characters, a block by
+        default. A longer document is returned without content or checksum,
+        to be streamed instead, and None is returned if it cannot be read.
+        """
+        limit = limit or self.block_size
+        try:
+            with io.TextIOWrapper(document.open_binary()) as f:
+                content = f.read(limit + 1)
+        except Exception as e:
+            log_read_error(document.name, e)
+            return None
+        if len(content) > limit:
+            return RawText(separator=separator, use_regex=use_regex)
+        return RawText(
+            content=content,
+            checksum=md5(content.encode("utf-8")).hexdigest(),
+            separator=separator,
+            use_regex=use_regex,
+        )
+
+    def stream_document(
+        self, session: Session, document: Document, raw_text: RawText
+    ) -> Optional[tuple[str, bool]]:
+        """
+        Enter a document a block at a time, returning its checksum and whether
+        it was added, or None if it could not be read
+        """
+        try:
+            return self.db.create_raw_text_from_blocks(
+                session, raw_text, partial(document.read_blocks, self.block_size)
+            )
+        except Exception as e:
+            log_read_error(document.name, e)
+        return None
+
+    def import_documents(
+        self,
+        session: Session,
+        filename: str,
+        separator: str = "",
+        use_regex: bool = False,
+        batch_size: int = 1000,
+    ) -> tuple[int, int, int, Optional[str]]:
+        """
+        Enter each document in a file, committing documents of up to
+        `small_file_size` characters `batch_size` at a time and streaming
+        longer ones
+
+        Returns the number of documents added, skipped as duplicates and
+        failed, and the checksum of the file if it is not an archive.
+        """
+        added = duplicates = failed = 0
+        checksum = None
+        raw_texts: list[RawText] = []
+        try:
+            for document in iter_documents(filename):
+                raw_text = self.read_document(
+                    document,
+                    separator,
+                    use_regex,
+                    min(self.small_file_size, self.block_size),
+                )
+                if raw_text is None:
+                    failed += 1
+                elif raw_text.checksum:
+                    raw_texts.append(raw_text)
+                    checksum = raw_text.checksum
+                elif streamed := self.stream_document(session, document, raw_text):
+                    checksum, was_added = streamed
+                    added += was_added
+                    duplicates += not was_added
+                else:
+                    failed += 1
+                if len(raw_texts) >= batch_size:
+                    count = self.db.create_raw_texts(session, raw_texts)
+                    added += count
+                    duplicates += len(raw_texts) - count
+                    raw_texts = []
+                if document.name != filename:
+                    checksum = None
+        except Exception as e:
+            log_read_error(filename, e)
+            failed += 1
+        count = self.db.create_raw_texts(session, raw_texts)
+        added += count
+        duplicates += len(raw_texts) - count
+        return added, duplicates, failed, checksum
+
     def import_file(
         self, filename: str, separator: str = "", use_regex: bool = False
     ) -> None:
-        raw_text = self.read_file(filename, separator, use_regex)
-        if raw_text:
-            session = Session(self.db.engine)
-            self.db.create_raw_text(session, raw_text)
-            logger.info(f"Loaded {filename}")
+        """
+        Import a textfile, or each file in an archive, reading long ones a
+        block at a time so memory use stays flat regardless of their size.
+        Compressed files are decompressed as they are read. A file is not
+        read again if its size and modification time are those recorded when
+        it was imported.
+        """
+        with Session(self.db.engine) as session:
+            path = os.path.abspath(filename)
+            stat = stat_file(filename)
+            if is_unchanged(
+                stat, self.db.read_imported_files(session, [path]).get(path)
+            ):
+                logger.info(f"Skipped {filename}, unchanged since it was imported")
+                return
+            added, duplicates, _, checksum = self.import_documents(
+                session, filename, separator, use_regex
+            )
+            if checksum:
+                self.db.record_imported_files(
+                    session, manifest_entry(filename, stat, checksum)
+                )
+                session.commit()
+            if added or duplicates:
+                logger.info(f"Loaded {filename}")
 
     def import_files(
         self, filenames: list[str], separator: str = "", use_regex: bool = False
@@ -48,3 +357,114 @@ class Loader:
         logger.info(f"Reading files with {regex} separator: {separator}")
         for filename in filenames:
             self.import_file(filename, separator, use_regex)
+
+    def read_small_file(
+        self, filename: str, separator: str = "", use_regex: bool = False
+    ) -> Optional[RawText]:
+        """
+        Read and checksum a textfile for a bulk import. An archive or a file
+        longer than `small_file_size` characters, or a block if that is
+        smaller, is returned without content or checksum, to be imported
+        document by document instead.
+        """
+        try:
+            f = open(filename, "rb")
+        except Exception as e:
+            log_read_error(filename, e)
+            return None
+        with f:
+            try:
+                header = f.read(HEADER_SIZE)
+                archive = is_archive(filename, header)
+            except Exception as e:
+                log_read_error(filename, e)
+                return None
+            if archive:
+                return RawText(separator=separator, use_regex=use_regex)
+            opener: Callable[[], IO[bytes]]
+            if compression_of(header):
+                opener = partial(open_decompressed, filename, header)
+            else:
+                # Read the text through the file its header was read from
+                f.seek(0)
+                opener = lambda: f
+            return self.read_document(
+                Document(filename, opener),
+                separator,
+                use_regex,
+                min(self.small_file_size, self.block_size),
+            )
+
+    def bulk_import_files(
+        self,
+        filenames: list[str],
+        separator: str = "",
+        use_regex: bool = False,
+        workers: int = 8,
+        batch_size: int = 1000,
+    ) -> tuple[int, int, int, int]:
+        """
+        Import many textfiles through one session, reading and checksumming
+        them in `workers` threads and committing `batch_size` files at a time.
+        Archives and files longer than `small_file_size` characters are
+        imported as in import_file, so no more than `batch_size` times that
+        is held in memory, and files unchanged since they were imported are
+        not read at all.
+
+        Returns the number of files added, unchanged, skipped as duplicates,
+        and failed, counting each document in an archive as a file.
+        """
+        regex = (use_regex and "regex") or ""
+        logger.info(f"Bulk reading files with {regex} separator: {separator}")
+        started_at = time.perf_counter()
+        added = unchanged = duplicates = failed = 0
+        with Session(self.db.engine) as session, ThreadPoolExecutor(workers) as pool:
+            for i in range(0, len(filenames), batch_size):
+                batch = filenames[i : i + batch_size]
+                imported = self.db.read_imported_files(
+                    session, [os.path.abspath(filename) for filename in batch]
+                )
+                changed = []
+                for filename, stat in zip(batch, pool.map(stat_file, batch)):
+                    if is_unchanged(stat, imported.get(os.path.abspath(filename))):
+                        unchanged += 1
+                    else:
+                        changed.append((filename, stat))
+
+                raw_texts = []
+                entries = []
+                for (filename, stat), raw_text in zip(
+                    changed,
+                    pool.map(
+                        self.read_small_file,
+                        [filename for filename, _ in changed],
+                        repeat(separator),
+                        repeat(use_regex),
+                    ),
+                ):
+                    if raw_text is None:
+                        failed += 1
+                    elif raw_text.checksum:
+                        raw_texts.append(raw_text)
+                        entries += manifest_entry(filename, stat, raw_text.checksum)
+                    else:
+                        counts = self.import_documents(
+                            session, filename, separator, use_regex, batch_size
+                        )
+                        added += counts[0]
+                        duplicates += counts[1]
+                        failed += counts[2]
+                        if counts[3]:
+                            entries += manifest_entry(filename, stat, counts[3])
+                self.db.record_imported_files(session, entries)
+                count = self.db.create_raw_texts(session, raw_texts)
+                added += count
+                duplicates += len(raw_texts) - count
+                logger.info(f"Imported {i + len(batch)} of {len(filenames)} files")
+        seconds = time.perf_counter() - started_at
+        logger.info(
+            f"Added {added} files, skipped {unchanged} unchanged files, "
+            f"{duplicates} duplicates and {failed} unreadable files in "
+            f"{seconds:.1f}s ({len(filenames) / max(seconds, 1e-9):.0f} files/s)"
+        )
+        return added, unchanged, duplicates, failed
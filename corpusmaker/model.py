@@ -2,9 +2,15 @@
 Model for storing text
 """
 
-from typing import Optional
+from typing import Iterable, Optional
 
-from sqlmodel import Field, SQLModel
+from enum import StrEnum
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.orm import QueryContext, Session, object_session, registry
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlmodel import Field, SQLModel, col, select
+from corpusmaker.chunker import span_text
 from datetime import datetime, timezone
 
 
@@ -13,7 +19,9 @@ class RawText(SQLModel, table=True):
         default=None, primary_key=True, description="The ID of the raw text"
     )
     content: str = Field(description="The content of the raw text")
-    checksum: str = Field(description="The checksum of the raw text")
+    checksum: str = Field(
+        unique=True, index=True, description="The checksum of the raw text"
+    )
     separator: str = Field(
         default="", description="The separator that delineates sections of the raw text"
     )
@@ -26,18 +34,329 @@ class RawText(SQLModel, table=True):
         nullable=False,
         description="The timestamp of when the raw text was added",
     )
+    # Kept last, so SQLite can reserve space for it without allocating it
+    encoded_content: Optional[bytes] = Field(
+        default=None,
+        description="The UTF-8 content of a raw text written a block at a time, "
+        "in which case content is empty",
+    )
+
+
+def decode_raw_text_content(content: Optional[str], encoded: Optional[bytes]) -> str:
+    """
+    The content of a raw text, whether it is stored as text or as UTF-8 bytes
+    """
+    if encoded is not None:
+        return encoded.decode("utf-8")
+    return content or ""
+
+
+class SceneStatus(StrEnum):
+    PENDING = "pending"
+    IN_FLIGHT = "in_flight"
+    DONE = "done"
+    FAILED = "failed"
 
 
 class Scene(SQLModel, table=True):
     id: Optional[int] = Field(
         default=None, primary_key=True, description="The ID of the scene"
     )
-    content: str = Field(description="The content of the scene")
-    checksum: str = Field(description="The checksum of the scene")
-    text_id: int = Field(foreign_key="rawtext.id", description="The parent raw text")
+    content: str = Field(
+        description="The content of the scene, empty if it is read from its raw text"
+    )
+    checksum: str = Field(
+        unique=True, index=True, description="The checksum of the scene"
+    )
+    text_id: int = Field(
+        foreign_key="rawtext.id", index=True, description="The parent raw text"
+    )
+    start: Optional[int] = Field(
+        default=None, description="The offset where the scene starts in its raw text"
+    )
+    end: Optional[int] = Field(
+        default=None, description="The offset where the scene ends in its raw text"
+    )
+    start_byte: Optional[int] = Field(
+        default=None,
+        description="The offset where the scene starts in the UTF-8 content of its raw text",
+    )
+    end_byte: Optional[int] = Field(
+        default=None,
+        description="The offset where the scene ends in the UTF-8 content of its raw text",
+    )
+    joined: bool = Field(
+        default=False,
+        description="Determines whether the scene is the lines of its span joined by spaces",
+    )
     summary: str = Field(default="", description="The generated summary of the scene")
+    status: str = Field(
+        default=SceneStatus.PENDING,
+        index=True,
+        description="The summarization status of the scene",
+    )
+    attempts: int = Field(
+        default=0, description="The number of summarization requests sent so far"
+    )
+    last_error: str = Field(
+        default="", description="The error from the last failed summarization request"
+    )
+    lease_owner: str = Field(
+        default="", description="The summarizer worker that has claimed the scene"
+    )
+    lease_expires_at: Optional[datetime] = Field(
+        default=None,
+        index=True,
+        description="The timestamp after which the claim on the scene can be taken over",
+    )
+    summarized_at: Optional[datetime] = Field(
+        default=None,
+        index=True,
+        description="The timestamp of when the summary was last written",
+    )
+    summary_seq: Optional[int] = Field(
+        default=None,
+        index=True,
+        description="The order in which the summary was committed, assigned by the transaction that wrote it",
+    )
+    duplicate_of: Optional[int] = Field(
+        default=None,
+        index=True,
+        description="The earlier scene this scene is a near-duplicate of",
+    )
     created_at: datetime = Field(
         default=datetime.now(timezone.utc),
         nullable=False,
         description="The timestamp of when the scene was added",
     )
+
+
+def read_raw_text_content(session: Session, text_id: int) -> str:
+    """
+    The content of a raw text, keeping the last one read on the session, as
+    scenes are mostly read in the order of their raw text
+    """
+    cached = session.info.get("raw_text_content")
+    if not cached or cached[0] != text_id:
+        row = (
+            session.connection()
+            .execute(
+                select(RawText.content, RawText.encoded_content).where(
+                    RawText.id == text_id
+                )
+            )
+            .one_or_none()
+        )
+        content = decode_raw_text_content(*row) if row else ""
+        cached = session.info["raw_text_content"] = (text_id, content)
+    return str(cached[1])
+
+
+def read_raw_text_span(
+    session: Session, text_id: int, start_byte: int, end_byte: int
+) -> Optional[str]:
+    """
+    The text between two offsets into the UTF-8 content of a raw text, read
+    with SQLite incremental blob I/O so the rest of the content is never
+    loaded, or None if the database is not SQLite
+    """
+    connection = session.connection()
+    if connection.dialect.name != "sqlite":
+        return None
+    encoded = connection.execute(
+        select(col(RawText.encoded_content).is_not(None)).where(RawText.id == text_id)
+    ).scalar_one()
+    driver_connection = connection.connection.driver_connection
+    assert isinstance(driver_connection, sqlite3.Connection)
+    # Content stored as text is UTF-8 in the database too, so it is read the same way
+    column = "encoded_content" if encoded else "content"
+    with driver_connection.blobopen("rawtext", column, text_id, readonly=True) as blob:
+        blob.seek(start_byte)
+        return blob.read(end_byte - start_byte).decode("utf-8")
+
+
+def read_scene_content(
+    session: Session,
+    text_id: int,
+    start: int,
+    end: int,
+    start_byte: Optional[int],
+    end_byte: Optional[int],
+    joined: bool,
+) -> str:
+    """
+    The content of a scene stored as offsets into its raw text. Only the
+    span of the scene is read, unless it was stored without byte offsets.
+    """
+    span = None
+    if start_byte is not None and end_byte is not None:
+        span = read_raw_text_span(session, text_id, start_byte, end_byte)
+    if span is None:
+        return span_text(read_raw_text_content(session, text_id), start, end, joined)
+    return span_text(span, 0, len(span), joined)
+
+
+def is_stored_as_span(scene: Scene) -> bool:
+    """
+    Whether the content of a loaded scene has to be read from its raw text
+    """
+    values = scene.__dict__
+    return (
+        values.get("content") == ""
+        and values.get("start") is not None
+        and values.get("end") is not None
+    )
+
+
+def load_scene_content(scene: Scene) -> None:
+    """
+    Fill in the content of a scene stored as offsets into its raw text
+    """
+    session = object_session(scene)
+    if not session or not is_stored_as_span(scene):
+        return
+    values = scene.__dict__
+    content = read_scene_content(
+        session,
+        values["text_id"],
+        values["start"],
+        values["end"],
+        values.get("start_byte"),
+        values.get("end_byte"),
+        values.get("joined", False),
+    )
+    set_committed_value(scene, "content", content)
+
+
+def load_raw_text_content(raw_text: RawText) -> None:
+    """
+    Decode the content of a raw text stored as UTF-8 bytes, dropping the
+    bytes so the text is only held once
+    """
+    encoded = raw_text.__dict__.get("encoded_content")
+    if encoded is not None:
+        set_committed_value(raw_text, "content", encoded.decode("utf-8"))
+        set_committed_value(raw_text, "encoded_content", None)
+
+
+@event.listens_for(RawText, "load")
+def on_raw_text_load(raw_text: RawText, context: QueryContext) -> None:
+    load_raw_text_content(raw_text)
+
+
+@event.listens_for(RawText, "refresh")
+def on_raw_text_refresh(
+    raw_text: RawText,
+    context: Optional[QueryContext],
+    attributes: Optional[Iterable[str]],
+) -> None:
+    load_raw_text_content(raw_text)
+
+
+@event.listens_for(Scene, "load")
+def on_scene_load(scene: Scene, context: QueryContext) -> None:
+    # Expired, so the span is only read once the content is used
+    session = object_session(scene)
+    if session and is_stored_as_span(scene):
+        session.expire(scene, ["content"])
+
+
+@event.listens_for(Scene, "refresh")
+def on_scene_refresh(
+    scene: Scene, context: Optional[QueryContext], attributes: Optional[Iterable[str]]
+) -> None:
+    if attributes is None or "content" in attributes:
+        load_scene_content(scene)
+
+
+class RequestTelemetry(SQLModel, table=True):
+    id: Optional[int] = Field(
+        default=None, primary_key=True, description="The ID of the request"
+    )
+    checksum: str = Field(
+        index=True, description="The checksum of the scene that was summarized"
+    )
+    model: str = Field(description="The model that answered the request")
+    prompt_tokens: int = Field(default=0, description="The tokens in the prompt")
+    completion_tokens: int = Field(
+        default=0, description="The tokens in the completion"
+    )
+    latency: float = Field(description="The seconds taken to receive the response")
+    finish_reason: str = Field(
+        default="", description="The reason the model stopped generating"
+    )
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        nullable=False,
+        description="The timestamp of when the response was received",
+    )
+
+
+class SceneSignature(SQLModel, table=True):
+    scene_id: int = Field(
+        primary_key=True, foreign_key="scene.id", description="The signed scene"
+    )
+    signature: bytes = Field(description="The MinHash signature of the scene")
+
+
+class LshBucket(SQLModel, table=True):
+    band: int = Field(primary_key=True, description="The band of the signature")
+    bucket: int = Field(
+        primary_key=True, description="The hash of the signature within the band"
+    )
+    scene_id: int = Field(
+        primary_key=True, foreign_key="scene.id", description="The indexed scene"
+    )
+
+
+class ExportWatermark(SQLModel, table=True):
+    target: str = Field(
+        primary_key=True, description="The export file the watermark belongs to"
+    )
+    summarized_at: Optional[datetime] = Field(
+        default=None, description="The summary timestamp of the last exported scene"
+    )
+    scene_id: int = Field(default=0, description="The ID of the last exported scene")
+    summary_seq: int = Field(
+        default=0, description="The summary sequence number of the last exported scene"
+    )
+    parts: int = Field(default=0, description="The number of parts exported so far")
+    exported_at: Optional[datetime] = Field(
+        default=None, description="The timestamp of the last export"
+    )
+
+
+class ImportedFile(SQLModel, table=True):
+    path: str = Field(primary_key=True, description="The absolute path of the file")
+    size: int = Field(description="The size of the file in bytes when it was read")
+    mtime_ns: int = Field(
+        description="The modification time of the file in nanoseconds when it was read"
+    )
+    checksum: str = Field(
+        index=True, description="The checksum of the raw text read from the file"
+    )
+    imported_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        nullable=False,
+        description="The timestamp of when the file was last read",
+    )
+
+
+class CacheModel(SQLModel, registry=registry()):
+    """
+    Base for tables kept in the summary cache file instead of the corpus database
+    """
+
+
+class CachedSummary(CacheModel, table=True):
+    model: str = Field(primary_key=True, description="The model that wrote the summary")
+    prompt_digest: str = Field(
+        primary_key=True, description="The sha256 digest of the system prompt"
+    )
+    checksum: str = Field(primary_key=True, description="The checksum of the scene")
+    summary: str = Field(description="The generated summary of the scene")
+    used_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        index=True,
+        description="The timestamp of when the summary was last stored or read",
+    )
@@ -0,0 +1,94 @@
+"""
+Planning operations for Corpusmaker
+"""
+
+from typing import Callable, Iterable, Optional
+
+from dataclasses import dataclass
+from loguru import logger
+
+Tokenizer = Callable[[str], int]
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def get_tokenizer(model: str) -> Tokenizer:
+    """
+    Count tokens with tiktoken if it is installed, otherwise fall back to
+    counting whitespace-separated words
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken is not installed, counting words instead of tokens")
+        return count_words
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+@dataclass
+class Planner:
+    system_prompt: str
+    model: str
+    tokenizer: Optional[Tokenizer] = None
+    completion_tokens: int = 256
+    # Chat formatting adds about 3 tokens per message plus 3 to prime the reply
+    message_tokens: int = 9
+
+    def __post_init__(self) -> None:
+        self.count_tokens = self.tokenizer or get_tokenizer(self.model)
+
+    def plan(
+        self,
+        contents: Iterable[str],
+        input_price: float = 0.0,
+        output_price: float = 0.0,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        concurrency: int = 1,
+        latency: float = 10.0,
+    ) -> dict[str, float]:
+        """
+        Count the tokens needed to summarize each scene, and estimate the
+        cost and the wall-clock time it will take under the given limits
+        """
+        system_tokens = self.count_tokens(self.system_prompt) + self.message_tokens
+        requests = prompt_tokens = largest = 0
+        for content in contents:
+            tokens = system_tokens + self.count_tokens(content)
+            requests += 1
+            prompt_tokens += tokens
+            largest = max(largest, tokens)
+        completion_tokens = requests * self.completion_tokens
+        tokens = prompt_tokens + completion_tokens
+
+        # The run takes as long as its tightest constraint allows
+        seconds = requests * latency / max(concurrency, 1)
+        if requests_per_minute:
+            seconds = max(seconds, requests * 60 / requests_per_minute)
+        if tokens_per_minute:
+            seconds = max(seconds, tokens * 60 / tokens_per_minute)
+        return {
+            "requests": requests,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "largest_prompt_tokens": largest,
+            "cost": (prompt_tokens * input_price + completion_tokens * output_price)
+            / 1_000_000,
+            "seconds": seconds,
+        }
+
+    def report(self, plan: dict[str, float]) -> None:
+        logger.info(
+            f"{plan['requests']:.0f} scenes to summarize with {self.model}: "
+            f"{plan['prompt_tokens']:.0f} prompt tokens "
+            f"(largest request {plan['largest_prompt_tokens']:.0f}), "
+            f"about {plan['completion_tokens']:.0f} completion tokens"
+        )
+        logger.info(f"Estimated cost: ${plan['cost']:.2f}")
+        logger.info(f"Estimated time: {plan['seconds'] / 3600:.1f} hours")
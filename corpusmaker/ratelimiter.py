@@ -0,0 +1,106 @@
+"""
+Rate limiting operations for Corpusmaker
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+from loguru import logger
+
+
+@dataclass
+class RateLimiter:
+    """
+    Token buckets for an account's requests-per-minute and tokens-per-minute limits
+
+    A limit of 0 means unlimited. Buckets refill continuously and are filled
+    only to `headroom` of the real limit, so dispatch stays just under it.
+    """
+
+    requests_per_minute: int = 0
+    tokens_per_minute: int = 0
+    completion_tokens: int = 256
+    headroom: float = 0.95
+    clock: Callable[[], float] = time.monotonic
+    request_capacity: float = field(init=False)
+    token_capacity: float = field(init=False)
+    requests: float = field(init=False)
+    tokens: float = field(init=False)
+    updated_at: float = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.request_capacity = self.requests_per_minute * self.headroom
+        self.token_capacity = self.tokens_per_minute * self.headroom
+        self.requests = self.request_capacity
+        self.tokens = self.token_capacity
+        self.updated_at = self.clock()
+
+    def estimate_tokens(self, content: str) -> int:
+        """
+        Estimate the tokens a request will cost from its length, at roughly
+        four characters per token, plus an allowance for the completion
+        """
+        return len(content) // 4 + 1 + self.completion_tokens
+
+    def refill(self) -> None:
+        now = self.clock()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.requests = min(
+            self.request_capacity,
+            self.requests + elapsed * self.request_capacity / 60,
+        )
+        self.tokens = min(
+            self.token_capacity, self.tokens + elapsed * self.token_capacity / 60
+        )
+
+    def delay(self, tokens: int) -> float:
+        """
+        Seconds to wait before a request costing `tokens` fits in both buckets
+        """
+        self.refill()
+        delay = 0.0
+        if self.requests_per_minute:
+            # A bucket smaller than one request waits for a full bucket
+            missing = min(1, self.request_capacity) - self.requests
+            if missing > 0:
+                delay = max(delay, missing * 60 / self.request_capacity)
+        if self.tokens_per_minute:
+            # A request larger than the whole bucket waits for a full bucket
+            missing = min(tokens, self.token_capacity) - self.tokens
+            if missing > 0:
+                delay = max(delay, missing * 60 / self.token_capacity)
+        return delay
+
+    def take(self, tokens: int) -> None:
+        if self.requests_per_minute:
+            self.requests -= 1
+        if self.tokens_per_minute:
+            self.tokens -= tokens
+
+    def wait(self, tokens: int) -> None:
+        """
+        Block until a request costing `tokens` can be sent, then reserve it
+        """
+        while (delay := self.delay(tokens)) > 0:
+            logger.debug(f"Rate limit reached, waiting {delay:.2f}s")
+            time.sleep(delay)
+        self.take(tokens)
+
+    async def acquire(self, tokens: int) -> None:
+        """
+        Wait without blocking the event loop until a request costing `tokens`
+        can be sent, then reserve it
+        """
+        while (delay := self.delay(tokens)) > 0:
+            logger.debug(f"Rate limit reached, waiting {delay:.2f}s")
+            await asyncio.sleep(delay)
+        self.take(tokens)
+
+    def record(self, estimated: int, actual: int) -> None:
+        """
+        Settle a reservation against the usage reported by the API
+        """
+        if self.tokens_per_minute:
+            self.tokens = min(self.token_capacity, self.tokens + estimated - actual)
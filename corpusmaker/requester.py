@@ -2,28 +2,128 @@
 API operations for Corpusmaker
 """
 
+from typing import Optional
+
+import os
+import time
 from dataclasses import dataclass
-from openai import OpenAI
+from functools import cached_property
+import httpx
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionMessageParam
+from corpusmaker.ratelimiter import RateLimiter
+from corpusmaker.telemetry import Telemetry
 
 
 @dataclass
 class Requester:
-    client = OpenAI()
     system_prompt: str
     model: str
+    limiter: Optional[RateLimiter] = None
+    telemetry: Optional[Telemetry] = None
+    base_url: str = ""
+    timeout: float = 600.0
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+
+    def api_key(self) -> Optional[str]:
+        """
+        OpenAI-compatible local servers usually ignore the API key, so one is
+        only required for the default OpenAI endpoint
+        """
+        if self.base_url:
+            return os.environ.get("OPENAI_API_KEY", "none")
+        return None
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+        )
+
+    @cached_property
+    def client(self) -> OpenAI:
+        """
+        The sync client, built on first use and reused for its connection pool.
+        Retries are left to the Summarizer, which records each attempt.
+        """
+        return OpenAI(
+            api_key=self.api_key(),
+            base_url=self.base_url or None,
+            timeout=self.timeout,
+            max_retries=0,
+            http_client=httpx.Client(
+                limits=self.limits(), timeout=self.timeout, follow_redirects=True
+            ),
+        )
+
+    @cached_property
+    def async_client(self) -> AsyncOpenAI:
+        """
+        The async client, built on first use and reused for its connection pool
+        """
+        return AsyncOpenAI(
+            api_key=self.api_key(),
+            base_url=self.base_url or None,
+            timeout=self.timeout,
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=self.limits(), timeout=self.timeout, follow_redirects=True
+            ),
+        )
+
+    async def aclose(self) -> None:
+        """
+        Close the async client, whose connections belong to the current event loop
+        """
+        if "async_client" in self.__dict__:
+            await self.__dict__.pop("async_client").close()
+
+    def make_messages(self, content: str) -> list[ChatCompletionMessageParam]:
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": content},
+        ]
+
+    def estimate_tokens(self, content: str) -> int:
+        if self.limiter:
+            return self.limiter.estimate_tokens(self.system_prompt + content)
+        return 0
+
+    def record_usage(
+        self, content: str, estimated: int, completion: ChatCompletion, latency: float
+    ) -> None:
+        if self.limiter and completion.usage:
+            self.limiter.record(estimated, completion.usage.total_tokens)
+        if self.telemetry:
+            self.telemetry.record(content, completion, latency)
 
     def generate_summary(self, content: str) -> str:
         """
         Summarize the provided text
         """
-        return str(
-            self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": content},
-                ],
-            )
-            .choices[0]
-            .message.content
+        estimated = self.estimate_tokens(content)
+        if self.limiter:
+            self.limiter.wait(estimated)
+        started_at = time.monotonic()
+        completion = self.client.chat.completions.create(
+            model=self.model,
+            messages=self.make_messages(content),
+        )
+        self.record_usage(content, estimated, completion, time.monotonic() - started_at)
+        return str(completion.choices[0].message.content)
+
+    async def agenerate_summary(self, content: str) -> str:
+        """
+        Summarize the provided text without blocking the event loop
+        """
+        estimated = self.estimate_tokens(content)
+        if self.limiter:
+            await self.limiter.acquire(estimated)
+        started_at = time.monotonic()
+        completion = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=self.make_messages(content),
         )
+        self.record_usage(content, estimated, completion, time.monotonic() - started_at)
+        return str(completion.choices[0].message.content)
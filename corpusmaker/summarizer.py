@@ -0,0 +1,207 @@
+"""
+Summarization operations for Corpusmaker
+"""
+
+from typing import Optional
+
+import asyncio
+import os
+import random
+import socket
+import time
+from dataclasses import dataclass, field
+from openai import APIConnectionError, InternalServerError, RateLimitError
+from sqlmodel import Session
+from corpusmaker.cache import SummaryCache
+from corpusmaker.database import Database
+from corpusmaker.model import Scene, SceneStatus
+from corpusmaker.requester import Requester
+from corpusmaker.writer import SummaryWriter
+from loguru import logger
+
+TRANSIENT_ERRORS = (APIConnectionError, InternalServerError, RateLimitError)
+
+
+@dataclass
+class Summarizer:
+    db: Database
+    requester: Requester
+    concurrency: int = 1
+    cache: Optional[SummaryCache] = None
+    max_attempts: int = 5
+    backoff_base: float = 1.0
+    backoff_cap: float = 60.0
+    write_batch_size: int = 100
+    flush_interval: float = 1.0
+    writer: Optional[SummaryWriter] = field(default=None, init=False)
+
+    def apply_cache(self, session: Session, scenes: list[Scene]) -> list[Scene]:
+        """
+        Fill in summaries already in the cache, returning the scenes still to request
+        """
+        if not self.cache:
+            return scenes
+        prompt_digest = self.cache.digest(self.requester.system_prompt)
+        cached = self.cache.get_many(
+            self.requester.model, prompt_digest, [scene.checksum for scene in scenes]
+        )
+        self.db.update_summaries(
+            session,
+            {
+                scene.id: cached[scene.checksum]
+                for scene in scenes
+                if scene.id and scene.checksum in cached
+            },
+        )
+        return [scene for scene in scenes if scene.checksum not in cached]
+
+    def save_summary(self, scene: Scene, summary: str, attempts: int) -> None:
+        if self.writer and scene.id:
+            self.writer.add(scene.id, scene.checksum, summary, attempts)
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Full-jitter exponential backoff before retrying the given attempt
+        """
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2**attempt))
+
+    def handle_error(
+        self,
+        session: Session,
+        scene: Scene,
+        attempt: int,
+        previous_attempts: int,
+        error: Exception,
+    ) -> Optional[float]:
+        """
+        Record a failed request, returning how long to wait before retrying it,
+        or None if the scene should be marked as failed
+        """
+        retry = isinstance(error, TRANSIENT_ERRORS) and attempt < self.max_attempts
+        if scene.id:
+            self.db.update_scene_status(
+                session,
+                scene.id,
+                SceneStatus.IN_FLIGHT if retry else SceneStatus.FAILED,
+                repr(error),
+                previous_attempts + attempt,
+            )
+        if not retry:
+            logger.error(f"Scene {scene.id} failed after {attempt} attempts: {error}")
+            return None
+        delay = self.backoff(attempt)
+        logger.warning(f"Scene {scene.id} failed, retrying in {delay:.1f}s: {error}")
+        return delay
+
+    def summarize_scene(self, session: Session, scene: Scene) -> None:
+        previous_attempts = scene.attempts
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                summary = self.requester.generate_summary(scene.content)
+            except Exception as error:
+                delay = self.handle_error(
+                    session, scene, attempt, previous_attempts, error
+                )
+                if delay is None:
+                    return
+                time.sleep(delay)
+            else:
+                self.save_summary(scene, summary, previous_attempts + attempt)
+                return
+
+    async def asummarize_scene(self, session: Session, scene: Scene) -> None:
+        previous_attempts = scene.attempts
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                summary = await self.requester.agenerate_summary(scene.content)
+            except Exception as error:
+                delay = self.handle_error(
+                    session, scene, attempt, previous_attempts, error
+                )
+                if delay is None:
+                    return
+                await asyncio.sleep(delay)
+            else:
+                self.save_summary(scene, summary, previous_attempts + attempt)
+                return
+
+    def summarize(self, session: Session, scenes: list[Scene]) -> None:
+        """
+        Summarize scenes one request at a time
+        """
+        for scene in scenes:
+            self.summarize_scene(session, scene)
+
+    async def asummarize(self, session: Session, scenes: list[Scene]) -> None:
+        """
+        Summarize scenes with up to `concurrency` requests in flight
+
+        Summaries are queued for the writer, which commits them every
+        `write_batch_size` summaries or `flush_interval` seconds, and `run`
+        flushes whatever is still queued if the run ends or is interrupted, so
+        nothing that has already been paid for is lost.
+        """
+        queue: asyncio.Queue[Scene] = asyncio.Queue()
+        for scene in scenes:
+            queue.put_nowait(scene)
+
+        async def worker() -> None:
+            while not queue.empty():
+                await self.asummarize_scene(session, queue.get_nowait())
+
+        logger.info(
+            f"Summarizing {len(scenes)} scenes with {self.concurrency} requests in flight"
+        )
+        background = []
+        if self.writer:
+            background.append(asyncio.create_task(self.writer.run()))
+        try:
+            async with asyncio.TaskGroup() as group:
+                for _ in range(min(self.concurrency, len(scenes))):
+                    group.create_task(worker())
+        finally:
+            for task in background:
+                task.cancel()
+            await self.requester.aclose()
+
+    def run(self, session: Session, scenes: list[Scene]) -> None:
+        """
+        Summarize scenes, queueing results for the writer, which flushes
+        whatever is left when the run ends or is interrupted
+        """
+        self.writer = SummaryWriter(
+            self.db, session, self.write_batch_size, self.flush_interval
+        )
+        if self.cache:
+            self.writer.cache = self.cache
+            self.writer.model = self.requester.model
+            self.writer.prompt_digest = self.cache.digest(self.requester.system_prompt)
+        try:
+            scenes = self.apply_cache(session, scenes)
+            self.db.mark_in_flight(session, [scene.id for scene in scenes if scene.id])
+            if self.concurrency > 1:
+                asyncio.run(self.asummarize(session, scenes))
+            else:
+                self.summarize(session, scenes)
+        finally:
+            self.writer.flush()
+            if self.requester.telemetry:
+                self.requester.telemetry.flush()
+            if self.cache:
+                self.cache.evict()
+                self.cache.report()
+
+    def run_leased(
+        self,
+        session: Session,
+        claim_size: int = 100,
+        lease_seconds: float = 600,
+        owner: str = "",
+    ) -> None:
+        """
+        Claim and summarize batches of scenes until none are left, so that
+        several workers can share one database without duplicating requests
+        """
+        owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        while scenes := self.db.claim_scenes(session, owner, claim_size, lease_seconds):
+            self.run(session, scenes)
@@ -0,0 +1,143 @@
+"""
+Telemetry operations for Corpusmaker
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from hashlib import md5
+import statistics
+from openai.types.chat import ChatCompletion
+from sqlalchemy import func
+from sqlmodel import Session, col, select
+from corpusmaker.database import Database
+from corpusmaker.model import RequestTelemetry, Scene, SceneStatus
+from loguru import logger
+
+
+def busy_seconds(windows: list[tuple[datetime, datetime]]) -> float:
+    """
+    Return the seconds covered by at least one of the given windows, so
+    overlapping requests are counted once and idle time between runs not at all
+    """
+    busy = 0.0
+    end = None
+    for window_start, window_end in sorted(windows):
+        if end is None or window_start > end:
+            busy += (window_end - window_start).total_seconds()
+            end = window_end
+        elif window_end > end:
+            busy += (window_end - end).total_seconds()
+            end = window_end
+    return busy
+
+
+@dataclass
+class Telemetry:
+    """
+    Record the usage and latency of each API response, keyed by the checksum
+    of the scene that was sent
+    """
+
+    db: Database
+    batch_size: int = 100
+    records: list[RequestTelemetry] = field(default_factory=list, init=False)
+
+    def record(self, content: str, completion: ChatCompletion, latency: float) -> None:
+        usage = completion.usage
+        self.records.append(
+            RequestTelemetry(
+                checksum=md5(content.encode("utf-8")).hexdigest(),
+                model=completion.model,
+                prompt_tokens=usage.prompt_tokens if usage else 0,
+                completion_tokens=usage.completion_tokens if usage else 0,
+                latency=latency,
+                finish_reason=str(completion.choices[0].finish_reason or ""),
+            )
+        )
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.records:
+            with Session(self.db.engine) as session:
+                session.add_all(self.records)
+                session.commit()
+            self.records = []
+
+    def stats(
+        self,
+        session: Session,
+        input_price: float = 0.0,
+        output_price: float = 0.0,
+        model: str = "",
+    ) -> dict[str, float]:
+        """
+        Summarize recorded requests: throughput, latency percentiles, cost at
+        the given prices per million tokens, and the projected time to
+        summarize the remaining scenes at the recorded rate. Rates are taken
+        over the time spent waiting on at least one response, so they are not
+        diluted by the gaps between runs
+        """
+        statement = select(RequestTelemetry)
+        if model:
+            statement = statement.where(RequestTelemetry.model == model)
+        requests = 0
+        prompt_tokens = completion_tokens = 0
+        latencies: list[float] = []
+        windows: list[tuple[datetime, datetime]] = []
+        for record in session.exec(statement):
+            requests += 1
+            prompt_tokens += record.prompt_tokens
+            completion_tokens += record.completion_tokens
+            latencies.append(record.latency)
+            windows.append(
+                (
+                    record.created_at - timedelta(seconds=record.latency),
+                    record.created_at,
+                )
+            )
+        remaining = session.exec(
+            select(func.count())
+            .select_from(Scene)
+            .where(
+                Scene.summary == "",
+                col(Scene.status) != SceneStatus.FAILED,
+                col(Scene.duplicate_of).is_(None),
+            )
+        ).one()
+
+        elapsed = busy_seconds(windows)
+        if len(latencies) > 1:
+            cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+            p50, p95 = cuts[49], cuts[94]
+        else:
+            p50 = p95 = latencies[0] if latencies else 0.0
+        tokens = prompt_tokens + completion_tokens
+        return {
+            "requests": requests,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "tokens_per_second": tokens / elapsed if elapsed else 0.0,
+            "latency_p50": p50,
+            "latency_p95": p95,
+            "cost": (prompt_tokens * input_price + completion_tokens * output_price)
+            / 1_000_000,
+            "remaining_scenes": remaining,
+            "eta_seconds": remaining * elapsed / requests if requests else 0.0,
+        }
+
+    def report(self, stats: dict[str, float]) -> None:
+        logger.info(
+            f"{stats['requests']:.0f} requests, "
+            f"{stats['prompt_tokens']:.0f} prompt tokens, "
+            f"{stats['completion_tokens']:.0f} completion tokens"
+        )
+        logger.info(f"Throughput: {stats['tokens_per_second']:.1f} tokens/s")
+        logger.info(
+            f"Latency: p50 {stats['latency_p50']:.2f}s, p95 {stats['latency_p95']:.2f}s"
+        )
+        logger.info(f"Cost: ${stats['cost']:.4f}")
+        logger.info(
+            f"{stats['remaining_scenes']:.0f} scenes remaining, "
+            f"ETA {stats['eta_seconds'] / 3600:.1f} hours"
+        )
@@ -0,0 +1,66 @@
+"""
+Batched write operations for Corpusmaker
+"""
+
+from typing import Optional
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from sqlmodel import Session
+from corpusmaker.cache import SummaryCache
+from corpusmaker.database import Database
+from loguru import logger
+
+
+@dataclass
+class SummaryWriter:
+    """
+    Queue finished summaries and store them in one transaction every
+    `batch_size` summaries or `interval` seconds, whichever comes first
+    """
+
+    db: Database
+    session: Session
+    batch_size: int = 100
+    interval: float = 1.0
+    cache: Optional[SummaryCache] = None
+    model: str = ""
+    prompt_digest: str = ""
+    summaries: dict[int, str] = field(default_factory=dict, init=False)
+    attempts: dict[int, int] = field(default_factory=dict, init=False)
+    checksums: dict[str, str] = field(default_factory=dict, init=False)
+    flushed_at: float = field(default_factory=time.monotonic, init=False)
+
+    def add(self, scene_id: int, checksum: str, summary: str, attempts: int) -> None:
+        self.summaries[scene_id] = summary
+        self.attempts[scene_id] = attempts
+        self.checksums[checksum] = summary
+        if self.due():
+            self.flush()
+
+    def due(self) -> bool:
+        return len(self.summaries) >= self.batch_size or (
+            bool(self.summaries) and time.monotonic() - self.flushed_at >= self.interval
+        )
+
+    def flush(self) -> None:
+        """
+        Store every queued summary
+        """
+        if self.summaries:
+            logger.info(f"Writing {len(self.summaries)} summaries")
+            self.db.update_summaries(self.session, self.summaries, self.attempts)
+        if self.cache and self.checksums:
+            self.cache.put_many(self.model, self.prompt_digest, self.checksums)
+        self.summaries, self.attempts, self.checksums = {}, {}, {}
+        self.flushed_at = time.monotonic()
+
+    async def run(self) -> None:
+        """
+        Flush queued summaries in the background while requests are in flight
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.due():
+                self.flush()
@@ -2,6 +2,8 @@ from typing import Generator
 from pytest_mock import MockerFixture
 
 import os
+import shutil
+from pathlib import Path
 import pytest
 from sqlmodel import Session
 from corpusmaker.database import Database
@@ -9,6 +11,8 @@ from corpusmaker.model import RawText
 from corpusmaker.loader import Loader
 from corpusmaker.requester import Requester
 from corpusmaker.exporter import Exporter
+from corpusmaker.summarizer import Summarizer
+from corpusmaker.cache import SummaryCache
 from corpusmaker.cli import Cli
 from loguru import logger
 
@@ -116,6 +120,26 @@ def requester(
     yield requester
 
 
+@pytest.fixture
+def summarizer(
+    db_instance_scenes: Database, requester: Requester
+) -> Generator[Summarizer, None, None]:
+    """
+    Create a summarizer over a database of blank scenes
+    """
+    summarizer = Summarizer(db_instance_scenes, requester, concurrency=3)
+    yield summarizer
+
+
+@pytest.fixture
+def cache() -> Generator[SummaryCache, None, None]:
+    """
+    Create an in-memory summary cache
+    """
+    cache = SummaryCache("sqlite://", max_entries=3)
+    yield cache
+
+
 @pytest.fixture
 def db_instance_summaries(
     db_instance_scenes: Database, requester: Requester, session: Session
@@ -145,13 +169,22 @@ def cli() -> Generator[Cli, None, None]:
     filename = "tests/files/test.sqlite3"
     cli = Cli(db_file="sqlite:///" + filename)
     yield cli
+    cli.db.engine.dispose()
     try:
         os.remove(filename)
     except FileNotFoundError:
         logger.error(f"Can't delete missing file: {filename}")
+    for suffix in ["-wal", "-shm"]:
+        if os.path.exists(filename + suffix):
+            os.remove(filename + suffix)
 
 
 @pytest.fixture
-def db_instance_real_summaries() -> Generator[Database, None, None]:
-    db = Database("sqlite:///tests/files/summaries.sqlite3")
+def db_instance_real_summaries(tmp_path: Path) -> Generator[Database, None, None]:
+    """
+    Load a copy of a database made by an earlier version of Corpusmaker
+    """
+    filename = tmp_path / "summaries.sqlite3"
+    shutil.copy("tests/files/summaries.sqlite3", filename)
+    db = Database(f"sqlite:///{filename}")
     yield db
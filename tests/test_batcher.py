@@ -0,0 +1,50 @@
+from typing import Any
+
+from pathlib import Path
+import json
+from corpusmaker.batcher import Batcher
+from corpusmaker.database import Database
+from sqlmodel import Session
+
+
+def test_write_batch_requests(
+    db_instance_scenes: Database, session: Session, tmp_path: Path
+) -> None:
+    """
+    Unsummarized scenes are written as sharded batch requests keyed by scene ID
+    """
+    batcher = Batcher("mock system prompt", "gpt-3.5-turbo", shard_size=2)
+    scenes = db_instance_scenes.find_scenes_without_summaries(session)
+    filenames = batcher.write_requests(scenes, str(tmp_path))
+    assert len(filenames) == 3
+
+    requests: list[dict[str, Any]] = []
+    for filename in filenames:
+        with open(filename) as f:
+            requests.extend(json.loads(line) for line in f)
+    assert [request["custom_id"] for request in requests] == [
+        str(scene.id) for scene in scenes
+    ]
+    assert requests[0]["url"] == "/v1/chat/completions"
+    assert requests[0]["body"]["model"] == "gpt-3.5-turbo"
+    assert requests[0]["body"]["messages"] == [
+        {"role": "system", "content": "mock system prompt"},
+        {"role": "user", "content": scenes[0].content},
+    ]
+
+
+def test_ingest_batch_results(db_instance_scenes: Database, session: Session) -> None:
+    """
+    Successful batch results are stored as summaries, and failed ones and
+    ones for scenes that do not exist are skipped
+    """
+    batcher = Batcher()
+    total = batcher.ingest_results(
+        db_instance_scenes, session, "tests/files/batch_results.jsonl", batch_size=2
+    )
+    assert total == 4
+    for scene_id in [1, 2, 4, 5]:
+        scene = db_instance_scenes.read_scene(session, scene_id)
+        assert scene.summary == f"batch summary {scene_id}"
+    unsummarized = db_instance_scenes.find_scenes_without_summaries(session)
+    assert [scene.id for scene in unsummarized] == [3]
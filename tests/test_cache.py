@@ -0,0 +1,62 @@
+from pytest_mock import MockerFixture
+
+from corpusmaker.cache import SummaryCache
+from corpusmaker.summarizer import Summarizer
+from sqlmodel import Session
+
+
+def test_cache_hits_and_misses(cache: SummaryCache) -> None:
+    """
+    Summaries are found only under the same model, prompt digest and checksum
+    """
+    digest = cache.digest("mock system prompt")
+    cache.put_many("gpt-3.5-turbo", digest, {"abc": "mock summary"})
+    assert cache.get_many("gpt-3.5-turbo", digest, ["abc", "def"]) == {
+        "abc": "mock summary"
+    }
+    assert cache.get_many("gpt-4", digest, ["abc"]) == {}
+    assert cache.get_many("gpt-3.5-turbo", cache.digest("other"), ["abc"]) == {}
+    assert cache.hits == 1
+    assert cache.misses == 3
+
+
+def test_cache_evicts_least_recently_used(cache: SummaryCache) -> None:
+    """
+    Eviction keeps the most recently used summaries up to the size limit
+    """
+    digest = cache.digest("mock system prompt")
+    for checksum in ["a", "b", "c", "d"]:
+        cache.put_many("gpt-3.5-turbo", digest, {checksum: f"summary {checksum}"})
+    cache.get_many("gpt-3.5-turbo", digest, ["a"])
+    cache.evict()
+    assert cache.get_many("gpt-3.5-turbo", digest, ["a", "b", "c", "d"]) == {
+        "a": "summary a",
+        "c": "summary c",
+        "d": "summary d",
+    }
+
+
+def test_summarize_from_cache(
+    mocker: MockerFixture,
+    summarizer: Summarizer,
+    cache: SummaryCache,
+    session: Session,
+) -> None:
+    """
+    Scenes already in the cache are summarized without an API call
+    """
+    cache.max_entries = 100
+    summarizer.cache = cache
+    summarizer.concurrency = 1
+    generate_summary = summarizer.requester.generate_summary
+    scenes = summarizer.db.find_scenes_without_summaries(session)
+    summarizer.run(session, scenes[:2])
+    assert generate_summary.call_count == 2  # type: ignore[attr-defined]
+
+    for scene in scenes[:2]:
+        assert scene.id
+        summarizer.db.update_summary(session, scene.id)
+    summarizer.run(session, summarizer.db.find_scenes_without_summaries(session))
+    assert generate_summary.call_count == 5  # type: ignore[attr-defined]
+    assert cache.hits == 2
+    assert summarizer.db.find_scenes_without_summaries(session) == []
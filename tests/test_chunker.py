@@ -0,0 +1,170 @@
+import random
+import re
+from hashlib import md5
+from pathlib import Path
+
+import pytest
+from corpusmaker.chunker import Chunker, span_text
+
+
+def reference_scenes(
+    content: str, separator: str, use_regex: bool, word_limit: int
+) -> list[str]:
+    """
+    The original list-based scene conversion, kept to check the chunker against
+    """
+    if use_regex:
+        words_by_section = [
+            section.strip().split(" ")
+            for section in re.split(re.compile(separator), content)
+            if section.strip()
+        ]
+    else:
+        words_by_section = [
+            section.strip().split(" ")
+            for section in content.split(separator or "\n")
+            if section.strip()
+        ]
+
+    sections = []
+    previous_words: list[str] = []
+    for index, current_words in enumerate(words_by_section):
+        words = list(previous_words)
+        words.extend(current_words)
+        previous_words = []
+
+        chunk_length = len(words)
+        next_index = index + 1
+
+        if (not separator) and chunk_length < word_limit:
+            if next_index < len(words_by_section):
+                if chunk_length + len(words_by_section[next_index]) < word_limit:
+                    previous_words.extend(words)
+                    continue
+
+        while chunk_length > word_limit:
+            chunk_length = -(-chunk_length // 2)
+
+        chunks = [
+            words[i : i + chunk_length] for i in range(0, len(words), chunk_length)
+        ]
+        sections.extend([" ".join(chunk) for chunk in chunks])
+    return sections
+
+
+def chunk(content: str, separator: str, use_regex: bool, word_limit: int) -> list[str]:
+    chunker = Chunker(content, separator, use_regex, word_limit)
+    return [text for _, _, text in chunker.scenes()]
+
+
+def random_text(rng: random.Random) -> str:
+    pieces = [
+        "word",
+        "a",
+        "longer-word",
+        "naïve",
+        "—",
+        " ",
+        "  ",
+        "\n",
+        "\n\n",
+        "\t",
+        "***",
+        "#",
+    ]
+    weights = [30, 10, 10, 3, 2, 20, 3, 8, 3, 2, 2, 2]
+    return "".join(rng.choices(pieces, weights, k=rng.randint(0, 400)))
+
+
+@pytest.mark.parametrize("word_limit", [1, 2, 5, 10, 60, 100, 8000])
+@pytest.mark.parametrize(
+    "filename,separator,use_regex",
+    [
+        ("test_file_1.txt", "", False),
+        ("test_file_2.txt", "* * * * *", False),
+        ("test_file_3.txt", r"Chapter \d+", True),
+        ("test_file_4.txt", "", False),
+        ("test_file_5.txt", "", False),
+    ],
+)
+def test_chunker_matches_reference_on_files(
+    filename: str, separator: str, use_regex: bool, word_limit: int
+) -> None:
+    """
+    The chunker produces the same scenes as the original algorithm on the test files
+    """
+    content = (Path("tests/files") / filename).read_text()
+    assert chunk(content, separator, use_regex, word_limit) == reference_scenes(
+        content, separator, use_regex, word_limit
+    )
+
+
+@pytest.mark.parametrize(
+    "separator,use_regex",
+    [
+        ("", False),
+        ("***", False),
+        ("\n\n", False),
+        (r"\n+", True),
+        (r"(#)", True),
+        (r"(\*)\*\*", True),
+        ("", True),
+        (r"\b", True),
+    ],
+)
+def test_chunker_matches_reference_on_random_text(
+    separator: str, use_regex: bool
+) -> None:
+    """
+    The chunker produces the same scenes as the original algorithm on random text,
+    including doubled spaces, blank sections and zero-width regex separators
+    """
+    rng = random.Random(separator)
+    for _ in range(200):
+        content = random_text(rng)
+        word_limit = rng.choice([1, 2, 3, 7, 20, 100])
+        assert chunk(content, separator, use_regex, word_limit) == reference_scenes(
+            content, separator, use_regex, word_limit
+        ), (content, word_limit)
+
+
+def test_chunker_spans_match_content_with_separator() -> None:
+    """
+    Scenes that are not merged from several sections are exactly their span
+    """
+    rng = random.Random(0)
+    for _ in range(100):
+        content = random_text(rng)
+        chunker = Chunker(content, "***", False, rng.choice([1, 3, 20]))
+        for start, end, text in chunker.scenes():
+            assert text == content[start:end]
+
+
+def test_chunker_is_lazy() -> None:
+    """
+    Scenes are produced one at a time, without splitting the whole text first
+    """
+    content = "word\n" * 1000000
+    scenes = Chunker(content, word_limit=10).scenes()
+    assert next(scenes) == (0, 44, " ".join(["word"] * 9))
+
+
+@pytest.mark.parametrize(
+    "separator,use_regex",
+    [("", False), ("***", False), (r"(#)", True), ("", True), (r"\b", True)],
+)
+def test_chunker_records_rebuild_scenes(separator: str, use_regex: bool) -> None:
+    """
+    Every scene can be read back from its stored record
+    """
+    rng = random.Random(separator)
+    for _ in range(100):
+        content = random_text(rng)
+        chunker = Chunker(content, separator, use_regex, rng.choice([1, 3, 20]))
+        encoded = content.encode("utf-8")
+        for (start, end, text), record in zip(chunker.scenes(), chunker.records()):
+            _, _, start_byte, end_byte, joined, stored, checksum = record
+            span = encoded[start_byte:end_byte].decode("utf-8")
+            assert span == content[start:end]
+            assert (stored or span_text(span, 0, len(span), joined)) == text
+            assert checksum == md5(text.encode("utf-8")).hexdigest()
@@ -1,6 +1,8 @@
 from pytest_mock import MockerFixture
 
 import json
+import pytest
+from pathlib import Path
 from corpusmaker.cli import Cli
 from sqlmodel import Session
 
@@ -18,6 +20,25 @@ def test_import_files(cli: Cli) -> None:
         assert raw_text.separator == separator
 
 
+def test_bulk_import_files(cli: Cli, tmp_path: Path) -> None:
+    """
+    Patterns are expanded once each, relative or absolute, and files matched
+    by more than one pattern are imported once
+    """
+    for index in range(3):
+        (tmp_path / f"description_{index}.txt").write_text(f"Description {index}")
+    cli.import_files(
+        [str(tmp_path / "description_*.txt"), str(tmp_path / "description_1.txt")],
+        bulk=True,
+        batch_size=2,
+    )
+
+    with Session(cli.db.engine) as session:
+        for index in range(3):
+            raw_text = cli.db.read_raw_text(session, index + 1)
+            assert raw_text.content == f"Description {index}"
+
+
 def test_create_and_summarize_in_stages(mocker: MockerFixture, cli: Cli) -> None:
     filenames = ["tests/files/test_file_5.txt", "tests/files/test_file_2.txt"]
     separator = "* * * * *"
@@ -77,3 +98,80 @@ def test_export_to_jsonl(mocker: MockerFixture, cli: Cli) -> None:
     with open(jsonl, "r", encoding="utf-8-sig") as f:
         content = [json.loads(line) for line in f]
     assert len(content) == 10
+
+
+def test_summarize_in_batch_mode(cli: Cli, tmp_path: Path) -> None:
+    cli.import_files(["tests/files/test_file_5.txt"], "* * * * *")
+    cli.create_scenes()
+    cli.summarize_scenes(
+        "tests/files/system_prompt.txt", mode="batch", batch_dir=str(tmp_path)
+    )
+    with open(tmp_path / "batch_00000.jsonl") as f:
+        assert len(f.readlines()) == 5
+
+    cli.ingest_batch_results(["tests/files/batch_results.jsonl"])
+    with Session(cli.db.engine) as session:
+        assert len(cli.db.find_scenes_with_summaries(session)) == 4
+
+
+def test_connection_limits_reach_requester(cli: Cli) -> None:
+    cli.max_connections = 8
+    cli.max_keepalive_connections = 4
+    requester = cli._make_requester(
+        "tests/files/system_prompt.txt", "gpt-3.5-turbo", 0, 0
+    )
+    assert requester.max_connections == 8
+    assert requester.max_keepalive_connections == 4
+
+
+def test_stats_without_requests(cli: Cli) -> None:
+    cli.import_files(["tests/files/test_file_5.txt"], "* * * * *")
+    cli.create_scenes()
+    cli.stats()
+
+
+def test_incremental_export(mocker: MockerFixture, cli: Cli, tmp_path: Path) -> None:
+    system_prompt = "tests/files/system_prompt.txt"
+    jsonl = str(tmp_path / "scenes.jsonl")
+    mocker.patch(
+        "corpusmaker.requester.Requester.generate_summary",
+        return_value="mock summary",
+    )
+    cli.import_files(["tests/files/test_file_5.txt"], "* * * * *")
+    cli.create_scenes()
+    cli.summarize_scenes(system_prompt)
+    cli.export_summaries(system_prompt, jsonl, incremental=True)
+    cli.export_summaries(system_prompt, jsonl, incremental=True)
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "scenes.part-00000.jsonl"
+    ]
+
+    cli.import_files(["tests/files/test_file_2.txt"], "* * * * *")
+    cli.create_scenes()
+    cli.summarize_scenes(system_prompt)
+    cli.export_summaries(system_prompt, jsonl, incremental=True)
+
+    parts = []
+    for part in ["scenes.part-00000.jsonl", "scenes.part-00001.jsonl"]:
+        with open(tmp_path / part, encoding="utf-8-sig") as f:
+            parts.append([json.loads(line) for line in f])
+    assert [len(part) for part in parts] == [5, 5]
+    assert parts[0][0]["messages"][2]["content"] == "Scene 1"
+    assert parts[1][0]["messages"][2]["content"] != "Scene 1"
+
+
+def test_export_to_parquet(mocker: MockerFixture, cli: Cli, tmp_path: Path) -> None:
+    parquet = pytest.importorskip("pyarrow.parquet")
+    system_prompt = "tests/files/system_prompt.txt"
+    mocker.patch(
+        "corpusmaker.requester.Requester.generate_summary",
+        return_value="mock summary",
+    )
+    cli.import_files(["tests/files/test_file_5.txt"], "* * * * *")
+    cli.create_scenes()
+    cli.summarize_scenes(system_prompt)
+    cli.export_summaries(
+        system_prompt, str(tmp_path / "scenes.jsonl"), chat=False, format="parquet"
+    )
+    rows = parquet.read_table(tmp_path / "scenes.parquet").to_pylist()
+    assert rows[0] == {"prompt": "mock summary", "completion": "Scene 1"}
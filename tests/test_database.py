@@ -1,7 +1,15 @@
+from pytest_mock import MockerFixture
+
 import pytest
+import shutil
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+from corpusmaker import model
 from corpusmaker.database import Database
-from sqlmodel import Session
-from corpusmaker.model import RawText
+from sqlalchemy import inspect
+from sqlmodel import Session, col, select, text
+from corpusmaker.model import RawText, Scene
 
 
 def test_add_raw_text_to_table(
@@ -173,6 +181,24 @@ def test_find_scenes_without_summaries(
         assert scenes[i - 1].id == i
 
 
+def test_update_summaries_skips_missing_scenes(
+    db_instance_scenes: Database, session: Session
+) -> None:
+    """
+    Summaries for scenes that do not exist are skipped, and the rest stored
+    """
+    stored = db_instance_scenes.update_summaries(
+        session, {1: "summary 1", 999: "summary 999", 2: "summary 2"}
+    )
+    assert stored == 2
+    scenes = db_instance_scenes.find_scenes_with_summaries(session)
+    assert [(scene.id, scene.summary) for scene in scenes] == [
+        (1, "summary 1"),
+        (2, "summary 2"),
+    ]
+    assert db_instance_scenes.update_summaries(session, {999: "summary"}) == 0
+
+
 def test_find_scenes_with_summaries(
     db_instance_summaries: Database, session: Session
 ) -> None:
@@ -205,3 +231,272 @@ def test_only_convert_valid_summaries(db_instance_real_summaries: Database) -> N
     with Session(db_instance_real_summaries.engine) as session:
         pcps = db_instance_real_summaries.get_pcps(session, "SUMMARY:")
         assert len(pcps) == 3
+
+
+def test_stream_pcps_filtered_in_sql(db_instance_real_summaries: Database) -> None:
+    """
+    Streamed PCPs are filtered in SQL exactly as a Python substring check would
+    """
+    with Session(db_instance_real_summaries.engine) as session:
+        pcps = db_instance_real_summaries.iter_pcps(session, "SUMMARY:")
+        assert not isinstance(pcps, list)
+        all_pcps = list(db_instance_real_summaries.iter_pcps(session))
+        for filter_for in ["SUMMARY:", "summary:", "%", ""]:
+            assert list(db_instance_real_summaries.iter_pcps(session, filter_for)) == [
+                pcp for pcp in all_pcps if filter_for in pcp["prompt"]
+            ]
+        assert len(list(pcps)) == 3
+
+
+def test_claim_scenes_with_leases(
+    db_instance_scenes: Database, session: Session
+) -> None:
+    """
+    Claimed scenes are not handed to another worker until their lease expires
+    """
+    first = db_instance_scenes.claim_scenes(session, "worker 1", 3, 600)
+    second = db_instance_scenes.claim_scenes(session, "worker 2", 3, 600)
+    assert [scene.id for scene in first] == [1, 2, 3]
+    assert [scene.id for scene in second] == [4, 5]
+    assert db_instance_scenes.claim_scenes(session, "worker 3", 3, 600) == []
+
+    expired = db_instance_scenes.claim_scenes(session, "worker 4", 3, -1)
+    assert expired == []
+    db_instance_scenes.update_summary(session, 4, "An example scene summary.")
+    session.execute(text("UPDATE scene SET lease_expires_at = '2000-01-01'"))
+    session.commit()
+    reclaimed = db_instance_scenes.claim_scenes(session, "worker 4", 10, 600)
+    assert [scene.id for scene in reclaimed] == [1, 2, 3, 5]
+    assert all(scene.lease_owner == "worker 4" for scene in reclaimed)
+
+
+def test_create_scenes_skips_duplicates(
+    db_instance_raw_text: Database, session: Session
+) -> None:
+    """
+    Scenes with a checksum already in the database are counted and skipped
+    """
+    added, skipped = db_instance_raw_text.create_scenes(session, 1, 100)
+    assert added > 0
+    assert skipped == 0
+    assert db_instance_raw_text.create_scenes(session, 1, 100) == (0, added)
+
+    indexes = inspect(db_instance_raw_text.engine).get_indexes("scene")
+    checksum_index = [
+        index for index in indexes if index["name"] == "ix_scene_checksum"
+    ]
+    assert checksum_index[0]["column_names"] == ["checksum"]
+    assert checksum_index[0]["unique"]
+
+
+def test_create_scenes_in_parallel_matches_serial(
+    db_instance_raw_text: Database, session: Session
+) -> None:
+    """
+    Scenes created by a pool of workers are the same, in the same order,
+    as scenes created one text at a time
+    """
+    expected = []
+    checksums = set()
+    for text_id in [1, 2, 3, 4]:
+        for scene in db_instance_raw_text.convert_raw_text_to_scenes(
+            session, text_id, 60
+        ):
+            if scene.checksum not in checksums:
+                checksums.add(scene.checksum)
+                expected.append((text_id, scene.content))
+
+    added, skipped = db_instance_raw_text.create_scenes_in_parallel(
+        session, [1, 2, 3, 4], 60, workers=2
+    )
+    assert added == len(expected)
+    scenes = session.exec(select(Scene).order_by(col(Scene.id))).all()
+    assert [(scene.text_id, scene.content) for scene in scenes] == expected
+
+
+def test_scenes_are_stored_as_offsets(
+    db_instance_raw_text: Database, session: Session
+) -> None:
+    """
+    Scenes are stored as offsets into their raw text, read back with their
+    content, and keep their content when the raw text is deleted
+    """
+    expected = db_instance_raw_text.convert_raw_text_to_scenes(session, 4, 100)
+    db_instance_raw_text.create_scenes(session, 4, 100)
+    stored = session.execute(text("SELECT content, joined FROM scene")).all()
+    assert all(content == "" for content, _ in stored)
+    assert any(joined for _, joined in stored)
+
+    scenes = session.exec(select(Scene).order_by(col(Scene.id))).all()
+    assert [scene.content for scene in scenes] == [scene.content for scene in expected]
+    assert list(db_instance_raw_text.iter_unsummarized_contents(session)) == [
+        scene.content for scene in expected
+    ]
+
+    session.commit()
+    assert scenes[0].content == expected[0].content
+
+    db_instance_raw_text.delete_raw_text(session, 4)
+    session.expunge_all()
+    scenes = session.exec(select(Scene).order_by(col(Scene.id))).all()
+    assert [scene.content for scene in scenes] == [scene.content for scene in expected]
+
+
+def test_scenes_read_only_their_span(
+    db_instance_empty: Database, session: Session, mocker: MockerFixture
+) -> None:
+    """
+    The content of a scene is only read once it is used, and then only its
+    span of the raw text is read, whether the raw text is stored as text or
+    as UTF-8 bytes. Scenes stored without byte offsets read the whole text.
+    """
+    db = db_instance_empty
+    lines = [f"Scène {i} — naïve café\nof {i} words\n***\n" for i in range(20)]
+    db.create_raw_text(session, RawText(content="".join(lines), checksum=""))
+    db.create_raw_text_from_blocks(
+        session, RawText(content="", separator="***"), lambda: reversed(lines)
+    )
+    expected = []
+    for text_id in [1, 2]:
+        expected += [
+            scene.content
+            for scene in db.convert_raw_text_to_scenes(session, text_id, 5)
+        ]
+        db.create_scenes(session, text_id, 5)
+    read_whole_text = mocker.spy(model, "read_raw_text_content")
+
+    session.expunge_all()
+    scenes = session.exec(select(Scene).order_by(col(Scene.id))).all()
+    assert all("content" not in scene.__dict__ for scene in scenes)
+    assert any(scene.joined for scene in scenes)
+    assert [scene.content for scene in scenes] == expected
+    db.update_summaries(session, {scene.id: "Summary" for scene in scenes if scene.id})
+    pcps = db.iter_pcps(session)
+    assert [pcp["completion"] for pcp in pcps] == expected
+    read_whole_text.assert_not_called()
+
+    session.execute(text("UPDATE scene SET start_byte = NULL, end_byte = NULL"))
+    session.expunge_all()
+    scenes = session.exec(select(Scene).order_by(col(Scene.id))).all()
+    assert [scene.content for scene in scenes] == expected
+    read_whole_text.assert_called()
+
+
+def test_stream_pcps_after_watermark(db_instance_real_summaries: Database) -> None:
+    """
+    A watermark moves past each streamed pair, including those summarized
+    before summary timestamps were recorded, so later streams only see newer ones
+    """
+    db = db_instance_real_summaries
+    with Session(db.engine) as session:
+        watermark = db.read_export_watermark(session, "scenes.jsonl")
+        assert len(list(db.iter_pcps(session, watermark=watermark))) == len(
+            db.get_pcps(session)
+        )
+        assert watermark.summarized_at is None
+        assert watermark.summary_seq == 12
+        assert list(db.iter_pcps(session, watermark=watermark)) == []
+
+        db.update_summary(session, 1, "A newer summary.")
+        pcps = list(db.iter_pcps(session, watermark=watermark))
+        assert [pcp["prompt"] for pcp in pcps] == ["A newer summary."]
+        assert watermark.scene_id == 1
+        assert watermark.summarized_at is not None
+        assert watermark.summary_seq == 13
+        assert list(db.iter_pcps(session, watermark=watermark)) == []
+
+
+def test_watermark_follows_commit_order(
+    db_instance_scenes: Database, session: Session, mocker: MockerFixture
+) -> None:
+    """
+    A summary committed after an export is streamed by the next one, even if
+    its writer's clock is behind that of a summary exported already
+    """
+    db = db_instance_scenes
+    watermark = db.read_export_watermark(session, "scenes.jsonl")
+    db.update_summaries(session, {2: "Written by a worker with a fast clock."})
+    pcps = list(db.iter_pcps(session, watermark=watermark))
+    assert [pcp["prompt"] for pcp in pcps] == ["Written by a worker with a fast clock."]
+
+    clock = mocker.patch("corpusmaker.database.datetime")
+    clock.now.return_value = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    db.update_summaries(session, {1: "Written by a worker with a slow clock."})
+    mocker.stopall()
+    pcps = list(db.iter_pcps(session, watermark=watermark))
+    assert [pcp["prompt"] for pcp in pcps] == ["Written by a worker with a slow clock."]
+    assert watermark.scene_id == 1
+    assert watermark.summary_seq == 2
+    assert list(db.iter_pcps(session, watermark=watermark)) == []
+
+
+def test_migrate_numbers_summaries_and_watermarks(tmp_path: Path) -> None:
+    """
+    Summaries in a database made before they were numbered are numbered in
+    the order they were written, and watermarks are moved to match
+    """
+    filename = tmp_path / "summaries.sqlite3"
+    shutil.copy("tests/files/summaries.sqlite3", filename)
+    with sqlite3.connect(filename) as connection:
+        connection.execute(
+            "CREATE TABLE exportwatermark (target VARCHAR NOT NULL PRIMARY KEY,"
+            " summarized_at DATETIME, scene_id INTEGER NOT NULL,"
+            " parts INTEGER NOT NULL, exported_at DATETIME)"
+        )
+        connection.execute(
+            "INSERT INTO exportwatermark VALUES ('scenes.jsonl', NULL, 5, 1, NULL)"
+        )
+    connection.close()
+    db = Database(f"sqlite:///{filename}")
+    with Session(db.engine) as session:
+        scenes = session.exec(select(Scene).order_by(col(Scene.id))).all()
+        assert [scene.summary_seq for scene in scenes] == list(range(1, 13))
+        watermark = db.read_export_watermark(session, "scenes.jsonl")
+        assert watermark.summary_seq == 5
+        assert len(list(db.iter_pcps(session, watermark=watermark))) == 7
+
+
+@pytest.mark.parametrize(
+    "profile,echo,pragmas",
+    [
+        ("debug", True, {"journal_mode": "delete", "synchronous": 2}),
+        (
+            "safe",
+            False,
+            {
+                "journal_mode": "wal",
+                "synchronous": 2,
+                "cache_size": -65536,
+                "mmap_size": 0,
+                "temp_store": 0,
+            },
+        ),
+        (
+            "bulk",
+            False,
+            {
+                "journal_mode": "wal",
+                "synchronous": 0,
+                "cache_size": -262144,
+                "mmap_size": 1 << 30,
+                "temp_store": 2,
+            },
+        ),
+    ],
+)
+def test_database_profiles(
+    tmp_path: Path, profile: str, echo: bool, pragmas: dict[str, str | int]
+) -> None:
+    """
+    A database profile sets statement logging and the pragmas of every connection
+    """
+    db = Database(f"sqlite:///{tmp_path / 'corpus.sqlite3'}", profile)
+    assert db.engine.echo == echo
+    with db.engine.connect() as connection:
+        for name, value in pragmas.items():
+            assert connection.execute(text(f"PRAGMA {name}")).scalar() == value
+
+
+def test_unknown_database_profile() -> None:
+    with pytest.raises(Exception, match="Unknown database profile"):
+        Database("sqlite://", "fast")
@@ -0,0 +1,97 @@
+import random
+import sys
+
+import pytest
+from corpusmaker.database import Database
+from corpusmaker.deduper import Deduper, MinHasher, jaccard, shingle_hashes
+from corpusmaker.model import RawText, Scene
+from sqlmodel import Session, col, select
+
+
+def make_scene(rng: random.Random, words: int = 300) -> str:
+    vocabulary = [f"word{i}" for i in range(2000)]
+    return " ".join(rng.choices(vocabulary, k=words))
+
+
+def edit(rng: random.Random, scene: str, changes: int) -> str:
+    words = scene.split(" ")
+    for _ in range(changes):
+        words[rng.randrange(len(words))] = "changed"
+    return " ".join(words)
+
+
+def add_text(db: Database, session: Session, scenes: list[str]) -> None:
+    raw_text = RawText(content="\n***\n".join(scenes), separator="***")
+    db.create_raw_text(session, raw_text)
+    assert raw_text.id
+    db.create_scenes(session, raw_text.id, 8000)
+
+
+def test_signatures_match_without_numpy(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Signatures are the same whether or not numpy is installed
+    """
+    pytest.importorskip("numpy")
+    hasher = MinHasher()
+    content = make_scene(random.Random(0))
+    signature = hasher.signature(content)
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    assert hasher.signature(content) == signature
+
+
+def test_signatures_estimate_jaccard() -> None:
+    """
+    Signatures estimate the Jaccard similarity of the shingles of two texts,
+    ignoring case and spacing
+    """
+    rng = random.Random(0)
+    hasher = MinHasher(num_perm=256)
+    scene = make_scene(rng)
+    copy = edit(rng, scene, 10)
+    shingles, copy_shingles = (set(shingle_hashes(s, 5)) for s in (scene, copy))
+    expected = len(shingles & copy_shingles) / len(shingles | copy_shingles)
+    estimate = jaccard(hasher.signature(scene), hasher.signature(copy))
+    assert abs(estimate - expected) < 0.1
+    assert hasher.signature(scene) == hasher.signature(
+        scene.upper().replace(" ", "  \n")
+    )
+
+
+def test_dedupe_scenes(db_instance_empty: Database, session: Session) -> None:
+    """
+    Near-duplicates are marked as duplicates of the earliest similar scene and
+    skipped by summarization and export, and later runs only check new scenes
+    """
+    rng = random.Random(0)
+    originals = [make_scene(rng) for _ in range(5)]
+    add_text(db_instance_empty, session, originals + [edit(rng, originals[1], 2)])
+    deduper = Deduper(db_instance_empty, batch_size=4)
+    assert deduper.run(session) == (6, 1)
+
+    add_text(
+        db_instance_empty,
+        session,
+        [edit(rng, originals[3], 3), edit(rng, originals[3], 150), make_scene(rng)],
+    )
+    assert deduper.run(session) == (3, 1)
+    assert deduper.run(session) == (0, 0)
+
+    scenes = session.exec(select(Scene).order_by(col(Scene.id))).all()
+    assert [scene.duplicate_of for scene in scenes] == [
+        None,
+        None,
+        None,
+        None,
+        None,
+        2,
+        4,
+        None,
+        None,
+    ]
+    unsummarized = db_instance_empty.find_scenes_without_summaries(session)
+    assert [scene.id for scene in unsummarized] == [1, 2, 3, 4, 5, 8, 9]
+
+    db_instance_empty.update_summaries(session, {2: "summary", 6: "summary"})
+    assert [pcp["checksum"] for pcp in db_instance_empty.iter_pcps(session)] == [
+        scenes[1].checksum
+    ]
@@ -1,7 +1,22 @@
+from typing import Iterator, Optional
+
+import codecs
+import gzip
+import json
+import random
+import string
+from hashlib import md5
+from pathlib import Path
+
+import pytest
 from corpusmaker.database import Database
-from corpusmaker.exporter import Exporter
+from corpusmaker.exporter import (
+    Exporter,
+    StringEncoder,
+    encode_string_ascii,
+    split_for,
+)
 from sqlmodel import Session
-import json
 
 
 def test_convert_pcp_to_jsonl(exporter: Exporter) -> None:
@@ -28,3 +43,203 @@ def test_export_pcps_to_jsonl(
     for index, pcp in enumerate(pcps):
         jsonline = exporter.convert_pcp_to_chat_completion_jsonline(pcp)
         assert json.loads(jsonl[index]) == jsonline
+
+
+def export_with_json_dump(
+    exporter: Exporter, filename: Path, pcps: list[dict[str, str]], chat: bool
+) -> None:
+    """
+    The original export, kept to check the fast export against
+    """
+    with open(filename, "w", encoding="utf-8-sig") as f:
+        for pcp in pcps:
+            if chat:
+                json.dump(exporter.convert_pcp_to_chat_completion_jsonline(pcp), f)
+            else:
+                json.dump(exporter.convert_pcp_to_legacy_completion_jsonline(pcp), f)
+            f.write("\n")
+
+
+@pytest.mark.parametrize("chat", [True, False])
+@pytest.mark.parametrize("encode_string", [None, encode_string_ascii])
+def test_fast_export_is_byte_identical(
+    tmp_path: Path, chat: bool, encode_string: Optional[StringEncoder]
+) -> None:
+    """
+    The fast export writes exactly the bytes json.dump would, with or without orjson
+    """
+    rng = random.Random(0)
+    alphabet = string.printable + '\x00\x1f\x7f\x80é—😀\ud800"\\'
+    pcps = [
+        {
+            "prompt": "".join(rng.choices(alphabet, k=rng.randint(0, 50))),
+            "completion": "".join(rng.choices(alphabet, k=rng.randint(0, 200))),
+        }
+        for _ in range(500)
+    ]
+    pcps.append({"prompt": "plain ascii", "completion": "plain ascii"})
+    exporter = Exporter('system — prompt\n\t"quoted"', str(tmp_path / "fast.jsonl"))
+    if encode_string:
+        exporter.encode_string = encode_string
+    exporter.export_pcps_to_jsonl(iter(pcps), chat)
+    export_with_json_dump(exporter, tmp_path / "expected.jsonl", pcps, chat)
+    assert (tmp_path / "fast.jsonl").read_bytes() == (
+        tmp_path / "expected.jsonl"
+    ).read_bytes()
+
+
+def make_pcps(count: int) -> list[dict[str, str]]:
+    return [
+        {
+            "prompt": f"summary {index}",
+            "completion": f"scene {index}\n" * (index % 7 + 1),
+            "checksum": md5(str(index).encode("utf-8")).hexdigest(),
+        }
+        for index in range(count)
+    ]
+
+
+def read_shards(filenames: list[str]) -> bytes:
+    data = b""
+    for filename in filenames:
+        if filename.endswith(".gz"):
+            content = gzip.decompress(Path(filename).read_bytes())
+        elif filename.endswith(".zst"):
+            zstandard = pytest.importorskip("zstandard")
+            # Streamed frames do not record their size, so read them as a stream
+            with open(filename, "rb") as f:
+                content = zstandard.ZstdDecompressor().stream_reader(f).read()
+        else:
+            content = Path(filename).read_bytes()
+        assert content.startswith(codecs.BOM_UTF8)
+        data += content.removeprefix(codecs.BOM_UTF8)
+    return data
+
+
+@pytest.mark.parametrize("compression", ["", "gzip", "zstd"])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_export_to_shards(tmp_path: Path, compression: str, workers: int) -> None:
+    """
+    Sharded exports hold the same records, in order, as a single export
+    """
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    pcps = make_pcps(100)
+    single = Exporter("mock system prompt", str(tmp_path / "single.jsonl"))
+    single.export_pcps_to_jsonl(pcps)
+
+    exporter = Exporter(
+        "mock system prompt",
+        str(tmp_path / "scenes.jsonl"),
+        shard_size=30,
+        compression=compression,
+        workers=workers,
+    )
+    filenames = exporter.export_pcps_to_shards(pcps)
+    suffix = {"": "", "gzip": ".gz", "zstd": ".zst"}[compression]
+    assert filenames == [
+        str(tmp_path / f"scenes-{index:05d}.jsonl{suffix}") for index in range(4)
+    ]
+    assert read_shards(filenames) == read_shards([single.filename])
+
+
+def test_export_to_shards_by_bytes(tmp_path: Path) -> None:
+    """
+    Shards stay under the byte limit, leaving room for the byte order mark
+    """
+    exporter = Exporter(
+        "mock system prompt", str(tmp_path / "scenes.jsonl"), shard_bytes=1000
+    )
+    filenames = exporter.export_pcps_to_shards(make_pcps(100))
+    assert len(filenames) > 1
+    for filename in filenames:
+        assert Path(filename).stat().st_size <= 1000 + len(codecs.BOM_UTF8)
+
+
+def test_export_with_validation_split(tmp_path: Path) -> None:
+    """
+    Records are split by checksum, the same way on every run
+    """
+    pcps = make_pcps(200)
+    exporter = Exporter(
+        "mock system prompt",
+        str(tmp_path / "scenes.jsonl"),
+        compression="gzip",
+        validation_fraction=0.2,
+    )
+    filenames = exporter.export_pcps_to_shards(pcps)
+    assert filenames == [
+        str(tmp_path / "scenes.train.jsonl.gz"),
+        str(tmp_path / "scenes.validation.jsonl.gz"),
+    ]
+    first_run = [Path(filename).read_bytes() for filename in filenames]
+
+    validation = read_shards(filenames[1:]).splitlines()
+    expected = [pcp for pcp in pcps if split_for(pcp["checksum"], 0.2) == "validation"]
+    assert 20 < len(validation) < 60
+    assert [json.loads(line)["messages"][1]["content"] for line in validation] == [
+        pcp["prompt"] for pcp in expected
+    ]
+
+    exporter.export_pcps_to_shards(reversed(pcps))
+    exporter.export_pcps_to_shards(pcps)
+    assert [Path(filename).read_bytes() for filename in filenames] == first_run
+
+
+@pytest.mark.parametrize("chat", [True, False])
+def test_export_to_parquet(tmp_path: Path, chat: bool) -> None:
+    """
+    Parquet exports hold the same values as JSONL exports, in bounded row groups
+    """
+    parquet = pytest.importorskip("pyarrow.parquet")
+    pcps = make_pcps(25)
+    exporter = Exporter(
+        "mock system prompt\n",
+        str(tmp_path / "scenes.parquet"),
+        compression="zstd",
+        row_group_size=10,
+    )
+    exporter.export_pcps_to_parquet(iter(pcps), chat)
+    exporter.filename = str(tmp_path / "scenes.jsonl")
+    exporter.export_pcps_to_jsonl(pcps, chat)
+
+    metadata = parquet.ParquetFile(tmp_path / "scenes.parquet").metadata
+    assert [metadata.row_group(i).num_rows for i in range(3)] == [10, 10, 5]
+    assert metadata.row_group(0).column(0).compression == "ZSTD"
+    with open(tmp_path / "scenes.jsonl", encoding="utf-8-sig") as f:
+        expected = [json.loads(line) for line in f]
+    assert parquet.read_table(tmp_path / "scenes.parquet").to_pylist() == expected
+
+
+@pytest.mark.parametrize("compression", ["", "gzip", "zstd"])
+def test_export_streams_unsharded_files(tmp_path: Path, compression: str) -> None:
+    """
+    Compressed and split exports that are not sharded are written as records
+    arrive, rather than held until the end
+    """
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    rng = random.Random(0)
+    exporter = Exporter(
+        "mock system prompt",
+        str(tmp_path / "scenes.jsonl"),
+        buffer_size=4096,
+        compression=compression,
+        validation_fraction=0.5,
+        workers=2,
+    )
+    suffix = {"": "", "gzip": ".gz", "zstd": ".zst"}[compression]
+    train_file = tmp_path / f"scenes.train.jsonl{suffix}"
+
+    def pcps() -> Iterator[dict[str, str]]:
+        for index in range(300):
+            if index == 250:
+                assert train_file.stat().st_size > 500000
+            yield {
+                "prompt": "summary",
+                "completion": "".join(rng.choices(string.ascii_letters, k=10000)),
+                "checksum": md5(str(index).encode("utf-8")).hexdigest(),
+            }
+
+    filenames = exporter.export_pcps_to_shards(pcps())
+    assert len(read_shards(filenames).splitlines()) == 300
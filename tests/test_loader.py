@@ -1,6 +1,23 @@
-from sqlmodel import Session
-from corpusmaker.loader import Loader
-from corpusmaker.model import RawText
+from pytest_mock import MockerFixture
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import subprocess
+import sys
+import tarfile
+import zipfile
+from hashlib import md5
+from pathlib import Path
+
+import pytest
+from sqlmodel import Session, select
+from corpusmaker.chunker import Chunker
+from corpusmaker.database import Database
+from corpusmaker.loader import Loader, is_archive, read_header
+from corpusmaker.model import ImportedFile, RawText
 
 
 def test_read_single_textfile(loader: Loader) -> None:
@@ -55,3 +72,325 @@ def test_import_multiple_textfiles(loader: Loader, session: Session) -> None:
         assert raw_text.separator == separator
         with open(textfile) as f:
             assert raw_text.content == f.read()
+
+
+def test_import_textfile_in_blocks(loader: Loader, session: Session) -> None:
+    """
+    Loader stores the same content and checksum a block at a time, including
+    characters split across blocks, and skips a file that is already stored
+    """
+    loader.block_size = 7
+    textfiles = ["tests/files/test_file_1.txt", "tests/files/test_file_2.txt"]
+    loader.import_files(textfiles + textfiles)
+    raw_texts = session.exec(select(RawText)).all()
+    assert len(raw_texts) == 2
+    for raw_text, textfile in zip(raw_texts, textfiles):
+        with open(textfile) as f:
+            content = f.read()
+        assert raw_text.content == content
+        assert raw_text.checksum == md5(content.encode("utf-8")).hexdigest()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_create_scenes_from_streamed_textfile(
+    loader: Loader, session: Session, workers: int
+) -> None:
+    """
+    Scenes are created from, and read back from, a raw text stored as bytes
+    """
+    loader.block_size = 7
+    loader.import_file("tests/files/test_file_2.txt", "* * * * *")
+    if workers > 1:
+        loader.db.create_scenes_in_parallel(session, [1], 8000, workers)
+    else:
+        loader.db.create_scenes(session, 1, 8000)
+    with open("tests/files/test_file_2.txt") as f:
+        expected = Chunker(f.read(), "* * * * *").scenes()
+    scenes = loader.db.find_scenes_without_summaries(session)
+    assert [scene.content for scene in scenes] == [text for _, _, text in expected]
+
+
+# Imports a file in a fresh process, printing how much its peak RSS grew
+IMPORT_SCRIPT = """
+import resource, sys
+from corpusmaker.database import Database
+from corpusmaker.loader import Loader, is_archive, read_header
+from loguru import logger
+logger.remove()
+loader = Loader(Database(sys.argv[2], sys.argv[3]))
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+loader.import_file(sys.argv[1])
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+"""
+
+
+@pytest.mark.parametrize("profile", ["safe", "bulk"])
+def test_import_large_textfile_with_flat_memory(tmp_path: Path, profile: str) -> None:
+    """
+    Importing a file into a database file holds no more than a few blocks of
+    it in memory, including what SQLite allocates, whatever the profile
+    """
+    textfile = tmp_path / "large.txt"
+    line = "Ünïcödé words and more words, " * 10 + "\n"
+    with open(textfile, "w") as f:
+        for _ in range(200000):
+            f.write(line)
+    pathname = f"sqlite:///{tmp_path / 'corpus.sqlite3'}"
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT, str(textfile), pathname, profile],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": os.getcwd()},
+    )
+    assert textfile.stat().st_size > 60000000
+    # ru_maxrss is in KiB
+    assert int(result.stdout.splitlines()[-1]) < 32 * 1024
+    with Session(Database(pathname).engine) as session:
+        raw_text = session.exec(select(RawText)).one()
+        assert raw_text.content == line * 200000
+        assert raw_text.checksum == md5(textfile.read_bytes()).hexdigest()
+
+
+def test_import_unreadable_textfile(
+    loader: Loader, session: Session, tmp_path: Path
+) -> None:
+    """
+    Loader stores nothing for a file that is not valid text
+    """
+    textfile = tmp_path / "binary.txt"
+    textfile.write_bytes(b"text" * 1000 + b"\xff\xfe")
+    loader.block_size = 100
+    loader.import_file(str(textfile))
+    assert session.exec(select(RawText)).all() == []
+
+
+def test_bulk_import_textfiles(
+    loader: Loader, session: Session, tmp_path: Path
+) -> None:
+    """
+    Loader imports many files through one session in batches, in order,
+    skipping duplicates and unreadable files and streaming large files
+    """
+    filenames = []
+    for index in range(10):
+        textfile = tmp_path / f"description_{index}.txt"
+        textfile.write_text(f"Description {index % 7}\n")
+        filenames.append(str(textfile))
+    (tmp_path / "large.txt").write_text("A large file.\n" * 100)
+    (tmp_path / "binary.txt").write_bytes(b"\xff\xfe")
+    filenames += [str(tmp_path / "large.txt"), str(tmp_path / "binary.txt")]
+    filenames += [str(tmp_path / "missing.txt")]
+    loader.block_size = 1000
+
+    assert loader.bulk_import_files(filenames, "\n", workers=4, batch_size=3) == (
+        8,
+        0,
+        3,
+        2,
+    )
+    raw_texts = session.exec(select(RawText)).all()
+    assert [raw_text.content for raw_text in raw_texts] == [
+        f"Description {index}\n" for index in range(7)
+    ] + ["A large file.\n" * 100]
+    assert all(raw_text.separator == "\n" for raw_text in raw_texts)
+    assert loader.bulk_import_files(filenames[:1]) == (0, 1, 0, 0)
+
+
+def test_bulk_import_streams_medium_textfiles(
+    loader: Loader, session: Session, tmp_path: Path, mocker: MockerFixture
+) -> None:
+    """
+    Files within a block but longer than the small file size are streamed,
+    rather than held in memory with the rest of their batch
+    """
+    (tmp_path / "small.txt").write_text("Small.\n")
+    (tmp_path / "medium.txt").write_text("A medium file.\n" * 20)
+    loader.small_file_size = 100
+    stream_document = mocker.spy(loader, "stream_document")
+    filenames = [str(tmp_path / "small.txt"), str(tmp_path / "medium.txt")]
+    assert loader.bulk_import_files(filenames) == (2, 0, 0, 0)
+    assert stream_document.call_count == 1
+    raw_texts = session.exec(select(RawText)).all()
+    assert {raw_text.content for raw_text in raw_texts} == {
+        "Small.\n",
+        "A medium file.\n" * 20,
+    }
+
+
+# Bulk imports the files in a directory in a fresh process, printing how much
+# its peak RSS grew
+BULK_IMPORT_SCRIPT = """
+import glob, resource, sys
+from corpusmaker.database import Database
+from corpusmaker.loader import Loader
+from loguru import logger
+logger.remove()
+loader = Loader(Database(sys.argv[2]))
+filenames = sorted(glob.glob(sys.argv[1] + "/*.txt"))
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+loader.bulk_import_files(filenames, batch_size=len(filenames))
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+"""
+
+
+def test_bulk_import_with_bounded_memory(tmp_path: Path) -> None:
+    """
+    A batch of files that each fit in a block is not held in memory at once
+    """
+    directory = tmp_path / "texts"
+    directory.mkdir()
+    for index in range(64):
+        (directory / f"text_{index:02d}.txt").write_text(
+            f"Text {index}, " + "words and more words, " * 40000
+        )
+    pathname = f"sqlite:///{tmp_path / 'corpus.sqlite3'}"
+    result = subprocess.run(
+        [sys.executable, "-c", BULK_IMPORT_SCRIPT, str(directory), pathname],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": os.getcwd()},
+    )
+    # ru_maxrss is in KiB
+    assert int(result.stdout.splitlines()[-1]) < 32 * 1024
+    with Session(Database(pathname).engine) as session:
+        assert len(session.exec(select(RawText)).all()) == 64
+
+
+def test_reimport_skips_unchanged_textfiles(
+    loader: Loader, session: Session, tmp_path: Path, mocker: MockerFixture
+) -> None:
+    """
+    Files whose size and modification time are unchanged since they were
+    imported are not read again, unless their raw text was deleted
+    """
+    filenames = []
+    for index in range(4):
+        textfile = tmp_path / f"description_{index}.txt"
+        textfile.write_text(f"Description {index}")
+        filenames.append(str(textfile))
+    assert loader.bulk_import_files(filenames, batch_size=3) == (4, 0, 0, 0)
+    assert len(session.exec(select(ImportedFile)).all()) == 4
+
+    read_small_file = mocker.spy(loader, "read_small_file")
+    assert loader.bulk_import_files(filenames, batch_size=3) == (0, 4, 0, 0)
+    assert read_small_file.call_count == 0
+
+    Path(filenames[0]).write_text("Description 0, revised")
+    Path(filenames[1]).write_text("Description 1")
+    os.utime(filenames[1], ns=(0, 0))
+    session.delete(loader.db.read_raw_text(session, 3))
+    session.commit()
+    assert loader.bulk_import_files(filenames, batch_size=3) == (2, 1, 1, 0)
+    assert read_small_file.call_count == 3
+    assert loader.bulk_import_files(filenames, batch_size=3) == (0, 4, 0, 0)
+
+    read_document = mocker.spy(loader, "read_document")
+    loader.import_file(filenames[0])
+    assert read_document.call_count == 0
+
+
+@pytest.mark.parametrize("compression", ["gzip", "bz2", "xz", "zstd"])
+def test_import_compressed_textfile(
+    loader: Loader, session: Session, tmp_path: Path, compression: str
+) -> None:
+    """
+    Compressed files are detected by their magic bytes, whatever they are
+    named, and stored and checksummed as their text, streamed or whole
+    """
+    content = "Scene one.\n\nScene twö.\n" * 100
+    data = content.encode("utf-8")
+    if compression == "gzip":
+        compressed = gzip.compress(data)
+    elif compression == "bz2":
+        compressed = bz2.compress(data)
+    elif compression == "xz":
+        compressed = lzma.compress(data)
+    else:
+        zstandard = pytest.importorskip("zstandard")
+        compressed = zstandard.ZstdCompressor().compress(data)
+    (tmp_path / "scenes.txt").write_bytes(compressed)
+    (tmp_path / "small.txt").write_bytes(compressed)
+
+    loader.block_size = 1000
+    loader.import_file(str(tmp_path / "scenes.txt"))
+    loader.block_size = 10000
+    loader.import_file(str(tmp_path / "small.txt"))
+    raw_texts = session.exec(select(RawText)).all()
+    assert len(raw_texts) == 1
+    assert raw_texts[0].content == content
+    assert raw_texts[0].checksum == md5(data).hexdigest()
+
+
+def test_import_archives(loader: Loader, session: Session, tmp_path: Path) -> None:
+    """
+    Each file in a zip or tar archive is imported as a raw text, streaming
+    long ones, and the archive is never skipped as unchanged
+    """
+    contents = ["First member.", "Second member.\n" * 100, "Third member."]
+    with zipfile.ZipFile(tmp_path / "texts.zip", "w") as zip_archive:
+        zip_archive.writestr("texts/", "")
+        zip_archive.writestr("texts/first.txt", contents[0])
+        zip_archive.writestr("texts/second.txt", contents[1])
+    with tarfile.open(tmp_path / "texts.tar.gz", "w:gz") as tar_archive:
+        for name, content in [("second.txt", contents[1]), ("third.txt", contents[2])]:
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar_archive.addfile(info, io.BytesIO(data))
+    filenames = [str(tmp_path / "texts.zip"), str(tmp_path / "texts.tar.gz")]
+    loader.block_size = 1000
+
+    assert loader.bulk_import_files(filenames, batch_size=1) == (3, 0, 1, 0)
+    raw_texts = session.exec(select(RawText)).all()
+    assert [raw_text.content for raw_text in raw_texts] == contents
+    assert loader.bulk_import_files(filenames) == (0, 0, 4, 0)
+    loader.import_files(filenames)
+    assert len(session.exec(select(RawText)).all()) == 3
+
+
+def test_archive_detection(tmp_path: Path) -> None:
+    """
+    Zip and tar archives are told apart from text, compressed or not, by
+    the header of the file
+    """
+    text = b"Not an archive, though it is long enough to hold a tar header.\n" * 20
+    (tmp_path / "text.txt").write_bytes(text)
+    (tmp_path / "text.txt.gz").write_bytes(gzip.compress(text))
+    (tmp_path / "corrupt.txt.bz2").write_bytes(bz2.compress(text)[:20])
+    with tarfile.open(tmp_path / "texts.tar", "w") as tar_archive:
+        tar_archive.add(tmp_path / "text.txt", "text.txt")
+    with tarfile.open(tmp_path / "texts.tar.bz2", "w:bz2") as tar_archive:
+        tar_archive.add(tmp_path / "text.txt", "text.txt")
+    with zipfile.ZipFile(tmp_path / "texts.zip", "w") as zip_archive:
+        zip_archive.writestr("text.txt", text)
+    expected = {
+        "text.txt": False,
+        "text.txt.gz": False,
+        "corrupt.txt.bz2": False,
+        "texts.tar": True,
+        "texts.tar.bz2": True,
+        "texts.zip": True,
+    }
+    for name, archive in expected.items():
+        filename = str(tmp_path / name)
+        assert is_archive(filename, read_header(filename)) == archive
+
+
+def test_import_corrupt_compressed_textfile(
+    loader: Loader, session: Session, tmp_path: Path
+) -> None:
+    """
+    A file that cannot be decompressed is reported, and nothing is stored
+    for it, whether it is read whole or streamed
+    """
+    compressed = gzip.compress(b"Some text.\n" * 1000)
+    (tmp_path / "truncated.txt.gz").write_bytes(compressed[: len(compressed) // 2])
+    (tmp_path / "valid.txt.gz").write_bytes(compressed)
+    filenames = [str(tmp_path / "truncated.txt.gz"), str(tmp_path / "valid.txt.gz")]
+    loader.block_size = 100
+    assert loader.bulk_import_files(filenames) == (1, 0, 0, 1)
+    loader.block_size = 100000
+    assert loader.bulk_import_files(filenames) == (0, 1, 0, 1)
+    assert len(session.exec(select(RawText)).all()) == 1
@@ -0,0 +1,39 @@
+from corpusmaker.database import Database
+from corpusmaker.planner import Planner, count_words
+from sqlmodel import Session
+
+
+def test_plan_counts_tokens_and_estimates_time(
+    db_instance_scenes: Database, session: Session
+) -> None:
+    """
+    Plans count tokens for every unsummarized scene and respect the tightest limit
+    """
+    scenes = db_instance_scenes.find_scenes_without_summaries(session)
+    planner = Planner(
+        "one two three", "gpt-3.5-turbo", tokenizer=count_words, completion_tokens=10
+    )
+    contents = db_instance_scenes.iter_unsummarized_contents(session, batch_size=2)
+    plan = planner.plan(contents, 1.0, 2.0, concurrency=5, latency=10)
+
+    scene_tokens = [count_words(scene.content) + 12 for scene in scenes]
+    assert plan["requests"] == 5
+    assert plan["prompt_tokens"] == sum(scene_tokens)
+    assert plan["largest_prompt_tokens"] == max(scene_tokens)
+    assert plan["completion_tokens"] == 50
+    assert plan["cost"] == (sum(scene_tokens) * 1.0 + 50 * 2.0) / 1_000_000
+    assert plan["seconds"] == 10
+
+    limited = planner.plan([scene.content for scene in scenes], requests_per_minute=1)
+    assert limited["seconds"] == 300
+    tokens = limited["prompt_tokens"] + limited["completion_tokens"]
+    limited = planner.plan([scene.content for scene in scenes], tokens_per_minute=60)
+    assert limited["seconds"] == tokens
+
+
+def test_plan_skips_summarized_scenes(
+    db_instance_summaries: Database, session: Session
+) -> None:
+    planner = Planner("", "gpt-3.5-turbo", tokenizer=count_words)
+    plan = planner.plan(db_instance_summaries.iter_unsummarized_contents(session))
+    assert plan["requests"] == 0
@@ -0,0 +1,82 @@
+from pytest_mock import MockerFixture
+
+from corpusmaker.ratelimiter import RateLimiter
+from corpusmaker.requester import Requester
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_requests_per_minute_bucket() -> None:
+    """
+    Requests are paced once the request bucket is empty
+    """
+    clock = FakeClock()
+    limiter = RateLimiter(requests_per_minute=60, headroom=1.0, clock=clock)
+    for _ in range(60):
+        assert limiter.delay(0) == 0
+        limiter.take(0)
+    assert limiter.delay(0) == 1.0
+    clock.now = 0.5
+    assert limiter.delay(0) == 0.5
+    clock.now = 1.0
+    assert limiter.delay(0) == 0
+
+
+def test_request_bucket_smaller_than_one_request() -> None:
+    """
+    A limit whose headroom leaves less than one request still lets requests
+    through, once the bucket is full
+    """
+    clock = FakeClock()
+    limiter = RateLimiter(requests_per_minute=1, clock=clock)
+    assert limiter.delay(0) == 0
+    limiter.take(0)
+    assert limiter.delay(0) > 60
+    clock.now = limiter.delay(0)
+    assert limiter.delay(0) == 0
+
+
+def test_tokens_per_minute_bucket() -> None:
+    """
+    Token reservations are settled against actual usage
+    """
+    clock = FakeClock()
+    limiter = RateLimiter(tokens_per_minute=1000, headroom=1.0, clock=clock)
+    limiter.take(800)
+    assert limiter.delay(400) == 12.0
+    limiter.record(estimated=800, actual=500)
+    assert limiter.delay(400) == 0
+    assert limiter.delay(5000) == 30.0
+
+
+def test_estimate_tokens() -> None:
+    limiter = RateLimiter(tokens_per_minute=1000, completion_tokens=10)
+    assert limiter.estimate_tokens("x" * 400) == 111
+
+
+def test_requester_waits_and_records_usage(mocker: MockerFixture) -> None:
+    """
+    Requester reserves estimated tokens before a request and settles them after
+    """
+    limiter = RateLimiter(tokens_per_minute=100000, completion_tokens=0)
+    completion = mocker.MagicMock()
+    completion.usage.total_tokens = 7
+    completion.choices[0].message.content = "mock summary"
+    requester = Requester(
+        "system", "gpt-3.5-turbo", limiter, base_url="http://localhost"
+    )
+    mocker.patch.object(
+        requester.client.chat.completions, "create", return_value=completion
+    )
+    wait = mocker.spy(limiter, "wait")
+    record = mocker.spy(limiter, "record")
+
+    assert requester.generate_summary("x" * 40) == "mock summary"
+    wait.assert_called_once_with(12)
+    record.assert_called_once_with(12, 7)
@@ -1,4 +1,4 @@
-from pytest import fail
+from pytest import MonkeyPatch
 from corpusmaker.database import Database
 from corpusmaker.requester import Requester
 from sqlmodel import Session
@@ -28,3 +28,22 @@ def test_generate_summaries(
 
     should_be_empty_now = db_instance_scenes.find_scenes_without_summaries(session)
     assert len(should_be_empty_now) == 0
+
+
+def test_client_is_built_lazily(monkeypatch: MonkeyPatch) -> None:
+    """
+    Requesters need no API key until a request is made, and reuse their client
+    """
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    requester = Requester("mock system prompt", "gpt-3.5-turbo")
+    assert "client" not in requester.__dict__
+
+    local = Requester(
+        "mock system prompt",
+        "llama-3-8b-instruct",
+        base_url="http://localhost:8080/v1",
+        max_connections=8,
+    )
+    assert local.client is local.client
+    assert str(local.client.base_url) == "http://localhost:8080/v1/"
+    assert local.client.max_retries == 0
@@ -0,0 +1,160 @@
+from pytest_mock import MockerFixture
+
+import asyncio
+import httpx
+import multiprocessing
+import time
+from openai import RateLimitError
+from corpusmaker.cli import Cli
+from corpusmaker.database import Database
+from corpusmaker.model import SceneStatus
+from corpusmaker.requester import Requester
+from corpusmaker.summarizer import Summarizer
+from sqlmodel import Session, text
+
+
+def test_summarize_concurrently(
+    mocker: MockerFixture, summarizer: Summarizer, session: Session
+) -> None:
+    """
+    Summaries are requested concurrently without exceeding the concurrency limit
+    """
+    in_flight = 0
+    most_in_flight = 0
+
+    async def fake_summary(content: str) -> str:
+        nonlocal in_flight, most_in_flight
+        in_flight += 1
+        most_in_flight = max(most_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return "mock summary"
+
+    mocker.patch(
+        "corpusmaker.requester.Requester.agenerate_summary", side_effect=fake_summary
+    )
+    scenes = summarizer.db.find_scenes_without_summaries(session)
+    assert len(scenes) == 5
+    summarizer.run(session, scenes)
+
+    assert most_in_flight == summarizer.concurrency
+    assert summarizer.db.find_scenes_without_summaries(session) == []
+    for scene in summarizer.db.find_scenes_with_summaries(session):
+        assert scene.summary == "mock summary"
+
+
+def test_retry_transient_errors(
+    mocker: MockerFixture, summarizer: Summarizer, session: Session
+) -> None:
+    """
+    Transient API errors are retried with backoff and counted as attempts
+    """
+    calls = 0
+
+    async def flaky_summary(content: str) -> str:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            request = httpx.Request(
+                "POST", "https://api.openai.com/v1/chat/completions"
+            )
+            response = httpx.Response(429, request=request)
+            raise RateLimitError("Rate limit reached", response=response, body=None)
+        await asyncio.sleep(0)
+        return "mock summary"
+
+    mocker.patch(
+        "corpusmaker.requester.Requester.agenerate_summary", side_effect=flaky_summary
+    )
+    summarizer.backoff_base = 0
+    scenes = summarizer.db.find_scenes_without_summaries(session)
+    summarizer.run(session, scenes)
+
+    assert summarizer.db.find_scenes_without_summaries(session) == []
+    scene = summarizer.db.read_scene(session, 1)
+    assert scene.status == SceneStatus.DONE
+    assert scene.attempts == 2
+    assert "Rate limit reached" in scene.last_error
+
+
+def test_failed_scenes_are_kept_for_retry(
+    mocker: MockerFixture, summarizer: Summarizer, session: Session
+) -> None:
+    """
+    A scene that fails does not stop the run, and is skipped until it is retried
+    """
+    scenes = summarizer.db.find_scenes_without_summaries(session)
+    failing_content = scenes[2].content
+
+    async def failing_summary(content: str) -> str:
+        await asyncio.sleep(0)
+        if content == failing_content:
+            raise Exception("Invalid request")
+        return "mock summary"
+
+    mocker.patch(
+        "corpusmaker.requester.Requester.agenerate_summary",
+        side_effect=failing_summary,
+    )
+    summarizer.run(session, scenes)
+
+    assert summarizer.db.find_scenes_without_summaries(session) == []
+    failed = summarizer.db.find_failed_scenes(session)
+    assert [scene.id for scene in failed] == [scenes[2].id]
+    assert failed[0].attempts == 1
+    assert "Invalid request" in failed[0].last_error
+
+    mocker.patch(
+        "corpusmaker.requester.Requester.agenerate_summary",
+        return_value="mock summary",
+    )
+    summarizer.run(session, failed)
+    assert summarizer.db.find_failed_scenes(session) == []
+    assert len(summarizer.db.find_scenes_with_summaries(session)) == 5
+
+
+def summarize_with_lease(db_file: str, owner: str) -> None:
+    """
+    Run one summarizer worker process against a shared database
+    """
+
+    def slow_summary(content: str) -> str:
+        time.sleep(0.05)
+        return f"summary by {owner}"
+
+    db = Database(db_file)
+    requester = Requester("mock system prompt", "gpt-3.5-turbo")
+    setattr(requester, "generate_summary", slow_summary)
+    with Session(db.engine) as session:
+        Summarizer(db, requester).run_leased(session, 2, 60, owner)
+
+
+def test_workers_share_database_with_leases(cli: Cli) -> None:
+    """
+    Several worker processes summarize every scene exactly once between them
+    """
+    cli.import_files(
+        ["tests/files/test_file_5.txt", "tests/files/test_file_2.txt"], "* * * * *"
+    )
+    cli.create_scenes()
+    with cli.db.engine.connect() as connection:
+        connection.execute(text("PRAGMA journal_mode=WAL"))
+
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=summarize_with_lease, args=(cli.db_file, f"worker {n}"))
+        for n in range(3)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+
+    with Session(cli.db.engine) as session:
+        assert cli.db.find_scenes_without_summaries(session) == []
+        scenes = cli.db.find_scenes_with_summaries(session)
+        assert len(scenes) == 10
+        for scene in scenes:
+            assert scene.attempts == 1
+            assert scene.summary == f"summary by {scene.lease_owner}"
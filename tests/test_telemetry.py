@@ -0,0 +1,121 @@
+from pytest_mock import MockerFixture
+
+from datetime import datetime, timedelta, timezone
+from hashlib import md5
+from openai.types.chat import ChatCompletion
+from corpusmaker.database import Database
+from corpusmaker.model import RequestTelemetry, Scene
+from corpusmaker.requester import Requester
+from corpusmaker.telemetry import Telemetry
+from sqlmodel import Session, select
+
+
+def make_completion(prompt_tokens: int, completion_tokens: int) -> ChatCompletion:
+    return ChatCompletion.model_validate(
+        {
+            "id": "chatcmpl-1",
+            "object": "chat.completion",
+            "created": 1711000000,
+            "model": "gpt-3.5-turbo-0125",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "mock summary"},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+    )
+
+
+def test_requests_are_recorded(
+    mocker: MockerFixture, db_instance_scenes: Database, session: Session
+) -> None:
+    """
+    Usage, latency and finish reason are recorded for each response
+    """
+    telemetry = Telemetry(db_instance_scenes)
+    requester = Requester(
+        "mock system prompt",
+        "gpt-3.5-turbo",
+        telemetry=telemetry,
+        base_url="http://localhost",
+    )
+    mocker.patch.object(
+        requester.client.chat.completions,
+        "create",
+        return_value=make_completion(100, 20),
+    )
+    assert requester.generate_summary("Scene 1") == "mock summary"
+    telemetry.flush()
+
+    record = session.exec(select(RequestTelemetry)).one()
+    assert record.checksum == md5("Scene 1".encode("utf-8")).hexdigest()
+    assert record.model == "gpt-3.5-turbo-0125"
+    assert record.prompt_tokens == 100
+    assert record.completion_tokens == 20
+    assert record.finish_reason == "stop"
+    assert record.latency >= 0
+
+
+def test_stats(db_instance_scenes: Database, session: Session) -> None:
+    """
+    Stats report throughput, latency percentiles, cost and time remaining
+    """
+    start = datetime(2024, 3, 1, tzinfo=timezone.utc)
+    for n in range(10):
+        session.add(
+            RequestTelemetry(
+                checksum=str(n),
+                model="gpt-3.5-turbo-0125",
+                prompt_tokens=1000,
+                completion_tokens=100,
+                latency=n + 1,
+                created_at=start + timedelta(seconds=10 * n),
+            )
+        )
+    session.commit()
+    stats = Telemetry(db_instance_scenes).stats(session, 0.5, 1.5)
+    assert stats["requests"] == 10
+    assert stats["tokens_per_second"] == 11000 / 55
+    assert stats["latency_p50"] == 5.5
+    assert round(stats["latency_p95"], 2) == 9.55
+    assert stats["cost"] == (10000 * 0.5 + 1000 * 1.5) / 1_000_000
+    assert stats["remaining_scenes"] == 5
+    assert stats["eta_seconds"] == 5 * 55 / 10
+
+
+def test_stats_ignore_idle_time_and_duplicates(
+    db_instance_scenes: Database, session: Session
+) -> None:
+    """
+    Concurrent requests are timed once, the time between runs is not counted,
+    and scenes marked as duplicates are not counted as remaining
+    """
+    start = datetime(2024, 3, 1, tzinfo=timezone.utc)
+    for run in range(2):
+        for n in range(4):
+            session.add(
+                RequestTelemetry(
+                    checksum=f"{run}-{n}",
+                    model="gpt-3.5-turbo-0125",
+                    prompt_tokens=100,
+                    completion_tokens=10,
+                    latency=4,
+                    created_at=start + timedelta(days=run, seconds=4 + n),
+                )
+            )
+    scene = session.exec(select(Scene)).first()
+    assert scene is not None
+    scene.duplicate_of = 2
+    session.add(scene)
+    session.commit()
+    stats = Telemetry(db_instance_scenes).stats(session)
+    assert stats["tokens_per_second"] == 880 / 14
+    assert stats["remaining_scenes"] == 4
+    assert stats["eta_seconds"] == 4 * 14 / 8
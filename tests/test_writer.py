@@ -0,0 +1,67 @@
+from pytest_mock import MockerFixture
+
+import pytest
+from corpusmaker.database import Database
+from corpusmaker.summarizer import Summarizer
+from corpusmaker.writer import SummaryWriter
+from sqlmodel import Session
+
+
+def test_write_summaries_in_batches(
+    mocker: MockerFixture, db_instance_scenes: Database, session: Session
+) -> None:
+    """
+    Summaries are stored together once a batch fills up
+    """
+    update_summaries = mocker.spy(db_instance_scenes, "update_summaries")
+    writer = SummaryWriter(db_instance_scenes, session, batch_size=3, interval=60)
+    writer.add(1, "a", "summary 1", 1)
+    writer.add(2, "b", "summary 2", 1)
+    assert db_instance_scenes.find_scenes_with_summaries(session) == []
+
+    writer.add(3, "c", "summary 3", 2)
+    update_summaries.assert_called_once()
+    scenes = db_instance_scenes.find_scenes_with_summaries(session)
+    assert [scene.summary for scene in scenes] == [
+        "summary 1",
+        "summary 2",
+        "summary 3",
+    ]
+    assert [scene.attempts for scene in scenes] == [1, 1, 2]
+
+
+def test_write_summaries_after_interval(
+    db_instance_scenes: Database, session: Session
+) -> None:
+    """
+    Summaries are stored once the flush interval has passed, however few there are
+    """
+    writer = SummaryWriter(db_instance_scenes, session, batch_size=100, interval=0)
+    writer.add(1, "a", "summary 1", 1)
+    assert len(db_instance_scenes.find_scenes_with_summaries(session)) == 1
+
+
+def test_flush_summaries_on_interrupt(
+    mocker: MockerFixture, summarizer: Summarizer, session: Session
+) -> None:
+    """
+    Summaries waiting to be written are stored when the run is interrupted
+    """
+    summaries = iter(["summary 1", "summary 2", "summary 3"])
+
+    def interrupted_summary(content: str) -> str:
+        for summary in summaries:
+            return summary
+        raise KeyboardInterrupt
+
+    mocker.patch(
+        "corpusmaker.requester.Requester.generate_summary",
+        side_effect=interrupted_summary,
+    )
+    summarizer.concurrency = 1
+    summarizer.flush_interval = 60
+    scenes = summarizer.db.find_scenes_without_summaries(session)
+    with pytest.raises(KeyboardInterrupt):
+        summarizer.run(session, scenes)
+    assert len(summarizer.db.find_scenes_with_summaries(session)) == 3
+    assert len(summarizer.db.find_scenes_without_summaries(session)) == 2